@@ -0,0 +1,665 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import Crypto_Data_Engine as engine
+import Crypto_Data_Final as app
+import Crypto_Data_Watchlist as watchlists
+
+"""
+
+Benchmarks for the query engine in Crypto_Data_Engine.py and the user
+store in Crypto_Data_Final.py. Each data benchmark runs against a
+synthetic CSV in the same layout as extendedTradeData.csv, so the
+numbers can be reproduced on any machine without the real export.
+
+"""
+
+# Defines the shape of the generated data, modelled on extendedTradeData.csv: stablecoins dominate the bought tokens,
+# a few wallets make most of the trades, and about a fifth of the rows are the mirrored second leg of a swap
+BENCHMARK_DIR = "benchmark_data"
+GENERATOR_VERSION = 2
+DEFAULT_ROWS = 10_000_000
+CHUNK_ROWS = 1_000_000
+TOKEN_WEIGHTS = {"USDC": 36, "USDT": 27, "WETH": 10, "wstETH": 8, "USDe": 4, "WBTC": 4, "stETH": 4, "sUSDe": 2,
+                 "DAI": 1, "ETH": 1, "weETH": 1, "aEthUSDT": 1, "LBTC": 1}
+TOKENS = list(TOKEN_WEIGHTS)
+WALLETS_PER_ROW = 0.05
+MAX_WALLETS = 2_000_000
+WALLET_SKEW = 3.0
+SWAP_LEG_SHARE = 0.18
+TRADE_VALUE_LOG_MEAN = 15.6
+TRADE_VALUE_LOG_SIGMA = 0.5
+START_TIME = pd.Timestamp("2025-03-01")
+TIME_SPAN_SECONDS = 30 * 24 * 60 * 60
+RESULT_COUNT = 99
+HEX_CHARS = np.frombuffer(b"0123456789abcdef", dtype="S1")
+
+# Sets up the hot path harness: the sizes it runs at, where results and the baseline are kept, and how much slower
+# or bigger a path may get before it counts as a regression. Run-to-run noise on a busy machine reaches about 30%,
+# so the tolerance sits above that and small absolute changes are ignored
+HOT_PATH_SIZES = [10 ** power for power in range(3, 9)]
+LARGE_SIZE = 1_000_000
+RESULTS_FILE = os.path.join(BENCHMARK_DIR, "hot_paths.json")
+BASELINE_FILE = "benchmark_baseline.json"
+SAVE_BASELINE = False
+REGRESSION_TOLERANCE = 0.5
+MIN_REGRESSION_SECONDS = 0.005
+MIN_REGRESSION_MB = 1.0
+LOGIN_ATTEMPTS = 1000
+LOGIN_PASSWORD = "benchmark-pass1!"
+VISIBLE_ROWS = 25
+
+# Sets up the sharded load benchmark: a month of daily exports, loaded with each worker count
+SHARD_DAYS = 30
+SHARD_WORKER_COUNTS = (1, 2, 4, 8)
+
+# Sets the smallest file the SQLite results are checked against the in-memory engine on, several streaming chunks long
+# so swap legs split across chunks are covered
+SQL_PARITY_ROWS = 3 * engine.STREAM_CHUNK_ROWS
+
+# Sets the fewest streaming chunks the smallest file of the streaming benchmark is read in
+STREAMING_MIN_CHUNKS = 3
+
+# Sets up the watchlist benchmark: list sizes (a few real wallets padded with random addresses) and the batch size matched
+WATCHLIST_SIZES = (1_000, 100_000, 500_000)
+WATCHLIST_REAL_WALLETS = 200
+
+# Builds an array of random "0x..." hex strings with the given number of bytes, kept as bytes until they are written
+def random_hex(rng, count, num_bytes):
+    raw = rng.integers(0, 256, size=(count, num_bytes), dtype=np.uint8)
+    chars = np.empty((count, 2 + 2 * num_bytes), dtype="S1")
+    chars[:, 0] = b"0"
+    chars[:, 1] = b"x"
+    chars[:, 2::2] = HEX_CHARS[raw >> 4]
+    chars[:, 3::2] = HEX_CHARS[raw & 15]
+    return chars.view(f"S{2 + 2 * num_bytes}").ravel()
+
+# Writes a CSV of synthetic trades in the extendedTradeData.csv layout, one chunk at a time.
+# The output depends only on rows and seed, so every machine benchmarks the same file
+def generate_trades_csv(path, rows, seed=0, chunk_rows=CHUNK_ROWS, start_time=START_TIME, time_span=TIME_SPAN_SECONDS):
+    rng = np.random.default_rng(seed)
+    wallets = random_hex(rng, min(MAX_WALLETS, max(1, int(rows * WALLETS_PER_ROW))), 20)
+    tokens = np.array(TOKENS)
+    weights = np.array(list(TOKEN_WEIGHTS.values()), dtype="float64")
+    weights /= weights.sum()
+
+    with open(path, 'w') as file:
+        file.write(",".join(engine.DATA_COLUMNS) + "\n")
+        for start in range(0, rows, chunk_rows):
+            count = min(chunk_rows, rows - start)
+            legs = int(count * SWAP_LEG_SHARE) if count > 1 else 0
+            trades = count - legs
+            bought = rng.choice(len(tokens), size=trades, p=weights)
+            sold = rng.choice(len(tokens), size=trades, p=weights)
+            sold = np.where(sold == bought, (sold + 1) % len(tokens), sold)
+            seconds = rng.integers(0, time_span, size=trades)
+            chunk = pd.DataFrame({
+                "trader_wallet": wallets[(len(wallets) * rng.random(trades) ** WALLET_SKEW).astype(np.int64)].astype("U"),
+                "token_bought": tokens[bought],
+                "token_sold": tokens[sold],
+                "trade_value_usd": np.round(rng.lognormal(TRADE_VALUE_LOG_MEAN, TRADE_VALUE_LOG_SIGMA, size=trades), 2),
+                "timestamp": (start_time + pd.to_timedelta(seconds, unit="s")).strftime(engine.TIMESTAMP_FORMAT),
+                "tx_hash": random_hex(rng, trades, 32).astype("U"),
+            })
+
+            # Copies some trades as their mirrored leg (same tx hash, bought and sold swapped) and shuffles them in
+            mirrored = chunk.iloc[rng.permutation(trades)[:legs]].rename(columns={"token_bought": "token_sold", "token_sold": "token_bought"})
+            chunk = pd.concat([chunk, mirrored[engine.DATA_COLUMNS]], ignore_index=True)
+            chunk.iloc[rng.permutation(count)].to_csv(file, header=False, index=False)
+    return path
+
+# Runs a function once and returns its result along with the seconds it took
+def time_call(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+# Returns the path of a generated CSV with the given number of rows, creating it if needed
+def benchmark_csv(rows):
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    path = os.path.join(BENCHMARK_DIR, f"trades_{rows}_v{GENERATOR_VERSION}.csv")
+    if not os.path.exists(path):
+        print(f"Generating {rows:,} rows into {path}...")
+        _, seconds = time_call(generate_trades_csv, path, rows)
+        print(f"  generated in {seconds:.2f}s")
+    return path
+
+# Loads a generated CSV through the app's loader so benchmarks run against the same typed frame as the GUI
+def load_benchmark_data(rows):
+    engine.CSV_FILE = benchmark_csv(rows)
+    return engine.load_data()
+
+# Runs a function a number of times and returns the average seconds per call
+def average_time(function, repeats, *args, **kwargs):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function(*args, **kwargs)
+    return (time.perf_counter() - start) / repeats
+
+# Compares parsing the CSV text against loading the binary cache written after the first parse
+def benchmark_cache(rows):
+    engine.CSV_FILE = benchmark_csv(rows)
+    shutil.rmtree(engine.cache_dir_for(engine.CSV_FILE), ignore_errors=True)
+
+    _, cold = time_call(engine.load_data, use_cache=False)
+    _, first = time_call(engine.load_data)
+    df, warm = time_call(engine.load_data)
+
+    print(f"Startup load of {len(df):,} rows")
+    print(f"  cold CSV parse:          {cold:.2f}s")
+    print(f"  parse + cache write:     {first:.2f}s")
+    print(f"  warm cache (mmap) load:  {warm:.2f}s ({cold / warm:.1f}x faster)")
+
+# Compares a full sort_values per "Load Data" click against reading the top-k off the prebuilt sort indexes
+def benchmark_sort_index(rows, k=RESULT_COUNT, repeats=5):
+    df = load_benchmark_data(rows)
+    sort_indexes, build = time_call(engine.build_sort_indexes, df)
+
+    print(f"Top {k} of {len(df):,} rows (index build: {build:.2f}s)")
+    for choice in engine.SORT_CHOICES:
+        sort_col, order = choice.split()
+        ascending = (order == "ASC")
+        full_sort = average_time(lambda: df.sort_values(by=sort_col, ascending=ascending).head(k), repeats)
+        indexed = average_time(lambda: df.iloc[sort_indexes[sort_col].top_k(k, ascending)], repeats)
+        print(f"  {choice:<22} sort_values {full_sort * 1000:9.2f}ms   index {indexed * 1000:7.3f}ms   ({full_sort / indexed:.0f}x)")
+
+# Compares full-sort and argpartition top-k selection on a filtered subset, where no prebuilt index applies
+def benchmark_top_k(rows, repeats=5):
+    df = load_benchmark_data(rows)
+    subset = df[df["token_bought"].isin(["USDC", "USDT", "DAI"])]
+
+    print(f"Top-k over a filtered subset of {len(subset):,} rows")
+    for sort_col in engine.SORT_COLUMNS:
+        values = subset[sort_col]
+        for k in (10, RESULT_COUNT, 10_000):
+            timings = {strategy: average_time(engine.select_top_k, repeats, values, k, False, strategy)
+                       for strategy in ("sort", "partition")}
+            print(f"  {sort_col:<16} k={k:<6} sort {timings['sort'] * 1000:8.2f}ms   "
+                  f"partition {timings['partition'] * 1000:8.2f}ms   ({timings['sort'] / timings['partition']:.1f}x)")
+
+# Streams a file in a fresh interpreter and returns its peak RSS in MB. ru_maxrss is carried over from the process
+# that started the interpreter (this one, holding generated data), so on Linux the high-water mark of the new
+# interpreter's own memory (VmHWM, reset by exec) is read instead
+def streaming_peak_rss(path):
+    code = ("import os, resource, sys, Crypto_Data_Engine as engine; "
+            "engine.stream_query(sys.argv[1], 'trade_value_usd', False, 99); "
+            "status = open('/proc/self/status').read() if os.path.exists('/proc/self/status') else ''; "
+            "peak = [line.split()[1] for line in status.splitlines() if line.startswith('VmHWM:')]; "
+            "print(peak[0] if peak else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")
+    output = subprocess.run([sys.executable, "-c", code, path], check=True, capture_output=True, text=True).stdout
+    return int(output.split()[-1]) / 1024
+
+# Checks that streaming keeps peak memory roughly flat as the file grows 4x, and fails if it grows with the file.
+# Every file is at least STREAMING_MIN_CHUNKS chunks long, so a file read in one chunk is never the baseline
+def benchmark_streaming(rows, max_growth=1.5):
+    smallest = max(rows // 4, STREAMING_MIN_CHUNKS * engine.STREAM_CHUNK_ROWS)
+    sizes = (smallest, smallest * 2, smallest * 4)
+    # Every file is generated before the first measurement, so generating one never overlaps a measured run
+    paths = [benchmark_csv(size) for size in sizes]
+    peaks = []
+    for size, path in zip(sizes, paths):
+        peak, seconds = time_call(streaming_peak_rss, path)
+        peaks.append(peak)
+        print(f"  {size:>12,} rows  {os.path.getsize(path) / 1024 ** 3:6.2f} GB file  peak RSS {peak:8.1f} MB  ({seconds:.1f}s)")
+    if peaks[-1] > peaks[0] * max_growth:
+        raise SystemExit(f"Streaming peak RSS grew from {peaks[0]:.0f} MB to {peaks[-1]:.0f} MB as the file grew 4x")
+    print(f"Streaming peak RSS stayed within {max_growth}x while the file grew 4x")
+
+# Times building the per-wallet leaderboard over the whole frame
+def benchmark_wallets(rows):
+    df = load_benchmark_data(rows)
+    stats, seconds = time_call(engine.compute_wallet_stats, df)
+    print(f"Wallet stats for {len(stats):,} wallets over {len(df):,} trades: {seconds:.2f}s")
+
+# Times thousands of tx hash and wallet lookups against a scan of the frame, and reports the index memory
+def benchmark_lookups(rows, lookups=5000):
+    df = load_benchmark_data(rows)
+    posting_indexes, build = time_call(engine.build_posting_indexes, df)
+    rng = np.random.default_rng(1)
+    values = np.concatenate((df["tx_hash"].to_numpy()[rng.integers(0, len(df), lookups // 2)],
+                             df["trader_wallet"].to_numpy()[rng.integers(0, len(df), lookups // 2)])).astype(str)
+
+    indexed = average_time(lambda: [engine.lookup_rows(posting_indexes, value) for value in values], 1) / len(values)
+    scan = average_time(lambda: [np.flatnonzero(df["tx_hash"] == value) for value in values[:5]], 1) / 5
+    print(f"Lookups over {len(df):,} trades (index build {build:.2f}s, {engine.index_memory(posting_indexes):.1f} MB)")
+    print(f"  hash index  {indexed * 1e6:10.1f} µs per lookup")
+    print(f"  full scan   {scan * 1e6:10.1f} µs per lookup ({scan / indexed:.0f}x slower)")
+
+# Times swap leg pairing as a share of loading the same file
+def benchmark_pairing(rows):
+    engine.CSV_FILE = benchmark_csv(rows)
+    _, parse = time_call(engine.load_data, use_cache=False)
+    df, warm = time_call(engine.load_data)
+    partners, pairing = time_call(engine.find_swap_partners, df)
+    print(f"Swap leg pairing over {len(df):,} trades ({int((partners >= 0).sum()):,} legs paired): {pairing:.2f}s")
+    print(f"  {pairing / parse:.0%} of a CSV parse ({parse:.2f}s), {pairing / warm:.0%} of a warm cache load ({warm:.2f}s)")
+
+# Writes a users.json with the given number of accounts, all sharing one password so logins can be checked.
+# The password has to pass the app's own signup rules, so the accounts are ones the app could have created
+def generate_users_json(path, users, password=LOGIN_PASSWORD):
+    valid, error = app.validate_password(password)
+    if not valid:
+        raise SystemExit(f"The benchmark password is not one the app accepts: {error}")
+    password_hash = app.hash_password(password)
+    app.save_user_data({f"user{i}": {"password": password_hash, "name": f"User {i}"} for i in range(users)}, path)
+    return path
+
+# Compares login throughput on the whole-file JSON store against the SQLite store migrated from the same file
+def benchmark_login(rows, logins=2000):
+    users = max(1000, rows // 100)
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    json_path = generate_users_json(os.path.join(BENCHMARK_DIR, f"users_{users}.json"), users)
+    db_path = os.path.join(BENCHMARK_DIR, f"users_{users}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+    sqlite_store, migrate = time_call(app.SqliteUserStore, db_path, json_path)
+    stores = {"json": app.JsonUserStore(json_path), "sqlite": sqlite_store}
+    names = [f"user{i}" for i in np.random.default_rng(2).integers(0, users, logins)]
+
+    print(f"Logins against {users:,} accounts (users.json {os.path.getsize(json_path) / 1024 ** 2:.1f} MB, migration {migrate:.2f}s)")
+    rates = {}
+    for label, store in stores.items():
+        app.user_store = store
+        count = logins if label == "sqlite" else min(logins, 50)
+        seconds = average_time(lambda: [app.login_user(name, LOGIN_PASSWORD) for name in names[:count]], 1)
+        if app.login_user(names[0], LOGIN_PASSWORD) != f"User {names[0][4:]}":
+            raise SystemExit(f"The {label} store rejected a valid login")
+        rates[label] = count / seconds
+        print(f"  {label:<7} {rates[label]:12,.0f} logins/s")
+    print(f"  SQLite is {rates['sqlite'] / rates['json']:.0f}x faster")
+    app.user_store = None
+    sqlite_store.close()
+
+# Imports the GUI module in a fresh interpreter, returning how long that took, which heavy modules came with it,
+# and how long the deferred imports of NumPy, pandas and the engine took afterwards
+def startup_import_time():
+    code = ("import sys, time; start = time.perf_counter(); import Crypto_Data_Final as app; "
+            "seconds = time.perf_counter() - start; eager = [name for name in app.LAZY_MODULES if name in sys.modules]; "
+            "start = time.perf_counter(); app.import_engine(); print(seconds, time.perf_counter() - start, *eager)")
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout.split()
+    return float(output[0]), float(output[1]), output[2:]
+
+# Times the imports the login window waits on, and fails if NumPy, pandas or the engine are imported before they are needed
+def benchmark_startup(rows, repeats=5):
+    timings = [startup_import_time() for _ in range(repeats)]
+    seconds = min(timing[0] for timing in timings)
+    deferred = min(timing[1] for timing in timings)
+    eager = sorted({name for *_, names in timings for name in names})
+    print(f"Imports before the login window:           {seconds * 1000:6.0f} ms (best of {repeats})")
+    print(f"Imports deferred to the prefetch thread:   {deferred * 1000:6.0f} ms")
+    if eager:
+        raise SystemExit(f"Imported at startup instead of on first use: {', '.join(eager)}")
+
+# Returns the best wall time of a function over a few runs, and the peak memory it allocated (NumPy and pandas buffers
+# included) from one more run under tracemalloc, which is kept apart because tracing slows the timed runs down
+def measure(function, repeats):
+    gc.collect()
+    seconds = min(time_call(function)[1] for _ in range(repeats))
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return seconds, peak / 1024 ** 2
+
+# Returns a SQLite user store with one account per hundred trades (at least a thousand), migrated from a generated users.json
+def benchmark_user_store(rows):
+    users = max(1000, rows // 100)
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    json_path = os.path.join(BENCHMARK_DIR, f"users_{users}.json")
+    if not os.path.exists(json_path):
+        generate_users_json(json_path, users)
+    return app.SqliteUserStore(os.path.join(BENCHMARK_DIR, f"users_{users}.db"), json_path), users
+
+# Sets up one data size and returns the GUI's hot paths at that size as name -> function, each doing what one click does
+def hot_paths(rows):
+    path = benchmark_csv(rows)
+    engine.load_data(csv_file=path)
+    trades = engine.TradeEngine("csv", path).load()
+    clauses = engine.parse_filter("token_bought=USDC,USDT; trade_value_usd=5000000..")
+    full_result = trades.query("trades", "trade_value_usd", False, app.TABLE_MAX_RESULTS)
+    store, users = benchmark_user_store(rows)
+    names = [f"user{i}" for i in np.random.default_rng(2).integers(0, users, LOGIN_ATTEMPTS)]
+
+    def table_fill(frame, visible_rows):
+        return app.format_rows([frame[col].to_numpy() for col in engine.DATA_COLUMNS], 0, visible_rows)
+
+    def login():
+        app.user_store = store
+        if not all(app.login_user(name, LOGIN_PASSWORD) for name in names):
+            raise SystemExit("The user store rejected a valid login")
+
+    return {
+        "load_data_csv": lambda: engine.load_data(use_cache=False, csv_file=path),
+        "load_data_cache": lambda: engine.load_data(csv_file=path),
+        "load_dataset": lambda: engine.load_dataset("csv", path),
+        # The default view is answered from the running aggregates, so the sort index is also timed on its own
+        "sort": lambda: engine.run_query(trades.df, trades.sort_indexes, "trade_value_usd", False, RESULT_COUNT),
+        "sort_aggregates": lambda: trades.query("trades", "trade_value_usd", False, RESULT_COUNT),
+        "filtered_sort": lambda: trades.query("trades", "timestamp", True, RESULT_COUNT, clauses),
+        "wallet_stats": lambda: engine.compute_wallet_stats(trades.df),
+        "stream_query": lambda: engine.stream_query(path, "trade_value_usd", False, RESULT_COUNT),
+        "key_transaction": lambda: table_fill(trades.key_transaction(), 1),
+        "table_fill": lambda: table_fill(full_result, VISIBLE_ROWS),
+        "login": login,
+    }
+
+# Describes the machine and library versions the results were recorded with
+def machine_info():
+    return {"platform": platform.platform(), "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(), "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__}
+
+# Returns a message for every path that got slower or bigger than the baseline allows, at the sizes both runs cover
+def find_regressions(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    recorded = {(result["path"], result["rows"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = recorded.get((result["path"], result["rows"]))
+        if before is None:
+            continue
+        for metric, slack, unit in (("seconds", MIN_REGRESSION_SECONDS, "s"), ("peak_mb", MIN_REGRESSION_MB, " MB")):
+            if result[metric] > before[metric] * (1 + tolerance) + slack:
+                regressions.append(f"{result['path']} at {result['rows']:,} rows: {metric} {before[metric]:.3f}{unit} -> "
+                                   f"{result[metric]:.3f}{unit} ({result[metric] / max(before[metric], 1e-9):.1f}x)")
+    return regressions
+
+# Runs every hot path at every size up to rows, writes the timings and peak memory as JSON,
+# and fails if any of them regressed against the stored baseline (or stores them as the new baseline)
+def benchmark_hot_paths(rows):
+    app.import_engine()
+    results = []
+    print(f"{'rows':>12}  {'hot path':<16} {'time':>12} {'peak memory':>14}")
+    for size in [size for size in HOT_PATH_SIZES if size <= rows]:
+        repeats = 5 if size <= LARGE_SIZE else 1
+        for name, function in hot_paths(size).items():
+            seconds, peak_mb = measure(function, repeats)
+            results.append({"path": name, "rows": size, "seconds": round(seconds, 6), "peak_mb": round(peak_mb, 3)})
+            print(f"{size:>12,}  {name:<16} {seconds * 1000:9.2f} ms {peak_mb:11.1f} MB")
+    app.user_store = None
+
+    report = {"machine": machine_info(), "generator_version": GENERATOR_VERSION, "results": results}
+    os.makedirs(os.path.dirname(RESULTS_FILE) or ".", exist_ok=True)
+    for path in [RESULTS_FILE] + ([BASELINE_FILE] if SAVE_BASELINE else []):
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=1)
+        print(f"Wrote {len(results)} results to {path}")
+    if SAVE_BASELINE:
+        return
+
+    try:
+        with open(BASELINE_FILE, 'r') as file:
+            baseline = json.load(file)
+    except FileNotFoundError:
+        print(f"No baseline at {BASELINE_FILE}; run with --save-baseline to store one")
+        return
+    if baseline.get("generator_version") != GENERATOR_VERSION:
+        raise SystemExit(f"{BASELINE_FILE} was recorded with generator version {baseline.get('generator_version')}, "
+                         f"not {GENERATOR_VERSION}; store a new baseline with --save-baseline")
+    regressions = find_regressions(results, baseline, REGRESSION_TOLERANCE)
+    if regressions:
+        raise SystemExit(f"{len(regressions)} hot path regression(s) against {BASELINE_FILE}:\n  " + "\n  ".join(regressions))
+    print(f"No regressions against {BASELINE_FILE} (tolerance {REGRESSION_TOLERANCE:.0%})")
+
+# Measures what the profiling hooks add to a call while profiling is off and while it is on
+def benchmark_profiler(rows, calls=200_000):
+    def noop():
+        pass
+
+    timed_noop = engine.profiler.timed("noop")(noop)
+    bare = average_time(noop, calls)
+    disabled = average_time(timed_noop, calls)
+    engine.profiler.enable()
+    enabled = average_time(timed_noop, calls)
+    engine.profiler.enable(False)
+    engine.profiler.reset()
+    print("Profiling hook overhead per call")
+    print(f"  disabled  {(disabled - bare) * 1e9:8.0f} ns")
+    print(f"  enabled   {(enabled - bare) * 1e9:8.0f} ns")
+
+# Returns a folder with a month of daily shard files holding the given number of rows between them, creating it if needed
+def benchmark_shards(rows, days=SHARD_DAYS):
+    folder = os.path.join(BENCHMARK_DIR, f"shards_{rows}_v{GENERATOR_VERSION}")
+    if not os.path.isdir(folder):
+        print(f"Generating {rows:,} rows as {days} daily shards into {folder}...")
+        os.makedirs(folder + ".tmp", exist_ok=True)
+        for day in range(days):
+            generate_trades_csv(os.path.join(folder + ".tmp", f"trades_{day + 1:02d}.csv"), rows // days, seed=day,
+                                start_time=START_TIME + pd.Timedelta(days=day), time_span=24 * 60 * 60)
+        os.replace(folder + ".tmp", folder)
+    return folder
+
+# Times loading a month of daily shards with 1, 2, 4 and 8 worker processes, parsing every shard from its CSV each time
+def benchmark_sharding(rows):
+    files = engine.shard_files(benchmark_shards(rows))
+    print(f"Loading {rows:,} trades from {len(files)} shards on a machine with {os.cpu_count()} CPU(s)")
+    single = None
+    for workers in SHARD_WORKER_COUNTS:
+        df, seconds = time_call(engine.load_shards, files, workers, use_cache=False)
+        single = single or seconds
+        print(f"  {workers} worker(s)  {seconds:8.2f}s  {single / seconds:5.2f}x  ({len(df):,} rows)")
+
+# Opens the in-memory engine and a freshly ingested SQLite store over the same file, timing both
+def open_sql_pair(path):
+    import Crypto_Data_Sql as sql
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(sql.db_path_for(path) + suffix):
+            os.remove(sql.db_path_for(path) + suffix)
+    memory, load = time_call(lambda: engine.TradeEngine("csv", path).load())
+    database, ingest = time_call(lambda: engine.TradeEngine("sqlite", path).load())
+    return memory, load, database, ingest
+
+# Fails unless the SQLite store holds the same rows as the in-memory engine and answers every sort choice with the same rows
+# in the same order. Wallet sums are added up in a different order in SQL, so their values may differ by a cent
+def check_sql_parity(memory, database, filter_texts=("", "token_bought=WETH,USDC")):
+    if memory.row_count() != database.row_count():
+        raise SystemExit(f"SQLite holds {database.row_count():,} trades but the in-memory engine {memory.row_count():,}")
+    for choice in engine.SORT_CHOICES + engine.WALLET_SORT_CHOICES:
+        for filter_text in filter_texts:
+            view, sort_col, ascending, num_results, clauses = engine.parse_query(choice, app.TABLE_MAX_RESULTS, filter_text,
+                                                                                 app.TABLE_MAX_RESULTS)
+            expected = memory.query(view, sort_col, ascending, num_results, clauses)
+            found = database.query(view, sort_col, ascending, num_results, clauses)
+            if view == "wallets":
+                same = expected["trader_wallet"].tolist() == found["trader_wallet"].tolist() and all(
+                    np.allclose(expected[col].to_numpy(dtype="float64"), found[col].to_numpy(dtype="float64"), rtol=1e-9, atol=0.01)
+                    for col in ("trade_count", "total_volume_usd", "mean_trade_usd", "max_trade_usd", "distinct_tokens"))
+            else:
+                same = expected.index.equals(found.index) and expected[engine.DATA_COLUMNS].equals(found[engine.DATA_COLUMNS].astype(expected[engine.DATA_COLUMNS].dtypes.to_dict()))
+            if not same:
+                raise SystemExit(f"SQLite and in-memory results differ for {choice} {filter_text}".strip())
+
+# Compares the SQLite backend with the in-memory engine: the one-off ingest against a load, then the latency of the same queries.
+# Results are checked against the in-memory engine first, on a file at least SQL_PARITY_ROWS long
+def benchmark_sql(rows, repeats=5):
+    parity_rows = max(rows, SQL_PARITY_ROWS)
+    memory, load, database, ingest = open_sql_pair(benchmark_csv(parity_rows))
+    check_sql_parity(memory, database)
+    print(f"SQLite results match the in-memory engine over {parity_rows:,} trades ({parity_rows // engine.STREAM_CHUNK_ROWS} streaming chunks)")
+    if parity_rows != rows:
+        memory, load, database, ingest = open_sql_pair(benchmark_csv(rows))
+    _, reopen = time_call(lambda: engine.TradeEngine("sqlite", database.csv_file).load())
+    print(f"SQLite backend over {rows:,} trades ({database.index_memory():.1f} MB database)")
+    print(f"  in-memory load {load:8.2f}s   ingest {ingest:8.2f}s   reopen {reopen:8.3f}s")
+
+    queries = [(choice, engine.parse_query(choice, RESULT_COUNT, filter_text)) for choice, filter_text in (
+        (engine.SORT_CHOICES[0], ""), (engine.SORT_CHOICES[3], ""),
+        (engine.SORT_CHOICES[0], "token_bought=WETH"),
+        (engine.SORT_CHOICES[2], "token_sold=USDC,USDT; trade_value_usd=10000000.."),
+        (engine.WALLET_SORT_CHOICES[0], ""))]
+    for choice, (view, sort_col, ascending, num_results, clauses) in queries:
+        in_memory = average_time(memory.query, repeats, view, sort_col, ascending, num_results, clauses)
+        pushed_down = average_time(database.query, repeats, view, sort_col, ascending, num_results, clauses)
+        label = choice + (" filtered" if clauses else "")
+        print(f"  {label:<36} in-memory {in_memory * 1000:9.2f} ms   sqlite {pushed_down * 1000:9.2f} ms")
+
+# Compares the daily partition layout with the in-memory engine: the one-off split against a load, then query latency
+# along with how many of the partitions each query had to open. Fails if a query returns other rows than the in-memory engine
+def benchmark_partitions(rows, repeats=5):
+    import Crypto_Data_Partitions as partitions
+
+    path = benchmark_csv(rows)
+    shutil.rmtree(partitions.partition_dir_for(path), ignore_errors=True)
+    memory, load = time_call(lambda: engine.TradeEngine("csv", path).load())
+    _, split = time_call(lambda: engine.TradeEngine("partitioned", path).load())
+    partitioned, reopen = time_call(lambda: engine.TradeEngine("partitioned", path).load())
+    store = partitioned.store
+    print(f"Daily partitions over {rows:,} trades ({len(store.partitions)} partitions, {store.memory_mb():.1f} MB)")
+    print(f"  in-memory load {load:8.2f}s   split {split:8.2f}s   reopen {reopen:8.3f}s")
+
+    last_day = max(partition["max_time"] for partition in store.partitions if partition["max_time"] is not None)
+    recent = pd.Timestamp(last_day - np.timedelta64(6, "D")).strftime("%d/%m/%Y")
+    for choice, filter_text in ((engine.SORT_CHOICES[2], ""), (engine.SORT_CHOICES[0], ""),
+                                (engine.SORT_CHOICES[0], f"timestamp={recent}.."),
+                                (engine.SORT_CHOICES[2], "trade_value_usd=20000000.."),
+                                (engine.WALLET_SORT_CHOICES[1], ""), (engine.WALLET_SORT_CHOICES[1], f"timestamp={recent}..")):
+        query = engine.parse_query(choice, RESULT_COUNT, filter_text)
+        # Partitions keep only their own category labels, so the values are compared rather than the categorical dtypes
+        if not memory.query(*query).astype(object).equals(partitioned.query(*query).astype(object)):
+            raise SystemExit(f"Partitioned and in-memory results differ for {choice} {filter_text}".strip())
+        in_memory = average_time(memory.query, repeats, *query)
+        store.frames.clear()
+        store.partitions_read = 0
+        cold = time_call(partitioned.query, *query)[1]
+        opened = store.partitions_read
+        warm = average_time(partitioned.query, repeats, *query)
+        label = f"{choice} {filter_text}".strip()
+        print(f"  {label:<48} in-memory {in_memory * 1000:8.2f} ms   partitioned {cold * 1000:8.2f} ms cold "
+              f"{warm * 1000:8.2f} ms warm   ({opened}/{len(store.partitions)} partitions read)")
+
+# Times folding batches of new trades into the rolling wallet windows against recomputing them from scratch,
+# and fails if the two ever disagree. The newest trades arrive shuffled, and every other batch holds only trades
+# older than the longest window, as late rows from a file that is not in time order would
+def benchmark_rolling(rows, batch_rows=1000, batches=50):
+    df = engine.pair_swap_legs(load_benchmark_data(rows)).sort_values("timestamp", kind="stable").reset_index(drop=True)
+    stale, df = df.iloc[:batch_rows * batches // 2], df.iloc[batch_rows * batches // 2:]
+    history, recent = df.iloc[:-batch_rows * batches // 2], df.iloc[-batch_rows * batches // 2:]
+    recent = recent.sample(frac=1, random_state=0)
+    arriving = pd.concat([part for first in range(0, len(recent), batch_rows)
+                          for part in (recent.iloc[first:first + batch_rows], stale.iloc[first:first + batch_rows])])
+    df = pd.concat([history, arriving])
+    rolling, build = time_call(engine.RollingWalletStats, history)
+    start = time.perf_counter()
+    for first in range(0, len(arriving), batch_rows):
+        rolling.append(arriving.iloc[first:first + batch_rows])
+    incremental = (time.perf_counter() - start) / batches
+    expected, recompute = time_call(engine.recompute_rolling_stats, df)
+
+    def by_wallet(frame):
+        return frame.sort_values("trader_wallet").reset_index(drop=True)
+    if not by_wallet(rolling.frame()).equals(by_wallet(expected)):
+        raise SystemExit("Rolling wallet stats differ from a full recompute")
+    print(f"Rolling wallet windows over {len(df):,} trades ({len(expected):,} wallets active in the longest window)")
+    print(f"  initial build {build:8.2f}s")
+    print(f"  per {batch_rows:,} trade batch  incremental {incremental * 1000:8.2f} ms   full recompute {recompute * 1000:8.2f} ms")
+    print("  incremental results match the full recompute")
+
+# Times building the token pair flows in one pass, folding batches into them against rebuilding, and finding a pair's trades
+# through the pair index against scanning both token columns; fails if the flows differ from a groupby
+def benchmark_flows(rows, batch_rows=1000, batches=50):
+    df = load_benchmark_data(rows)
+    history, arriving = df.iloc[:-batch_rows * batches], df.iloc[-batch_rows * batches:]
+    flows, build = time_call(engine.TokenPairFlows, history)
+    start = time.perf_counter()
+    for first in range(0, len(arriving), batch_rows):
+        flows.append(arriving.iloc[first:first + batch_rows], len(history) + first)
+    incremental = (time.perf_counter() - start) / batches
+    rebuilt, rebuild = time_call(engine.TokenPairFlows, df)
+
+    grouped = df.groupby(["token_bought", "token_sold"], observed=True)["trade_value_usd"].agg(["size", "sum"])
+    found = flows.frame().set_index(["token_bought", "token_sold"]).reindex(grouped.index)
+    if not (found["trade_count"].to_numpy() == grouped["size"].to_numpy()).all() or \
+            not np.allclose(found["volume_usd"].to_numpy(), grouped["sum"].round(2).to_numpy()):
+        raise SystemExit("Token pair flows differ from a groupby")
+
+    bought, sold = grouped["size"].idxmax()
+    indexed_rows, indexed = time_call(flows.rows, bought, sold)
+    scanned_rows, scanned = time_call(lambda: np.flatnonzero(((df["token_bought"] == bought) & (df["token_sold"] == sold)).to_numpy()))
+    if not np.array_equal(indexed_rows, scanned_rows):
+        raise SystemExit("The pair index found different trades than a scan")
+    print(f"Token pair flows over {len(df):,} trades ({len(flows.tokens)} tokens, {len(grouped):,} pairs)")
+    print(f"  build {build * 1000:8.2f} ms   per {batch_rows:,} trade batch  incremental {incremental * 1000:8.2f} ms   rebuild {rebuild * 1000:8.2f} ms")
+    print(f"  {bought} -> {sold} ({len(indexed_rows):,} trades)  index {indexed * 1e6:8.1f} µs   scan {scanned * 1e6:8.1f} µs")
+    print("  flows match a groupby")
+
+# Times matching batches of new trades against watchlists of growing size, with and without the Bloom prefilter,
+# and fails if a match differs from checking every row against a Python set
+def benchmark_watchlist(rows, batch_rows=1000, batches=50):
+    df = load_benchmark_data(rows)
+    rng = np.random.default_rng(0)
+    real = rng.choice(df["trader_wallet"].cat.categories.to_numpy(), WATCHLIST_REAL_WALLETS, replace=False)
+    arriving = df.iloc[-batch_rows * batches:]
+    # Appended batches arrive with only their own wallets as categories, as CsvTail reads them
+    batch_list = [arriving.iloc[first:first + batch_rows].assign(trader_wallet=lambda batch: engine.categorize(batch["trader_wallet"].astype(object)))
+                  for first in range(0, len(arriving), batch_rows)]
+    print(f"Watchlist matching, {batch_rows:,} trade batches from {len(df):,} trades")
+    for size in WATCHLIST_SIZES:
+        addresses = np.concatenate((real, random_hex(rng, size - len(real), 20).astype(str)))
+        expected = set(addresses)
+        for bloom in (False, True):
+            watchlist, build = time_call(watchlists.Watchlist, addresses, bloom)
+            latencies, matches = [], 0
+            for batch in batch_list:
+                matched, seconds = watchlist.check_batch(batch)
+                if not matched.index.equals(batch.index[[wallet in expected for wallet in batch["trader_wallet"]]]):
+                    raise SystemExit("Watchlist matches differ from a Python set")
+                latencies.append(seconds)
+                matches += len(matched)
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+            print(f"  {size:>9,} addresses  bloom {'on ' if bloom else 'off'}  build {build:6.2f}s  {watchlist.memory_mb():6.1f} MB  "
+                  f"per batch p50 {p50:6.2f} ms  p99 {p99:6.2f} ms  ({matches:,} matches)")
+    print("  matches agree with a Python set")
+
+BENCHMARKS = {
+    "cache": benchmark_cache,
+    "sort_index": benchmark_sort_index,
+    "top_k": benchmark_top_k,
+    "streaming": benchmark_streaming,
+    "wallets": benchmark_wallets,
+    "lookups": benchmark_lookups,
+    "pairing": benchmark_pairing,
+    "login": benchmark_login,
+    "startup": benchmark_startup,
+    "hot_paths": benchmark_hot_paths,
+    "profiler": benchmark_profiler,
+    "sql": benchmark_sql,
+    "sharding": benchmark_sharding,
+    "partitions": benchmark_partitions,
+    "rolling": benchmark_rolling,
+    "flows": benchmark_flows,
+    "watchlist": benchmark_watchlist,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the crypto trades data viewer")
+    parser.add_argument("benchmarks", nargs="*", help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS, help="data size (hot_paths runs every power of ten up to it)")
+    parser.add_argument("--sizes", type=int, nargs="+", help="exact data sizes for hot_paths")
+    parser.add_argument("--output", default=RESULTS_FILE, help="where hot_paths writes its JSON results")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="results hot_paths is compared against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this hot_paths run as the baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE, help="slowdown allowed before failing (0.5 = 50%%)")
+    args = parser.parse_args()
+    HOT_PATH_SIZES = args.sizes or HOT_PATH_SIZES
+    RESULTS_FILE, BASELINE_FILE, SAVE_BASELINE, REGRESSION_TOLERANCE = args.output, args.baseline, args.save_baseline, args.tolerance
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+    for name in args.benchmarks or BENCHMARKS:
+        BENCHMARKS[name](args.rows)
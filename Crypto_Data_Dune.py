@@ -0,0 +1,256 @@
+import asyncio
+import json
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+
+Asynchronous client for the Dune query that V1 ran inline in its Tk
+callback. Instead of re-executing the query (and spending credits) on
+every button press, it reuses the latest stored result while it is
+fresh enough, only executes the query when it has gone stale, and polls
+the execution status with exponential backoff. Rate limits (429) and
+server errors (5xx) are retried with the same backoff.
+
+DuneStubServer mimics the Dune results endpoints on localhost, so the
+client can be exercised offline. Running this file does exactly that.
+
+"""
+
+# Defines the Dune API endpoints, the query being tracked, and how the client polls and caches it
+DUNE_API_URL = "https://api.dune.com/api/v1"
+DUNE_QUERY_ID = 4859878
+DUNE_MAX_AGE = 15 * 60
+REQUEST_TIMEOUT = 30
+POLL_INITIAL_DELAY = 1.0
+POLL_BACKOFF = 2.0
+POLL_MAX_DELAY = 30.0
+POLL_TIMEOUT = 10 * 60
+REQUEST_RETRIES = 4
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+COMPLETED_STATE = "QUERY_STATE_COMPLETED"
+FAILED_STATES = {"QUERY_STATE_FAILED", "QUERY_STATE_CANCELLED", "QUERY_STATE_EXPIRED"}
+
+class DuneError(Exception):
+    pass
+
+# A rate limit or server error, which the same request may get past after a pause (retry_after, if the API gave one)
+class DuneRetryableError(DuneError):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# Parses Dune's timestamps, which can carry nanoseconds that datetime does not accept
+def parse_dune_time(value):
+    value = re.sub(r"(\.\d{6})\d+", r"\1", value).replace("Z", "+00:00")
+    return datetime.fromisoformat(value)
+
+# Returns how many seconds ago a Dune result finished executing
+def result_age(result):
+    ended_at = result.get("execution_ended_at")
+    if not ended_at:
+        return float("inf")
+    return (datetime.now(timezone.utc) - parse_dune_time(ended_at)).total_seconds()
+
+class AsyncDuneClient:
+    def __init__(self, api_key, base_url=DUNE_API_URL, max_age=DUNE_MAX_AGE, sleep=asyncio.sleep):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.max_age = max_age
+        self.sleep = sleep
+        self.cache = {}
+
+    # Sends one blocking HTTP request and decodes the JSON reply
+    def request_sync(self, method, path):
+        request = urllib.request.Request(self.base_url + path, method=method,
+                                         headers={"X-Dune-API-Key": self.api_key})
+        try:
+            with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as error:
+            if error.code in RETRY_STATUSES:
+                retry_after = error.headers.get("Retry-After", "")
+                raise DuneRetryableError(f"Dune API returned {error.code} for {method} {path}",
+                                         float(retry_after) if retry_after.isdigit() else None) from error
+            raise DuneError(f"Dune API returned {error.code} for {method} {path}") from error
+        except urllib.error.URLError as error:
+            raise DuneError(f"Could not reach the Dune API: {error.reason}") from error
+
+    # Runs a request on a worker thread so the event loop stays free. Rate limits and server errors are retried up to
+    # REQUEST_RETRIES times, waiting as long as Retry-After asks or else backing off the way status polls do
+    async def request(self, method, path):
+        delay = POLL_INITIAL_DELAY
+        for attempt in range(REQUEST_RETRIES + 1):
+            try:
+                return await asyncio.to_thread(self.request_sync, method, path)
+            except DuneRetryableError as error:
+                if attempt == REQUEST_RETRIES:
+                    raise
+                await self.sleep(delay if error.retry_after is None else error.retry_after)
+                delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+
+    async def latest_result(self, query_id):
+        return await self.request("GET", f"/query/{query_id}/results")
+
+    async def execute(self, query_id):
+        return (await self.request("POST", f"/query/{query_id}/execute"))["execution_id"]
+
+    # Polls an execution until it completes, doubling the wait between polls up to POLL_MAX_DELAY
+    async def wait_for_execution(self, execution_id):
+        delay, waited = POLL_INITIAL_DELAY, 0.0
+        while True:
+            state = (await self.request("GET", f"/execution/{execution_id}/status"))["state"]
+            if state == COMPLETED_STATE:
+                return
+            if state in FAILED_STATES:
+                raise DuneError(f"Dune execution {execution_id} ended in {state}")
+            if waited >= POLL_TIMEOUT:
+                raise DuneError(f"Dune execution {execution_id} did not finish within {POLL_TIMEOUT}s")
+            await self.sleep(delay)
+            waited += delay
+            delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+
+    async def execution_result(self, execution_id):
+        return await self.request("GET", f"/execution/{execution_id}/results")
+
+    # Returns the query's rows, going to the network only when the cached and latest results are both too old
+    async def fetch_rows(self, query_id=DUNE_QUERY_ID, max_age=None):
+        max_age = self.max_age if max_age is None else max_age
+        cached = self.cache.get(query_id)
+        if cached is not None and time.monotonic() - cached[0] <= max_age:
+            return cached[1]
+
+        try:
+            result = await self.latest_result(query_id)
+        except DuneError:
+            result = None
+        if result is None or result.get("state") != COMPLETED_STATE or result_age(result) > max_age:
+            execution_id = await self.execute(query_id)
+            await self.wait_for_execution(execution_id)
+            result = await self.execution_result(execution_id)
+
+        rows = result["result"]["rows"]
+        self.cache[query_id] = (time.monotonic(), rows)
+        return rows
+
+# Serves canned rows through the same endpoints as the Dune API, counting every request it receives.
+# Statuses queued in failures are returned, one per request, before any request is answered normally
+class DuneStubServer:
+    def __init__(self, rows, api_key="stub-key", pending_polls=2, port=0):
+        self.rows = rows
+        self.api_key = api_key
+        self.pending_polls = pending_polls
+        self.requests = []
+        self.executions = {}
+        self.latest = None
+        self.failures = []
+        self.retry_after = None
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.make_handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/api/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Builds the result body Dune returns for a finished execution
+    def result_body(self, execution_id, query_id):
+        ended_at = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        return {"execution_id": execution_id, "query_id": query_id, "state": COMPLETED_STATE,
+                "execution_ended_at": ended_at, "result": {"rows": self.rows}}
+
+    # Works out the reply for one request as a (status, body) pair
+    def respond(self, method, path, api_key):
+        with self.lock:
+            self.requests.append((method, path))
+            if self.failures:
+                return self.failures.pop(0), {"error": "Injected failure"}
+            if api_key != self.api_key:
+                return 401, {"error": "invalid API Key"}
+
+            parts = path.strip("/").split("/")[2:]
+            if method == "POST" and len(parts) == 3 and parts[0] == "query" and parts[2] == "execute":
+                execution_id = f"stub-{len(self.executions) + 1}"
+                self.executions[execution_id] = {"query_id": int(parts[1]), "polls": 0}
+                return 200, {"execution_id": execution_id, "state": "QUERY_STATE_PENDING"}
+            if method == "GET" and len(parts) == 3 and parts[0] == "execution" and parts[1] in self.executions:
+                execution = self.executions[parts[1]]
+                if parts[2] == "status":
+                    execution["polls"] += 1
+                    done = execution["polls"] > self.pending_polls
+                    return 200, {"execution_id": parts[1], "state": COMPLETED_STATE if done else "QUERY_STATE_EXECUTING"}
+                if parts[2] == "results":
+                    self.latest = self.result_body(parts[1], execution["query_id"])
+                    return 200, self.latest
+            if method == "GET" and len(parts) == 3 and parts[0] == "query" and parts[2] == "results":
+                if self.latest is None:
+                    return 404, {"error": "No execution found"}
+                return 200, self.latest
+            return 404, {"error": "Not found"}
+
+    def make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def reply(self):
+                status, body = stub.respond(self.command, self.path, self.headers.get("X-Dune-API-Key"))
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                if status == 429 and stub.retry_after is not None:
+                    self.send_header("Retry-After", str(stub.retry_after))
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = reply
+            do_POST = reply
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+# Fetches the query twice from a local stub: the first fetch executes and polls, the second reuses the cache
+async def demo():
+    rows = [{"trader_wallet": "0xfac983fce7ef3cee8ffb2ceb967e1b2362aada00", "token_bought": "DAI",
+             "token_sold": "USDC", "trade_value_usd": 26595002.51, "timestamp": "2025-03-21 22:44:00.000 UTC",
+             "tx_hash": "0xad3d7ca2979af2446fde4359f43672619623e5daa7958f2aa8e0b3abcda3c294"}]
+
+    async def no_sleep(delay):
+        print(f"  backing off {delay:.0f}s")
+
+    with DuneStubServer(rows) as stub:
+        client = AsyncDuneClient(stub.api_key, base_url=stub.url, sleep=no_sleep)
+        print(f"First fetch: {len(await client.fetch_rows())} row(s), {len(stub.requests)} requests")
+        before = len(stub.requests)
+        print(f"Second fetch: {len(await client.fetch_rows())} row(s), {len(stub.requests) - before} requests")
+
+        fresh_client = AsyncDuneClient(stub.api_key, base_url=stub.url, sleep=no_sleep)
+        before = len(stub.requests)
+        await fresh_client.fetch_rows()
+        print(f"New client reusing the latest result: {stub.requests[before:]}")
+
+if __name__ == "__main__":
+    asyncio.run(demo())
@@ -0,0 +1,1338 @@
+import argparse
+import asyncio
+import bisect
+import glob
+import hashlib
+import heapq
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+import Crypto_Data_Profiler as profiler
+from Crypto_Data_Dune import AsyncDuneClient, DUNE_QUERY_ID
+
+"""
+
+The data side of the crypto trades viewer, with no tkinter in sight:
+loading the CSV (or the Dune query), the binary cache, the sort and
+lookup indexes, filters, top-k selection and the key transaction.
+Crypto_Data_Final.py drives it from the GUI, and running this file
+answers the same queries from the command line, streaming the results
+to stdout as CSV or JSON lines so they can be used in batch jobs.
+
+"""
+
+# Defines the data constants: the CSV file, its columns, the sort choices and the limits on a query
+CSV_FILE = "/Users/reillyturner/Desktop/FailingProject/extendedTradeData.csv"
+REQUIRED_COLUMNS = {"trader_wallet", "token_bought", "token_sold", "trade_value_usd", "timestamp", "tx_hash"}
+SORT_CHOICES = ['trade_value_usd DESC', 'trade_value_usd ASC', 'timestamp DESC', 'timestamp ASC']
+SORT_COLUMNS = list(dict.fromkeys(choice.split()[0] for choice in SORT_CHOICES))
+WALLET_SORT_CHOICES = ['wallet total_volume_usd DESC', 'wallet trade_count DESC', 'wallet max_trade_usd DESC', 'wallet last_seen DESC']
+POSTING_COLUMNS = ["token_bought", "token_sold", "trader_wallet", "tx_hash"]
+TX_HASH_LENGTH = 66
+WALLET_LENGTH = 42
+TOP_K_STRATEGIES = ("auto", "partition", "sort")
+TOP_K_STRATEGY = "auto"
+TOP_K_PARTITION_FACTOR = 10
+MIN_RESULTS = 1
+MAX_RESULTS = 99
+DATA_COLUMNS = ["trader_wallet", "token_bought", "token_sold", "trade_value_usd", "timestamp", "tx_hash"]
+WALLET_COLUMNS = ["trader_wallet", "trade_count", "total_volume_usd", "mean_trade_usd", "max_trade_usd",
+                  "distinct_tokens", "first_seen", "last_seen"]
+PAIR_BITMAP_LIMIT = 1 << 27
+AGGREGATE_TOP_N = 99
+
+# Sets the rolling wallet activity windows, counted back from the latest trade in whole buckets of ROLLING_BUCKET_SECONDS
+ROLLING_WINDOWS = {"1h": 60 * 60, "24h": 24 * 60 * 60, "7d": 7 * 24 * 60 * 60}
+ROLLING_BUCKET_SECONDS = 60
+ROLLING_COLUMNS = ["trader_wallet"] + [f"{metric}_{window}" for window in ROLLING_WINDOWS for metric in ("trades", "volume_usd")]
+PAIR_COLUMNS = ["token_bought", "token_sold", "trade_count", "volume_usd", "reverse_volume_usd"]
+PAIR_KEY_STRIDE = 1 << 32
+ROLLING_SORT_CHOICES = ['rolling volume_usd_24h DESC', 'rolling trades_24h DESC', 'rolling volume_usd_1h DESC', 'rolling volume_usd_7d DESC']
+OUTPUT_FORMATS = ("csv", "json")
+OUTPUT_CHUNK_ROWS = 10_000
+
+# Chooses where trades come from: the CSV export, the live Dune query (needs DUNE_API_KEY set),
+# "stream", which re-reads the CSV in chunks on every query for files too big to load into memory,
+# "sqlite", which ingests the CSV once into an indexed database next to it and runs every query as SQL,
+# or "partitioned", which splits the CSV once into daily partitions and reads only the days a query can need
+DATA_SOURCE = "csv"
+DATA_SOURCES = ("csv", "dune", "stream", "sqlite", "partitioned")
+STORE_SOURCES = ("sqlite", "partitioned")
+STREAM_CHUNK_ROWS = 200_000
+DUNE_API_KEY = os.environ.get("DUNE_API_KEY", "")
+dune_client = None
+
+# Chooses what happens to the two mirrored legs of one swap (same tx hash, bought/sold reversed):
+# "collapse" keeps only the first leg, "link" keeps both and records each leg's partner in pair_row, "keep" leaves them alone
+SWAP_LEG_POLICY = "collapse"
+SWAP_LEG_POLICIES = ("collapse", "link", "keep")
+# Bounds how many rows a leg read in chunks (streaming, ingest, follow) waits for its mirror, so the legs that never
+# get one do not pile up for the rest of the file. The two legs of a swap are written next to each other in the export
+SWAP_LEG_WINDOW_ROWS = 1_000_000
+
+# Sets the schema the CSV is loaded with, so the timestamp is parsed once and repeated strings are stored as categories.
+# Strings are read plain and made categories afterwards, since read_csv's category parsing was about 3x slower than a plain parse
+TIMESTAMP_FORMAT = "%d/%m/%Y %H:%M"
+CATEGORY_COLUMNS = ["trader_wallet", "token_bought", "token_sold", "tx_hash"]
+NUMERIC_DTYPES = {"trade_value_usd": "float64"}
+CSV_DTYPES = {**NUMERIC_DTYPES, **{col: "category" for col in CATEGORY_COLUMNS}}
+READ_DTYPES = NUMERIC_DTYPES
+REPORT_MEMORY = False
+
+# Lets CSV_FILE name a folder or glob of shard files (one export per day or hour), parsed in parallel worker processes.
+# Workers are spawned rather than forked, since forking a process with Tk and loader threads running is unsafe
+SHARD_PATTERN = "*.csv"
+SHARD_WORKERS = os.cpu_count() or 1
+SHARD_START_METHOD = "spawn"
+
+# Sets up the binary column cache that is written next to the CSV after the first parse
+USE_CACHE = True
+CACHE_SUFFIX = ".cache"
+CACHE_MANIFEST = "manifest.json"
+CACHE_VERSION = 2
+HASH_BLOCK_SIZE = 1 << 20
+
+# Returns how much memory a dataframe is using in megabytes
+def memory_footprint(df):
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
+
+# Converts the raw CSV columns into their typed forms
+def apply_schema(df):
+    df = df.dropna(how="all").reset_index(drop=True)
+    df["timestamp"] = parse_timestamps(df["timestamp"])
+    for col in CATEGORY_COLUMNS:
+        df[col] = categorize(df[col])
+    return df.astype(NUMERIC_DTYPES)
+
+# Stores a column as a category with the categories in first-seen order. astype("category") sorts them,
+# which for a million unique tx hashes takes several times longer than the factorize itself, and nothing needs the order
+def categorize(column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column
+    codes, uniques = pd.factorize(column)
+    return pd.Series(pd.Categorical.from_codes(codes, uniques), index=column.index, name=column.name)
+
+# Parses each distinct timestamp string once and spreads the results back over the rows,
+# since trades share minutes and a non-ISO format is parsed one string at a time
+def parse_timestamps(column):
+    column = categorize(column)
+    parsed = pd.to_datetime(column.cat.categories.astype(str), format=TIMESTAMP_FORMAT)
+    return parsed.take(column.cat.codes.to_numpy(), allow_fill=True, fill_value=pd.NaT)
+
+# Parses the CSV text into a typed dataframe
+def parse_csv(csv_file, report_memory=REPORT_MEMORY):
+    if report_memory:
+        raw_df = pd.read_csv(csv_file)
+        if not REQUIRED_COLUMNS.issubset(raw_df.columns):
+            raise ValueError("CSV file is missing required columns")
+        df = apply_schema(raw_df)
+        print(f"Memory footprint: {memory_footprint(raw_df):.2f} MB raw, {memory_footprint(df):.2f} MB typed", file=sys.stderr)
+        return df
+
+    df = pd.read_csv(csv_file, dtype=READ_DTYPES)
+    if not REQUIRED_COLUMNS.issubset(df.columns):
+        raise ValueError("CSV file is missing required columns")
+    return apply_schema(df)
+
+# Identifies the exact version of a file by its size, modification time and content hash
+def file_fingerprint(path):
+    stat = os.stat(path)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return {"version": CACHE_VERSION, "size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": digest.hexdigest()}
+
+# Returns the folder the binary cache for a CSV file is stored in
+def cache_dir_for(csv_file):
+    return csv_file + CACHE_SUFFIX
+
+# Stores category labels as one UTF-8 byte buffer plus the offset each label starts at, so any text round trips
+# and reading them back never goes through a fixed-width string array
+def write_categories(categories, path):
+    encoded = [value.encode("utf-8") for value in categories]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    np.save(path + ".offsets.npy", offsets)
+    np.save(path + ".bytes.npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+def read_categories(path):
+    offsets = np.load(path + ".offsets.npy").tolist()
+    buffer = np.load(path + ".bytes.npy", mmap_mode='r').tobytes()
+    return pd.Index([buffer[start:stop].decode("utf-8") for start, stop in zip(offsets[:-1], offsets[1:])])
+
+# Writes every column to its own .npy file, with the manifest written last so a half written cache is never used
+def write_cache(df, cache_dir, fingerprint):
+    os.makedirs(cache_dir, exist_ok=True)
+    categorical = []
+    for col in df.columns:
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(cache_dir, f"{col}.codes.npy"), values.cat.codes.to_numpy())
+            write_categories(values.cat.categories, os.path.join(cache_dir, f"{col}.categories"))
+            categorical.append(col)
+        else:
+            np.save(os.path.join(cache_dir, f"{col}.npy"), values.to_numpy())
+
+    manifest_path = os.path.join(cache_dir, CACHE_MANIFEST)
+    with open(manifest_path + ".tmp", 'w') as file:
+        json.dump({"fingerprint": fingerprint, "columns": list(df.columns), "categorical": categorical}, file)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+# Memory-maps the cached columns back into a dataframe, or returns None if the cache is missing or stale
+def read_cache(cache_dir, fingerprint):
+    try:
+        with open(os.path.join(cache_dir, CACHE_MANIFEST), 'r') as file:
+            manifest = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if manifest["fingerprint"] != fingerprint:
+        return None
+
+    columns = {}
+    for col in manifest["columns"]:
+        if col in manifest["categorical"]:
+            codes = np.load(os.path.join(cache_dir, f"{col}.codes.npy"), mmap_mode='r')
+            columns[col] = pd.Categorical.from_codes(codes, categories=read_categories(os.path.join(cache_dir, f"{col}.categories")))
+        else:
+            columns[col] = np.load(os.path.join(cache_dir, f"{col}.npy"), mmap_mode='r')
+    return pd.DataFrame(columns, copy=False)
+
+# Returns the shard files a folder or glob names, in name order so dated exports stay in date order,
+# or None if the path is a single CSV file
+def shard_files(path):
+    if os.path.isdir(path):
+        pattern = os.path.join(path, SHARD_PATTERN)
+    elif glob.has_magic(path):
+        pattern = path
+    else:
+        return None
+    files = sorted(glob.glob(pattern))
+    if not files:
+        raise ValueError(f"No CSV files match {path}")
+    return files
+
+# Loads one shard in a worker process, naming the shard in any error so a bad file among hundreds can be found
+def load_shard(csv_file, report_memory=REPORT_MEMORY, use_cache=USE_CACHE):
+    try:
+        return load_data(report_memory, use_cache, csv_file)
+    except ValueError as error:
+        raise ValueError(f"{os.path.basename(csv_file)}: {error}") from error
+
+# Loads every shard on a pool of worker processes (each with its own binary cache) and joins them in file order
+@profiler.timed()
+def load_shards(files, workers=None, report_memory=REPORT_MEMORY, use_cache=USE_CACHE):
+    workers = min(SHARD_WORKERS if workers is None else workers, len(files))
+    if workers <= 1:
+        frames = [load_shard(csv_file, report_memory, use_cache) for csv_file in files]
+    else:
+        context = multiprocessing.get_context(SHARD_START_METHOD)
+        with ProcessPoolExecutor(workers, mp_context=context) as pool:
+            frames = list(pool.map(load_shard, files, [report_memory] * len(files), [use_cache] * len(files)))
+    return concat_frames(frames)
+
+# Loads CSV, reusing the binary cache when the file has not changed since it was written.
+# A folder or glob of shard files is loaded in parallel and returned as one frame
+@profiler.timed()
+def load_data(report_memory=REPORT_MEMORY, use_cache=USE_CACHE, csv_file=None):
+    csv_file = CSV_FILE if csv_file is None else csv_file
+    files = shard_files(csv_file)
+    if files is not None:
+        return load_shards(files, report_memory=report_memory, use_cache=use_cache)
+    if not use_cache:
+        return parse_csv(csv_file, report_memory)
+
+    cache_dir = cache_dir_for(csv_file)
+    fingerprint = file_fingerprint(csv_file)
+    df = read_cache(cache_dir, fingerprint)
+    if df is not None:
+        return df
+
+    df = parse_csv(csv_file, report_memory)
+    try:
+        write_cache(df, cache_dir, fingerprint)
+    except (OSError, UnicodeError) as error:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        print(f"Could not write data cache: {error}", file=sys.stderr)
+    return df
+
+# Keeps the rows of one column in sorted order, so any ASC/DESC top-k can be read off without sorting again
+class SortIndex:
+    def __init__(self, values):
+        values = np.asarray(values)
+        self.order = np.argsort(values, kind="stable")
+        self.sorted_values = values[self.order]
+        self.valid_count = int(np.count_nonzero(~pd.isna(self.sorted_values)))
+
+    # Merges newly appended rows (numbered from first_row onwards) into the sorted order
+    def append(self, values, first_row):
+        values = np.asarray(values)
+        new_order = np.argsort(values, kind="stable")
+        new_sorted = values[new_order]
+        positions = np.searchsorted(self.sorted_values, new_sorted, side="right")
+        self.order = np.insert(self.order, positions, new_order + first_row)
+        self.sorted_values = np.insert(self.sorted_values, positions, new_sorted)
+        self.valid_count += int(np.count_nonzero(~pd.isna(new_sorted)))
+
+    # Returns the row positions of the first k rows in the same order as a stable sort_values (missing values last)
+    def top_k(self, k, ascending=True):
+        if ascending:
+            return self.order[:k]
+
+        k_valid = min(k, self.valid_count)
+        rows = self.order[:0]
+        if k_valid > 0:
+            # Walks the permutation backwards, widened to the whole group of ties at the cut-off,
+            # then puts tied rows back in their original order
+            valid_values = self.sorted_values[:self.valid_count]
+            start = np.searchsorted(valid_values, valid_values[self.valid_count - k_valid], side="left")
+            candidate_rows = self.order[start:self.valid_count]
+            candidate_values = valid_values[start:]
+            group = np.concatenate(([0], np.cumsum(candidate_values[1:] != candidate_values[:-1])))
+            rows = candidate_rows[np.argsort(-group, kind="stable")][:k_valid]
+        missing = self.order[self.valid_count:self.valid_count + (k - k_valid)]
+        return np.concatenate((rows, missing))
+
+    # Returns the rows whose value lies between low and high inclusive (either end can be None for open-ended)
+    def range_rows(self, low=None, high=None):
+        valid_values = self.sorted_values[:self.valid_count]
+        start = 0 if low is None else np.searchsorted(valid_values, low, side="left")
+        stop = self.valid_count if high is None else np.searchsorted(valid_values, high, side="right")
+        return self.order[start:max(start, stop)]
+
+# Turns datetimes into integers so values can be negated and compared when selecting
+def sortable_keys(values):
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.view("int64")
+    return values
+
+# Finds the positions of the k smallest (or largest) values, in the same order as a stable sort_values (missing values last)
+# "partition" does an O(n) argpartition then only sorts the k winners, "sort" does a full stable argsort,
+# and "auto" picks partition whenever k is much smaller than n
+def select_top_k(values, k, ascending=True, strategy=TOP_K_STRATEGY):
+    if strategy not in TOP_K_STRATEGIES:
+        raise ValueError(f"Unknown top-k strategy: {strategy}")
+    values = np.asarray(values)
+    missing = pd.isna(values)
+    n = len(values)
+    if strategy == "auto":
+        strategy = "partition" if k * TOP_K_PARTITION_FACTOR <= n else "sort"
+
+    if strategy == "sort":
+        keys = sortable_keys(values)
+        if not ascending:
+            keys = -keys
+        order = np.argsort(np.where(missing, 0, keys), kind="stable")
+        return np.concatenate((order[~missing[order]], np.flatnonzero(missing)))[:k]
+
+    valid_rows = np.flatnonzero(~missing)
+    keys = sortable_keys(values[valid_rows])
+    if not ascending:
+        keys = -keys
+    k_valid = min(k, len(valid_rows))
+    if k_valid == 0:
+        valid_rows, keys = valid_rows[:0], keys[:0]
+    elif k_valid < len(valid_rows):
+        # Everything strictly better than the k-th value wins, and ties on the k-th value go to the earliest rows
+        kth = np.partition(keys, k_valid - 1)[k_valid - 1]
+        better = np.flatnonzero(keys < kth)
+        tied = np.flatnonzero(keys == kth)[:k_valid - len(better)]
+        chosen = np.sort(np.concatenate((better, tied)))
+        valid_rows, keys = valid_rows[chosen], keys[chosen]
+    rows = valid_rows[np.argsort(keys, kind="stable")]
+    return np.concatenate((rows, np.flatnonzero(missing)[:k - k_valid]))
+
+# Maps each value of a categorical column to the rows holding it (a posting list), so equality filters never scan the column.
+# Rows appended later are kept in a small per-value delta rather than rebuilding the whole list
+class PostingIndex:
+    def __init__(self, column):
+        codes = column.cat.codes.to_numpy()
+        self.categories = column.cat.categories
+        self.order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.categories))
+        self.offsets = np.concatenate(([0], np.cumsum(counts))) + np.count_nonzero(codes < 0)
+        self.appended = {}
+
+    # Adds the rows of an appended batch (numbered from first_row onwards) to the delta
+    def append(self, column, first_row):
+        codes = column.cat.codes.to_numpy()
+        if len(codes) == 0:
+            return
+        order = np.argsort(codes, kind="stable")
+        for group in np.split(order, np.flatnonzero(np.diff(codes[order])) + 1):
+            code = codes[group[0]]
+            if code >= 0:
+                value = column.cat.categories[code]
+                self.appended[value] = np.concatenate((self.appended.get(value, group[:0]), group + first_row))
+
+    # Returns the rows holding a value, in row order. The value is found through the categories' hash table, so this is O(1)
+    def rows(self, value):
+        try:
+            code = self.categories.get_loc(value)
+            base = self.order[self.offsets[code]:self.offsets[code + 1]]
+        except KeyError:
+            base = self.order[:0]
+        if value in self.appended:
+            return np.concatenate((base, self.appended[value]))
+        return base
+
+    # Returns the bytes this index adds on top of the column itself (the row lists and the category hash table)
+    def memory_bytes(self):
+        appended = sum(rows.nbytes for rows in self.appended.values())
+        return self.order.nbytes + self.offsets.nbytes + self.categories.memory_usage(deep=False) + appended
+
+# Builds a posting list index for every categorical column that can be filtered on or looked up
+@profiler.timed()
+def build_posting_indexes(df):
+    indexes = {col: PostingIndex(df[col]) for col in POSTING_COLUMNS}
+    # Looks up a dummy value so each hash table is built while loading rather than on the first search
+    for index in indexes.values():
+        index.rows("")
+    return indexes
+
+# Finds the rows for a tx hash or wallet address, telling the two apart by length and trying both otherwise
+def lookup_rows(posting_indexes, value):
+    value = value.strip().lower()
+    if len(value) == TX_HASH_LENGTH:
+        return posting_indexes["tx_hash"].rows(value)
+    if len(value) == WALLET_LENGTH:
+        return posting_indexes["trader_wallet"].rows(value)
+    return np.union1d(posting_indexes["tx_hash"].rows(value), posting_indexes["trader_wallet"].rows(value))
+
+# Returns the memory used by the lookup and filter indexes in megabytes
+def index_memory(posting_indexes):
+    return sum(index.memory_bytes() for index in posting_indexes.values()) / (1024 * 1024)
+
+# Builds a sort index for every column that can be picked in the sort dropdown
+@profiler.timed()
+def build_sort_indexes(df):
+    return {col: SortIndex(df[col]) for col in SORT_COLUMNS}
+
+# Keeps running stats over the loaded trades, so the key transaction and other summaries never need a full rescan
+class TradeAggregates:
+    def __init__(self, df, top_n=AGGREGATE_TOP_N):
+        self.top_n = top_n
+        self.row_count = 0
+        self.total_volume = 0.0
+        self.key_row = None
+        self.key_value = None
+        self.token_max = {}
+        self.top_heap = []
+        self.append(df, 0)
+
+    # Folds a batch of appended rows (numbered from first_row onwards) into the running stats
+    def append(self, new_df, first_row):
+        values = new_df["trade_value_usd"].to_numpy(dtype="float64")
+        self.row_count += len(values)
+        if np.isnan(values).all():
+            return
+        self.total_volume += float(np.nansum(values))
+
+        batch_key = int(np.nanargmax(values))
+        if self.key_value is None or values[batch_key] > self.key_value:
+            self.key_row, self.key_value = first_row + batch_key, float(values[batch_key])
+
+        batch = pd.DataFrame({"token": new_df["token_bought"].to_numpy(), "value": values}).dropna()
+        for token, row in batch.groupby("token", observed=True)["value"].idxmax().items():
+            if token not in self.token_max or values[row] > self.token_max[token][0]:
+                self.token_max[token] = (float(values[row]), first_row + int(row))
+
+        # Min-heap of (value, -row), so the smallest value (and latest row on ties) is the one pushed out
+        for row in select_top_k(values, self.top_n, ascending=False):
+            if np.isnan(values[row]):
+                break
+            entry = (float(values[row]), -(first_row + int(row)))
+            if len(self.top_heap) < self.top_n:
+                heapq.heappush(self.top_heap, entry)
+            elif entry > self.top_heap[0]:
+                heapq.heapreplace(self.top_heap, entry)
+
+    # Returns the row positions of the highest value trades, highest first
+    def top_rows(self, n=None):
+        return [-row for _, row in sorted(self.top_heap, reverse=True)[:n]]
+
+    # Returns the row position of the highest value trade for each bought token
+    def token_max_rows(self):
+        return {token: row for token, (_, row) in self.token_max.items()}
+
+# Keeps a dense token x token matrix of trade counts and USD volume (row = token bought, column = token sold)
+# and a posting list index over the pairs, so a cell drills down to its trades without scanning the frame.
+# Both token columns share one integer coding, so the whole matrix is two bincounts over pair codes
+class TokenPairFlows:
+    def __init__(self, df):
+        tokens = union_categoricals([df["token_bought"], df["token_sold"]], ignore_order=True)
+        self.tokens = list(tokens.categories)
+        self.token_ids = {token: token_id for token_id, token in enumerate(self.tokens)}
+        self.counts = np.zeros((len(self.tokens), len(self.tokens)), dtype=np.int64)
+        self.volumes = np.zeros((len(self.tokens), len(self.tokens)))
+        self.index = None
+        codes = tokens.codes.astype(np.int64)
+        self.add(codes[:len(df)], codes[len(df):], df["trade_value_usd"].to_numpy(dtype="float64"), 0)
+
+    # Adds trades given as bought and sold token ids to the matrix and the pair index (rows numbered from first_row onwards)
+    def add(self, bought, sold, values, first_row):
+        keep = (bought >= 0) & (sold >= 0)
+        size = len(self.tokens)
+        pairs = bought[keep] * size + sold[keep]
+        self.counts += np.bincount(pairs, minlength=size * size).reshape(size, size)
+        self.volumes += np.bincount(pairs, weights=np.nan_to_num(values[keep]), minlength=size * size).reshape(size, size)
+
+        keys = np.where(keep, bought * PAIR_KEY_STRIDE + sold, -1)
+        codes, uniques = pd.factorize(keys[keep])
+        pair_codes = np.full(len(keys), -1, dtype=np.int64)
+        pair_codes[keep] = codes
+        column = pd.Series(pd.Categorical.from_codes(pair_codes, uniques))
+        if self.index is None:
+            self.index = PostingIndex(column)
+        else:
+            self.index.append(column, first_row)
+
+    # Maps an appended batch's tokens onto the shared ids, growing the matrix for tokens not seen before
+    def token_codes(self, column):
+        codes, uniques = pd.factorize(column)
+        ids = np.array([self.token_ids.setdefault(token, len(self.token_ids)) for token in uniques], dtype=np.int64)
+        if len(self.token_ids) > len(self.tokens):
+            self.tokens.extend(list(self.token_ids)[len(self.tokens):])
+            grow = len(self.tokens) - len(self.counts)
+            self.counts = np.pad(self.counts, ((0, grow), (0, grow)))
+            self.volumes = np.pad(self.volumes, ((0, grow), (0, grow)))
+        return np.where(codes >= 0, ids[codes] if len(ids) else -1, -1)
+
+    # Folds a batch of appended rows (numbered from first_row onwards) into the matrix
+    def append(self, new_df, first_row):
+        bought = self.token_codes(new_df["token_bought"])
+        sold = self.token_codes(new_df["token_sold"])
+        self.add(bought, sold, new_df["trade_value_usd"].to_numpy(dtype="float64"), first_row)
+
+    # Returns the rows of the trades that bought one token with another, in row order
+    def rows(self, bought, sold):
+        if bought not in self.token_ids or sold not in self.token_ids:
+            return np.zeros(0, dtype=np.int64)
+        return self.index.rows(self.token_ids[bought] * PAIR_KEY_STRIDE + self.token_ids[sold])
+
+    # Returns every pair with trades as a frame of PAIR_COLUMNS, with the volume flowing the other way alongside
+    def frame(self):
+        bought, sold = np.nonzero(self.counts)
+        return pd.DataFrame({"token_bought": np.array(self.tokens, dtype=object)[bought],
+                             "token_sold": np.array(self.tokens, dtype=object)[sold],
+                             "trade_count": self.counts[bought, sold],
+                             "volume_usd": self.volumes[bought, sold].round(2),
+                             "reverse_volume_usd": self.volumes[sold, bought].round(2)})
+
+# Returns each trade's time bucket, wallet and value in whole cents, leaving out trades without a wallet or timestamp.
+# Cents are integers, so running sums can be added to and taken from without drifting from a fresh sum
+def bucket_trades(df, bucket_seconds=ROLLING_BUCKET_SECONDS):
+    times = df["timestamp"].to_numpy().astype("datetime64[s]")
+    wallets = df["trader_wallet"]
+    keep = ~np.isnat(times) & wallets.notna().to_numpy()
+    buckets = times[keep].astype(np.int64) // bucket_seconds
+    cents = np.round(np.nan_to_num(df["trade_value_usd"].to_numpy(dtype="float64")[keep]) * 100).astype(np.int64)
+    return buckets, wallets.to_numpy()[keep], cents
+
+# Combines two sums of the same bucket (trades arriving late for a minute already seen), so it holds each wallet once again
+def merge_bucket(bucket, extra):
+    wallet_ids, counts, cents = (np.concatenate(parts) for parts in zip(bucket, extra))
+    merged_ids, inverse = np.unique(wallet_ids, return_inverse=True)
+    merged_counts, merged_cents = np.zeros(len(merged_ids), dtype=np.int64), np.zeros(len(merged_ids), dtype=np.int64)
+    np.add.at(merged_counts, inverse, counts)
+    np.add.at(merged_cents, inverse, cents)
+    return merged_ids, merged_counts, merged_cents
+
+# Keeps per-wallet trade counts and USD volumes over sliding windows (see ROLLING_WINDOWS) as trades arrive.
+# Trades are summed per wallet into time buckets, and each window keeps running totals over the buckets inside it:
+# a new bucket is added to every window once and taken out once as the window passes it, so each update costs
+# O(trades + buckets expired) however much history is loaded. Buckets older than the longest window are dropped
+class RollingWalletStats:
+    def __init__(self, df, windows=ROLLING_WINDOWS, bucket_seconds=ROLLING_BUCKET_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.spans = {name: -(-seconds // bucket_seconds) for name, seconds in windows.items()}
+        self.longest = max(self.spans, key=self.spans.get)
+        self.wallet_ids = {}
+        self.wallets = []
+        self.counts = {name: np.zeros(0, dtype=np.int64) for name in self.spans}
+        self.cents = {name: np.zeros(0, dtype=np.int64) for name in self.spans}
+        self.buckets = {}
+        self.bucket_order = []
+        self.now = None
+        self.append(df)
+
+    # Returns the first bucket inside a window that ends at the given bucket
+    def edge(self, name, now):
+        return now - self.spans[name] + 1
+
+    # Maps wallets to dense ids, giving new wallets the next ids and growing the running totals (doubling) to fit
+    def wallet_codes(self, wallets):
+        codes, uniques = pd.factorize(wallets)
+        ids = np.empty(len(uniques), dtype=np.int64)
+        for position, wallet in enumerate(uniques):
+            wallet_id = self.wallet_ids.get(wallet)
+            if wallet_id is None:
+                wallet_id = self.wallet_ids[wallet] = len(self.wallets)
+                self.wallets.append(wallet)
+            ids[position] = wallet_id
+        for totals in (self.counts, self.cents):
+            for name, values in totals.items():
+                if len(values) < len(self.wallets):
+                    totals[name] = np.concatenate((values, np.zeros(max(len(self.wallets), 2 * len(values)) - len(values), dtype=np.int64)))
+        return ids[codes]
+
+    # Adds (sign 1) or takes away (sign -1) one bucket's per-wallet sums from a window's totals. A bucket holds each wallet once
+    def apply(self, name, bucket, sign):
+        wallet_ids, counts, cents = bucket
+        self.counts[name][wallet_ids] += sign * counts
+        self.cents[name][wallet_ids] += sign * cents
+
+    # Folds a batch of trades into the buckets, moves every window up to the latest trade and drops expired buckets
+    def append(self, new_df):
+        buckets, wallets, cents = bucket_trades(new_df, self.bucket_seconds)
+        if len(buckets) == 0:
+            return
+        now = int(buckets.max()) if self.now is None else max(self.now, int(buckets.max()))
+        keep = buckets >= self.edge(self.longest, now)
+        if not keep.any():
+            # Every trade is older than the longest window (late rows from a file not in time order), so nothing moves
+            return
+        buckets, wallet_ids, cents = buckets[keep], self.wallet_codes(wallets[keep]), cents[keep]
+
+        # Takes out the buckets each window has moved past, before the batch is added
+        if self.now is not None:
+            for name in self.spans:
+                start = bisect.bisect_left(self.bucket_order, self.edge(name, self.now))
+                stop = bisect.bisect_left(self.bucket_order, self.edge(name, now))
+                for bucket_id in self.bucket_order[start:stop]:
+                    self.apply(name, self.buckets[bucket_id], -1)
+        self.now = now
+
+        # Sums the batch per (bucket, wallet), then adds each bucket to the windows it falls in and to the bucket store
+        order = np.lexsort((wallet_ids, buckets))
+        buckets, wallet_ids, cents = buckets[order], wallet_ids[order], cents[order]
+        starts = np.flatnonzero(np.concatenate(([True], (buckets[1:] != buckets[:-1]) | (wallet_ids[1:] != wallet_ids[:-1]))))
+        buckets, wallet_ids = buckets[starts], wallet_ids[starts]
+        counts = np.diff(np.append(starts, len(order)))
+        cents = np.add.reduceat(cents, starts)
+        bounds = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1], [True])))
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            bucket_id = int(buckets[start])
+            bucket = (wallet_ids[start:stop], counts[start:stop], cents[start:stop])
+            for name in self.spans:
+                if bucket_id >= self.edge(name, now):
+                    self.apply(name, bucket, 1)
+            if bucket_id in self.buckets:
+                bucket = merge_bucket(self.buckets[bucket_id], bucket)
+            else:
+                bisect.insort(self.bucket_order, bucket_id)
+            self.buckets[bucket_id] = bucket
+
+        expired = bisect.bisect_left(self.bucket_order, self.edge(self.longest, now))
+        for bucket_id in self.bucket_order[:expired]:
+            del self.buckets[bucket_id]
+        del self.bucket_order[:expired]
+
+    # Returns the time the windows end at: the minute of the latest trade
+    def latest_time(self):
+        return None if self.now is None else pd.Timestamp((self.now + 1) * self.bucket_seconds, unit="s")
+
+    # Returns the windowed stats of every wallet with a trade in the longest window, as a frame of ROLLING_COLUMNS
+    def frame(self):
+        active = np.flatnonzero(self.counts[self.longest][:len(self.wallets)])
+        columns = {"trader_wallet": np.array(self.wallets, dtype=object)[active]}
+        for name in self.spans:
+            columns[f"trades_{name}"] = self.counts[name][active]
+            columns[f"volume_usd_{name}"] = self.cents[name][active] / 100
+        return pd.DataFrame(columns)[ROLLING_COLUMNS]
+
+    # Returns the top wallets for a rolling sort
+    def top(self, sort_col, ascending, num_results):
+        stats = self.frame()
+        return stats.iloc[select_top_k(stats[sort_col], num_results, ascending)]
+
+# Works out the rolling stats from scratch with one groupby per window, for checking RollingWalletStats against
+def recompute_rolling_stats(df, windows=ROLLING_WINDOWS, bucket_seconds=ROLLING_BUCKET_SECONDS):
+    buckets, wallets, cents = bucket_trades(df, bucket_seconds)
+    trades = pd.DataFrame({"trader_wallet": wallets.astype(object), "bucket": buckets, "cents": cents})
+    now = buckets.max() if len(buckets) else 0
+    longest = max(windows, key=windows.get)
+    stats = None
+    for name, seconds in sorted(windows.items(), key=lambda item: -item[1]):
+        window = trades[trades["bucket"] > now - -(-seconds // bucket_seconds)].groupby("trader_wallet")["cents"]
+        totals = pd.DataFrame({f"trades_{name}": window.size(), f"volume_usd_{name}": window.sum()})
+        stats = totals if name == longest else stats.join(totals)
+    stats = stats.fillna(0).astype(np.int64)
+    for name in windows:
+        stats[f"volume_usd_{name}"] = stats[f"volume_usd_{name}"] / 100
+    return stats.rename_axis("trader_wallet").reset_index()[ROLLING_COLUMNS]
+
+# Converts the rows returned by the Dune query into the same typed frame the CSV loader produces
+def dune_rows_to_frame(rows):
+    df = pd.DataFrame(rows, columns=DATA_COLUMNS)
+    df["timestamp"] = pd.to_datetime(df["timestamp"].astype(str).str.removesuffix(" UTC"))
+    return df.astype(CSV_DTYPES)
+
+# Fetches the trades from the live Dune query, reusing the client's cached result while it is fresh enough
+def load_dune_data():
+    global dune_client
+    if dune_client is None:
+        if not DUNE_API_KEY:
+            raise ValueError("Set the DUNE_API_KEY environment variable to load live data")
+        dune_client = AsyncDuneClient(DUNE_API_KEY)
+    return dune_rows_to_frame(asyncio.run(dune_client.fetch_rows(DUNE_QUERY_ID)))
+
+# Finds each row's mirrored leg (same tx hash, bought and sold tokens swapped) without Python loops, or -1 if it has none.
+# Only rows whose tx hash appears more than once can have a partner. Those are encoded as (tx, bought, sold) integers,
+# and the n-th row with a key is paired with the n-th row with its mirror key
+def find_swap_partners(df):
+    n = len(df)
+    partners = np.full(n, -1, dtype=np.int64)
+    if n == 0:
+        return partners
+    tokens = union_categoricals([df["token_bought"], df["token_sold"]], ignore_order=True)
+    token_count = len(tokens.categories) + 1
+    bought, sold = tokens.codes[:n].astype(np.int64) + 1, tokens.codes[n:].astype(np.int64) + 1
+    tx = df["tx_hash"].cat.codes.to_numpy().astype(np.int64)
+
+    tx_counts = np.bincount(tx[tx >= 0], minlength=len(df["tx_hash"].cat.categories))
+    rows = np.flatnonzero((tx >= 0) & (bought > 0) & (sold > 0) & (bought != sold))
+    rows = rows[tx_counts[tx[rows]] > 1]
+    if len(rows) == 0:
+        return partners
+    keys = (tx[rows] * token_count + bought[rows]) * token_count + sold[rows]
+    mirror_keys = (tx[rows] * token_count + sold[rows]) * token_count + bought[rows]
+    matched = match_mirror_keys(keys, mirror_keys)
+    found = matched >= 0
+    partners[rows[found]] = rows[matched[found]]
+    return partners
+
+# Returns, for each key, the position of the key it pairs with (or -1): the n-th occurrence of a key
+# is paired with the n-th occurrence of its mirror key
+def match_mirror_keys(keys, mirror_keys):
+    matched = np.full(len(keys), -1, dtype=np.int64)
+    if len(keys) == 0:
+        return matched
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    group_start = np.maximum.accumulate(np.where(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])), np.arange(len(keys)), 0))
+    rank = np.empty(len(keys), dtype=np.int64)
+    rank[order] = np.arange(len(keys)) - group_start
+
+    position = np.searchsorted(sorted_keys, mirror_keys, side="left") + rank
+    found = position < len(keys)
+    found[found] = sorted_keys[position[found]] == mirror_keys[found]
+    matched[found] = order[position[found]]
+    return matched
+
+# Applies the swap leg policy given each row's partner, numbering the rows from first_row onwards
+def apply_swap_policy(df, partners, policy, first_row=0):
+    if policy == "link":
+        return df.assign(pair_row=partners)
+    keep = (partners < 0) | (partners > np.arange(first_row, first_row + len(df)))
+    return df.iloc[np.flatnonzero(keep)].reset_index(drop=True)
+
+# Applies the swap leg policy to a freshly loaded frame. If a pairer is given, the legs left without a partner
+# are handed to it, so trades read after the frame can still be paired with them
+@profiler.timed()
+def pair_swap_legs(df, policy=None, pairer=None):
+    policy = SWAP_LEG_POLICY if policy is None else policy
+    if policy not in SWAP_LEG_POLICIES:
+        raise ValueError(f"Unknown swap leg policy: {policy}")
+    if policy == "keep":
+        return df
+    partners = find_swap_partners(df)
+    if pairer is not None:
+        pairer.seed(df, partners)
+    return apply_swap_policy(df, partners, policy)
+
+# Pairs swap legs across a stream of chunks (or the loaded trades and the batches appended after them) the way
+# find_swap_partners pairs them within one frame. Legs still waiting for their mirror are carried forward as
+# 64-bit keys (the tx hash hashed and mixed with the two token ids) with their row numbers. Rows are numbered
+# as read, before any are collapsed, which is also the numbering pair_row uses since "link" drops nothing.
+# A leg is only carried for window rows, keeping the carried keys (and the memory of a stream) bounded
+class SwapLegPairer:
+    def __init__(self, policy=None, window=None):
+        policy = SWAP_LEG_POLICY if policy is None else policy
+        if policy not in SWAP_LEG_POLICIES:
+            raise ValueError(f"Unknown swap leg policy: {policy}")
+        self.policy = policy
+        self.window = SWAP_LEG_WINDOW_ROWS if window is None else window
+        self.token_ids = {}
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.mirror_keys = np.zeros(0, dtype=np.uint64)
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.next_row = 0
+        self.linked = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+    # Maps a token column onto ids shared by every chunk, with 0 for a missing token
+    def token_codes(self, column):
+        column = categorize(column)
+        ids = np.array([self.token_ids.setdefault(token, len(self.token_ids) + 1) for token in column.cat.categories], dtype=np.uint64)
+        codes = column.cat.codes.to_numpy()
+        return np.where(codes >= 0, ids[codes] if len(ids) else 0, 0).astype(np.uint64)
+
+    # Returns the positions of the rows that can be a swap leg, with their keys and the keys of their mirrors
+    def leg_keys(self, df):
+        tx = categorize(df["tx_hash"])
+        tx_hashes = pd.util.hash_array(tx.cat.categories.to_numpy(dtype=object))
+        tx_codes = tx.cat.codes.to_numpy()
+        bought, sold = self.token_codes(df["token_bought"]), self.token_codes(df["token_sold"])
+        legs = np.flatnonzero((tx_codes >= 0) & (bought > 0) & (sold > 0) & (bought != sold))
+        hashes, bought, sold = tx_hashes[tx_codes[legs]], bought[legs], sold[legs]
+        shift = np.uint64(32)
+        return legs, hashes ^ ((bought << shift) | sold), hashes ^ ((sold << shift) | bought)
+
+    # Takes over the legs of a frame paired as a whole that are still waiting for a partner
+    def seed(self, df, partners):
+        legs, keys, mirror_keys = self.leg_keys(df)
+        waiting = (partners[legs] < 0) & (legs >= len(df) - self.window)
+        self.keys, self.mirror_keys, self.rows = keys[waiting], mirror_keys[waiting], legs[waiting].astype(np.int64)
+        self.next_row = len(df)
+
+    # Pairs the next chunk with itself and with the legs carried from earlier chunks, and applies the policy.
+    # Earlier rows that found their partner in this chunk are left in linked, for a caller holding them to update
+    def pair(self, chunk):
+        first_row = self.next_row
+        self.next_row += len(chunk)
+        if self.policy == "keep":
+            return chunk
+        legs, keys, mirror_keys = self.leg_keys(chunk)
+        carried = len(self.keys)
+        keys, mirror_keys = np.concatenate((self.keys, keys)), np.concatenate((self.mirror_keys, mirror_keys))
+        rows = np.concatenate((self.rows, legs + first_row))
+        matched = match_mirror_keys(keys, mirror_keys)
+        partner_rows = np.where(matched >= 0, rows[np.maximum(matched, 0)], -1)
+
+        partners = np.full(len(chunk), -1, dtype=np.int64)
+        partners[legs] = partner_rows[carried:]
+        linked = np.flatnonzero(partner_rows[:carried] >= 0)
+        self.linked = (rows[linked], partner_rows[linked])
+        waiting = (matched < 0) & (rows >= self.next_row - self.window)
+        self.keys, self.mirror_keys, self.rows = keys[waiting], mirror_keys[waiting], rows[waiting]
+        return apply_swap_policy(chunk, partners, self.policy, first_row)
+
+# Returns the offset just past the last newline in a file and the partial line after it, reading back from the end
+def last_line_start(path, block_size=1 << 16):
+    with open(path, 'rb') as file:
+        end = file.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            position = max(0, position - block_size)
+            file.seek(position)
+            data = file.read(end - position)
+            newline = data.rfind(b"\n")
+            if newline >= 0:
+                return position + newline + 1, data[newline + 1:]
+        file.seek(0)
+        return 0, file.read()
+
+# Follows a CSV that is being appended to, parsing only the complete lines written since the last read
+class CsvTail:
+    def __init__(self, path, offset=None):
+        self.path = path
+        self.columns = list(pd.read_csv(path, nrows=0).columns)
+        if not REQUIRED_COLUMNS.issubset(self.columns):
+            raise ValueError("CSV file is missing required columns")
+        # Tailing starts after the last complete line, the rule read_new_rows applies, so a file that does not end
+        # with a newline has its partial last line read whole once the writer finishes it. The load already parsed
+        # that line as it was, so if it is finished without changes it is skipped rather than read twice
+        self.partial = b""
+        if offset is None:
+            offset, partial = last_line_start(path)
+            self.partial = partial.rstrip(b"\r")
+        self.offset = offset
+        self.last_write_time = None
+        self.pairer = SwapLegPairer()
+
+    # Returns the trades appended since the last read (possibly none), or None if the file was rewritten
+    def read_new_rows(self):
+        stat = os.stat(self.path)
+        if stat.st_size < self.offset:
+            return None
+        with open(self.path, 'rb') as file:
+            file.seek(self.offset)
+            data = file.read(stat.st_size - self.offset)
+
+        # A line without its newline may still be being written, so it is left for the next read
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        self.last_write_time = stat.st_mtime
+        if end and self.partial:
+            first_end = data.find(b"\n") + 1
+            start = first_end if data[:first_end].rstrip(b"\r\n") == self.partial else 0
+            self.partial = b""
+            data = data[start:]
+            end -= start
+        if not data[:end].strip():
+            return apply_schema(pd.DataFrame({col: pd.Series(dtype="object") for col in self.columns}))
+        new_df = pd.read_csv(io.BytesIO(data[:end]), header=None, names=self.columns, dtype=READ_DTYPES)
+        return self.pairer.pair(apply_schema(new_df))
+
+# Joins typed frames end to end, merging the category lists so the columns stay categorical.
+# Each column is copied once into its joined form, and only columns every frame has are kept
+def concat_frames(frames):
+    if len(frames) == 1:
+        return frames[0]
+    columns = {}
+    for col in frames[0].columns:
+        if not all(col in frame for frame in frames[1:]):
+            continue
+        if isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+            columns[col] = union_categoricals([frame[col] for frame in frames], ignore_order=True)
+        else:
+            columns[col] = np.concatenate([frame[col].to_numpy() for frame in frames])
+    return pd.DataFrame(columns, copy=False)
+
+# Joins appended trades onto the loaded frame
+def concat_trades(df, new_df):
+    return concat_frames([df, new_df])
+
+# Adds appended trades to the frame, sort indexes and aggregates without rebuilding any of them
+@profiler.timed()
+def append_trades(df, sort_indexes, posting_indexes, aggregates, new_df):
+    new_df = new_df.reset_index(drop=True)
+    first_row = len(df)
+    for col, index in {**sort_indexes, **posting_indexes}.items():
+        index.append(new_df[col], first_row)
+    aggregates.append(new_df, first_row)
+    return concat_trades(df, new_df)
+
+# Reads the CSV (or each shard in turn) as a stream of typed chunks, numbering rows across every file,
+# so only one chunk is in memory at a time. Swap legs are paired across chunks and files by one pairer
+def read_trade_chunks(csv_file, chunk_rows=STREAM_CHUNK_ROWS, pairer=None):
+    pairer = SwapLegPairer() if pairer is None else pairer
+    first_row = 0
+    for path in shard_files(csv_file) or [csv_file]:
+        with pd.read_csv(path, dtype=READ_DTYPES, chunksize=chunk_rows) as reader:
+            for number, chunk in enumerate(reader):
+                if number == 0 and not REQUIRED_COLUMNS.issubset(chunk.columns):
+                    raise ValueError(f"{os.path.basename(path)} is missing required columns")
+                chunk = pairer.pair(apply_schema(chunk))
+                chunk.index = pd.RangeIndex(first_row, first_row + len(chunk))
+                first_row += len(chunk)
+                yield chunk
+
+# Keeps the best k rows seen so far; rows are kept in file order before selecting so ties go to the earliest row
+def merge_top_k(best, chunk, sort_col, ascending, k):
+    candidates = chunk.iloc[select_top_k(chunk[sort_col], k, ascending)]
+    if best is not None:
+        candidates = pd.concat([best, candidates]).sort_index()
+    return candidates.iloc[select_top_k(candidates[sort_col], k, ascending)]
+
+# Keeps the highest value trade seen so far, preferring the earliest row on ties
+def merge_key_transaction(key_tx, chunk):
+    values = chunk["trade_value_usd"].to_numpy(dtype="float64")
+    if np.isnan(values).all():
+        return key_tx
+    row = int(np.nanargmax(values))
+    if key_tx is None or values[row] > key_tx["trade_value_usd"].iloc[0]:
+        return chunk.iloc[[row]]
+    return key_tx
+
+# Answers a query over a file in a single streaming pass with bounded memory, merging per-chunk partial results
+@profiler.timed()
+def stream_query(csv_file, sort_col, ascending, num_results, chunk_rows=STREAM_CHUNK_ROWS):
+    top, key_tx = None, None
+    for chunk in read_trade_chunks(csv_file, chunk_rows):
+        top = merge_top_k(top, chunk, sort_col, ascending, num_results)
+        key_tx = merge_key_transaction(key_tx, chunk)
+    empty = pd.DataFrame(columns=DATA_COLUMNS)
+    return (empty if top is None else top), (empty if key_tx is None else key_tx)
+
+# Loads the trades and builds everything the queries read from
+@profiler.timed()
+def load_dataset(source=None, csv_file=None):
+    source = DATA_SOURCE if source is None else source
+    csv_file = CSV_FILE if csv_file is None else csv_file
+    if source == "dune":
+        df, tail = load_dune_data(), None
+    else:
+        # Follow mode tails a single file, so shards are loaded without it
+        df = load_data(csv_file=csv_file)
+        tail = None if shard_files(csv_file) else CsvTail(csv_file)
+    df = pair_swap_legs(df, pairer=None if tail is None else tail.pairer)
+    return df, build_sort_indexes(df), build_posting_indexes(df), TradeAggregates(df), tail
+
+# Parses one end of a timestamp range. A date given without a time covers the whole day, so as the high end it stands
+# for the last instant of that day and "timestamp=05/10/2024" matches every trade on the 5th. Dates are day first as in
+# the CSV, except ISO dates such as 2024-10-05, which start with the year
+def parse_time_bound(text, end=False):
+    value = pd.to_datetime(text, dayfirst=not text[:4].isdigit())
+    if end and ":" not in text:
+        value += pd.Timedelta(days=1) - pd.Timedelta(1, "ns")
+    return np.datetime64(value)
+
+# Parses filter text such as "token_bought=USDC,DAI; trade_value_usd=1000000..; timestamp=01/03/2025..15/03/2025"
+# into clauses. Clauses separated by ";" must all match, predicates separated by "|" within a clause are alternatives,
+# "a,b" matches any listed value and "low..high" is an inclusive range with either end optional
+def parse_filter(text):
+    clauses = []
+    for clause_text in text.split(";"):
+        if not clause_text.strip():
+            continue
+        clause = []
+        for predicate_text in clause_text.split("|"):
+            col, sep, value = (part.strip() for part in predicate_text.partition("="))
+            if not sep or not value:
+                raise ValueError(f"Filters look like column=value, not '{predicate_text.strip()}'")
+            if col in POSTING_COLUMNS:
+                clause.append((col, "in", [item.strip() for item in value.split(",")]))
+            elif col in SORT_COLUMNS:
+                low, dots, high = (part.strip() for part in value.partition(".."))
+                if not dots:
+                    high = low
+                if col == "trade_value_usd":
+                    bounds = (float(low) if low else None, float(high) if high else None)
+                else:
+                    bounds = (parse_time_bound(low) if low else None, parse_time_bound(high, end=True) if high else None)
+                clause.append((col, "between", bounds))
+            else:
+                raise ValueError(f"Cannot filter on '{col}'. Try one of: {', '.join(POSTING_COLUMNS + SORT_COLUMNS)}")
+        clauses.append(clause)
+    return clauses
+
+# Combines the filter clauses as boolean row bitmaps, OR within a clause and AND across clauses, and returns the matching rows
+@profiler.timed()
+def filter_rows(row_count, clauses, sort_indexes, posting_indexes):
+    mask = np.ones(row_count, dtype=bool)
+    for clause in clauses:
+        clause_mask = np.zeros(row_count, dtype=bool)
+        for col, op, value in clause:
+            if op == "in":
+                for item in value:
+                    clause_mask[posting_indexes[col].rows(item)] = True
+            else:
+                clause_mask[sort_indexes[col].range_rows(*value)] = True
+        mask &= clause_mask
+    return np.flatnonzero(mask)
+
+# Summarises every wallet in one groupby pass: trade count, total/mean/max USD volume, distinct tokens and first/last seen
+@profiler.timed()
+def compute_wallet_stats(df):
+    stats = df.groupby("trader_wallet", observed=True).agg(
+        trade_count=("trade_value_usd", "size"),
+        total_volume_usd=("trade_value_usd", "sum"),
+        mean_trade_usd=("trade_value_usd", "mean"),
+        max_trade_usd=("trade_value_usd", "max"),
+        first_seen=("timestamp", "min"),
+        last_seen=("timestamp", "max"),
+    )
+    stats["mean_trade_usd"] = stats["mean_trade_usd"].round(2)
+
+    # Counts distinct (wallet, token) pairs across both token columns, encoded as single integers.
+    # A bitmap over every possible pair is used while it stays small, otherwise the pairs are sorted
+    tokens = union_categoricals([df["token_bought"], df["token_sold"]], ignore_order=True)
+    token_count = max(1, len(tokens.categories))
+    wallet_count = len(df["trader_wallet"].cat.categories)
+    wallet_codes = np.tile(df["trader_wallet"].cat.codes.to_numpy().astype(np.int64), 2)
+    keep = (wallet_codes >= 0) & (tokens.codes >= 0)
+    pairs = wallet_codes[keep] * token_count + tokens.codes[keep]
+    if wallet_count * token_count <= PAIR_BITMAP_LIMIT:
+        seen = np.zeros(wallet_count * token_count, dtype=bool)
+        seen[pairs] = True
+        distinct = seen.reshape(wallet_count, token_count).sum(axis=1)
+    else:
+        pairs = np.sort(pairs)
+        pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))] if len(pairs) else pairs
+        distinct = np.bincount(pairs // token_count, minlength=wallet_count)
+    stats["distinct_tokens"] = distinct[stats.index.codes]
+
+    stats.index = stats.index.astype(str)
+    return stats.reset_index()[WALLET_COLUMNS]
+
+# Returns the key transaction as a one row frame (empty if there are no trades)
+def key_transaction_frame(df, aggregates):
+    if aggregates.key_row is None:
+        return df.iloc[:0]
+    return df.iloc[[aggregates.key_row]]
+
+# Answers a highest value query from the running aggregates when they hold the whole answer: the top trades when
+# nothing is filtered, or the single largest trade of the bought tokens a filter lists. Returns None for any other query
+def aggregate_rows(df, aggregates, sort_col, ascending, num_results, clauses):
+    if sort_col != "trade_value_usd" or ascending:
+        return None
+    if not clauses:
+        return aggregates.top_rows(num_results) if num_results <= len(aggregates.top_heap) else None
+    if num_results == 1 and len(clauses) == 1 and len(clauses[0]) == 1 and clauses[0][0][:2] == ("token_bought", "in"):
+        token_rows = aggregates.token_max_rows()
+        rows = [token_rows[token] for token in clauses[0][0][2] if token in token_rows]
+        # A listed token whose trades all lack a value is missing from the aggregates, so the filter answers it instead
+        if rows and len(rows) == len(set(clauses[0][0][2])):
+            values = df["trade_value_usd"].to_numpy()
+            return [max(rows, key=lambda row: (values[row], -row))]
+    return None
+
+# Returns the rows of a query, using the sort index when there is one for the column.
+# Filtered queries pass the surviving row ids, which go through top-k selection instead
+@profiler.timed()
+def run_query(df, sort_indexes, sort_col, ascending, num_results, rows=None):
+    if rows is not None:
+        rows = rows[select_top_k(df[sort_col].to_numpy()[rows], num_results, ascending)]
+    elif sort_col in sort_indexes:
+        rows = sort_indexes[sort_col].top_k(num_results, ascending)
+    else:
+        rows = select_top_k(df[sort_col], num_results, ascending)
+    return df.iloc[rows]
+
+# Splits a sort choice into the view it belongs to, the column to sort by and the direction
+def parse_choice(selected_order):
+    parts = selected_order.split()
+    view = {"wallet": "wallets", "rolling": "rolling"}.get(parts[0], "trades")
+    return view, parts[-2], parts[-1] == "ASC"
+
+# Checks a query the way the GUI's inputs do and returns it as (view, sort column, ascending, result count, filter clauses).
+# The result count is capped at MAX_RESULTS unless a caller that can show more passes its own max_results
+def parse_query(choice, num_results, filter_text="", max_results=None):
+    max_results = MAX_RESULTS if max_results is None else max_results
+    if choice not in SORT_CHOICES + WALLET_SORT_CHOICES + ROLLING_SORT_CHOICES:
+        raise ValueError(f"Unknown sort choice '{choice}'. Try one of: {', '.join(SORT_CHOICES + WALLET_SORT_CHOICES + ROLLING_SORT_CHOICES)}")
+    if not MIN_RESULTS <= num_results <= max_results:
+        raise ValueError(f"Enter a number between {MIN_RESULTS} and {max_results}.")
+    return (*parse_choice(choice), num_results, parse_filter(filter_text))
+
+# Opens the on-disk store behind a STORE_SOURCES source. The store modules import this one, so they are imported here
+def open_store(source, csv_file):
+    if shard_files(csv_file):
+        raise ValueError(f"The {source} source reads a single CSV file, not a folder of shards")
+    if source == "sqlite":
+        import Crypto_Data_Sql
+        return Crypto_Data_Sql.SqlTradeStore.open(csv_file)
+    import Crypto_Data_Partitions
+    return Crypto_Data_Partitions.PartitionedTradeStore.open(csv_file)
+
+# Holds one loaded dataset with its indexes and answers queries against it, so any number of queries share one load.
+# With a STORE_SOURCES source it holds an open on-disk store instead and every query is answered by it.
+# The lock lets appended trades be folded in on one thread while queries run on another
+class TradeEngine:
+    def __init__(self, source=None, csv_file=None):
+        self.source = DATA_SOURCE if source is None else source
+        self.csv_file = CSV_FILE if csv_file is None else csv_file
+        self.lock = threading.RLock()
+        self.df = self.sort_indexes = self.posting_indexes = self.aggregates = self.tail = self.wallet_stats = None
+        self.store = self.rolling = self.pair_flows = None
+
+    def loaded(self):
+        return self.df is not None or self.store is not None
+
+    # Loads the trades (or takes a dataset already loaded by load_dataset) and swaps them in for whatever was loaded before
+    def load(self, dataset=None):
+        if self.source in STORE_SOURCES:
+            store = open_store(self.source, self.csv_file)
+            # Partitions are a snapshot of the file, so only the database follows appended trades
+            tail = CsvTail(self.csv_file) if self.source == "sqlite" else None
+            if tail is not None:
+                tail.pairer = store.swap_leg_pairer()
+            with self.lock:
+                if self.store is not None:
+                    self.store.close()
+                self.store, self.tail = store, tail
+            return self
+        dataset = load_dataset(self.source, self.csv_file) if dataset is None else dataset
+        with self.lock:
+            self.df, self.sort_indexes, self.posting_indexes, self.aggregates, self.tail = dataset
+            self.wallet_stats = self.rolling = self.pair_flows = None
+        return self
+
+    # Takes over everything another engine loaded, e.g. one prefetched on a background thread
+    def adopt(self, other):
+        with self.lock, other.lock:
+            self.source, self.csv_file, self.store = other.source, other.csv_file, other.store
+            self.df, self.sort_indexes, self.posting_indexes, self.aggregates, self.tail = (
+                other.df, other.sort_indexes, other.posting_indexes, other.aggregates, other.tail)
+            self.wallet_stats, self.rolling, self.pair_flows = other.wallet_stats, other.rolling, other.pair_flows
+        return self
+
+    def row_count(self):
+        with self.lock:
+            return self.store.row_count() if self.store is not None else len(self.df)
+
+    # Returns the memory used by the lookup and filter indexes in megabytes (the database file size for sqlite)
+    def index_memory(self):
+        with self.lock:
+            return self.store.memory_mb() if self.store is not None else index_memory(self.posting_indexes)
+
+    # Reads any trades appended to the CSV and folds them in, returning them (or None if the file was rewritten)
+    def follow(self):
+        new_df = self.tail.read_new_rows()
+        if new_df is None or new_df.empty:
+            return new_df
+        profiler.count("trades appended", len(new_df))
+        with self.lock:
+            if self.store is not None:
+                self.store.append(new_df, self.store.row_count())
+                return new_df
+            first_row = len(self.df)
+            self.df = append_trades(self.df, self.sort_indexes, self.posting_indexes, self.aggregates, new_df)
+            earlier, later = self.tail.pairer.linked
+            if "pair_row" in self.df and len(earlier):
+                # Legs loaded before their mirror arrived get pointed at it now
+                pair_row = self.df["pair_row"].to_numpy().copy()
+                pair_row[earlier] = later
+                self.df["pair_row"] = pair_row
+            self.wallet_stats = None
+            if self.rolling is not None:
+                self.rolling.append(new_df)
+            if self.pair_flows is not None:
+                self.pair_flows.append(new_df, first_row)
+        return new_df
+
+    def key_transaction(self):
+        with self.lock:
+            if self.store is not None:
+                return self.store.key_transaction()
+            return key_transaction_frame(self.df, self.aggregates)
+
+    # Returns the wallet leaderboard, computing it the first time it is needed after the data changes
+    def get_wallet_stats(self):
+        with self.lock:
+            if self.wallet_stats is None:
+                self.wallet_stats = compute_wallet_stats(self.df)
+            return self.wallet_stats
+
+    # Returns the rolling window stats, building them the first time they are needed; appended trades are folded in after that
+    def get_rolling_stats(self):
+        with self.lock:
+            if self.rolling is None:
+                self.rolling = RollingWalletStats(self.df)
+            return self.rolling
+
+    # Returns the token pair flows, building them the first time they are needed; appended trades are folded in after that
+    def get_pair_flows(self):
+        with self.lock:
+            if self.store is not None:
+                raise ValueError(f"Token flows need the trades in memory, which the {self.source} source does not load")
+            if self.pair_flows is None:
+                self.pair_flows = TokenPairFlows(self.df)
+            return self.pair_flows
+
+    # Returns the trades that bought one token with another, found through the pair index
+    def pair_trades(self, bought, sold):
+        with self.lock:
+            return self.df.iloc[self.get_pair_flows().rows(bought, sold)]
+
+    # Returns the rows of a trades, wallets or rolling query, narrowed to the rows matching the filter clauses if there are any.
+    # Each view is timed as its own span, since a wallet summary and a sort index lookup differ by orders of magnitude
+    def query(self, view, sort_col, ascending, num_results, clauses=()):
+        profiler.count("queries")
+        with self.lock, profiler.span(f"query {view}"):
+            if view == "rolling":
+                if clauses:
+                    raise ValueError("Rolling wallet views cover every trade in the window, so they cannot be filtered")
+                if self.store is not None:
+                    raise ValueError(f"Rolling wallet views need the trades in memory, which the {self.source} source does not load")
+                return self.get_rolling_stats().top(sort_col, ascending, num_results)
+            if self.store is not None:
+                return self.store.query(view, sort_col, ascending, num_results, clauses)
+            if view == "trades":
+                rows = aggregate_rows(self.df, self.aggregates, sort_col, ascending, num_results, clauses)
+                if rows is not None:
+                    profiler.count("queries from aggregates")
+                    return self.df.iloc[rows]
+            rows = filter_rows(len(self.df), clauses, self.sort_indexes, self.posting_indexes) if clauses else None
+            if view == "wallets":
+                stats = self.get_wallet_stats() if rows is None else compute_wallet_stats(self.df.iloc[rows])
+                return stats.iloc[select_top_k(stats[sort_col], num_results, ascending)]
+            return run_query(self.df, self.sort_indexes, sort_col, ascending, num_results, rows)
+
+    # Returns the trades of a tx hash or wallet
+    def lookup(self, value):
+        with self.lock:
+            if self.store is not None:
+                return self.store.lookup(value)
+            return self.df.iloc[lookup_rows(self.posting_indexes, value)]
+
+# Writes a result to a text stream a chunk of rows at a time, as CSV or as one JSON object per line.
+# Every float column is a USD amount, so JSON floats are written to the cent like the CSV
+def write_results(frame, out, output_format="csv", header=True):
+    for start in range(0, max(len(frame), 1), OUTPUT_CHUNK_ROWS):
+        chunk = frame.iloc[start:start + OUTPUT_CHUNK_ROWS]
+        if output_format == "csv":
+            chunk.to_csv(out, header=header and start == 0, index=False, date_format=TIMESTAMP_FORMAT, lineterminator="\n")
+        elif len(chunk):
+            out.write(chunk.to_json(orient="records", lines=True, date_format="iso", date_unit="s", double_precision=2).rstrip("\n") + "\n")
+
+# Reads a batch file of JSON lines such as {"sort": "timestamp DESC", "count": 10, "filter": "token_bought=USDC"},
+# filling anything a line leaves out from the command line options
+def read_batch(lines, defaults):
+    queries = []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            queries.append(parse_query(item.get("sort", defaults.sort), int(item.get("count", defaults.count)),
+                                       item.get("filter", defaults.filter)))
+        except (ValueError, TypeError, AttributeError) as error:
+            raise ValueError(f"Batch line {number}: {error}") from error
+    return queries
+
+# Answers the query given on the command line, or every query in a batch file against a single load, writing the rows to stdout
+def main(argv=None):
+    global SWAP_LEG_POLICY
+    parser = argparse.ArgumentParser(description="Queries the crypto trades without the GUI and writes the results to stdout")
+    parser.add_argument("--csv", default=CSV_FILE, help="the CSV export to read, or a folder or quoted glob of shard files")
+    parser.add_argument("--source", choices=DATA_SOURCES, default=DATA_SOURCE)
+    parser.add_argument("--sort", default=SORT_CHOICES[0], help=f"one of: {', '.join(SORT_CHOICES + WALLET_SORT_CHOICES + ROLLING_SORT_CHOICES)}")
+    parser.add_argument("-n", "--count", type=int, default=AGGREGATE_TOP_N, help="number of results")
+    parser.add_argument("--filter", default="", help='e.g. "token_bought=USDC,DAI; trade_value_usd=1000000.."')
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="csv")
+    parser.add_argument("--key-transaction", action="store_true", help="write the highest value trade instead of the query")
+    parser.add_argument("--flows", action="store_true", help="write the token pairs with the most USD volume instead of the query")
+    parser.add_argument("--swap-policy", choices=SWAP_LEG_POLICIES, default=SWAP_LEG_POLICY,
+                        help='what to do with the two legs of a swap ("link" adds a pair_row column)')
+    parser.add_argument("--batch", help='file of JSON lines, one query each ("-" reads stdin); adds a "query" column numbering them')
+    args = parser.parse_args(argv)
+    SWAP_LEG_POLICY = args.swap_policy
+
+    try:
+        if args.batch is None:
+            queries = [parse_query(args.sort, args.count, args.filter)]
+        elif args.batch == "-":
+            queries = read_batch(sys.stdin, args)
+        else:
+            with open(args.batch, 'r') as file:
+                queries = read_batch(file, args)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    if args.source == "stream" and any(view != "trades" or clauses for view, *_, clauses in queries):
+        parser.error("Wallet views and filters need the data loaded, so they are not available with --source stream")
+    if any(view == "rolling" and (clauses or args.source in STORE_SOURCES) for view, *_, clauses in queries):
+        parser.error("Rolling wallet views cannot be filtered and need the trades in memory (--source csv or dune)")
+    if args.flows and args.source in STORE_SOURCES + ("stream",):
+        parser.error("Token flows need the trades in memory (--source csv or dune)")
+
+    trades = None if args.source == "stream" else TradeEngine(args.source, args.csv).load()
+    columns = None
+    try:
+        for number, (view, sort_col, ascending, num_results, clauses) in enumerate(queries, start=1):
+            if args.flows:
+                view = "flows"
+                flows = trades.get_pair_flows().frame()
+                result = flows.iloc[select_top_k(flows["volume_usd"], num_results, False)]
+            elif args.key_transaction:
+                view = "trades"
+                result = stream_query(args.csv, sort_col, ascending, 1)[1] if trades is None else trades.key_transaction()
+            elif trades is None:
+                result = stream_query(args.csv, sort_col, ascending, num_results)[0]
+            else:
+                result = trades.query(view, sort_col, ascending, num_results, clauses)
+            result = result[{"wallets": WALLET_COLUMNS, "rolling": ROLLING_COLUMNS, "flows": PAIR_COLUMNS}.get(
+                view, DATA_COLUMNS + (["pair_row"] if "pair_row" in result else []))]
+            if args.batch is not None:
+                result = result.assign(query=number)[["query", *result.columns]]
+            write_results(result, sys.stdout, args.format, header=list(result.columns) != columns)
+            columns = list(result.columns)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # The reader (e.g. head) stopped early; point stdout at devnull so the exit flush does not fail again
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,19 @@
+import time
+startup_start = time.perf_counter()
+
+import argparse
 import hashlib
+import importlib
 import json
+import os
+import sqlite3
 import tkinter as tk
-from tkinter import messagebox, ttk
+from tkinter import filedialog, messagebox, ttk
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-import pandas as pd
+import Crypto_Data_Profiler as profiler
 
 """
 
@@ -23,23 +32,183 @@ would be good to track.
 
 """
 
-# Defines my constants, sets the columns, sources the CSV file, and sets the window size
-CSV_FILE = "/Users/reillyturner/Desktop/FailingProject/extendedTradeData.csv"
-REQUIRED_COLUMNS = {"trader_wallet", "token_bought", "token_sold", "trade_value_usd", "timestamp", "tx_hash"}
-SORT_CHOICES = ['trade_value_usd DESC', 'trade_value_usd ASC', 'timestamp DESC', 'timestamp ASC']
-MIN_RESULTS = 1
-MAX_RESULTS = 99
+# Defines my constants, sets the window size, the table headings and how the GUI polls background work
 WINDOW_WIDTH = 800
 WINDOW_HEIGHT = 600
 COLUMNS = ("Wallet", "Token Bought", "Token Sold", "Trade Value (USD)", "Timestamp", "Tx Hash")
+WALLET_HEADINGS = ("Wallet", "Trades", "Total Volume (USD)", "Mean Trade (USD)", "Max Trade (USD)",
+                   "Tokens", "First Seen", "Last Seen")
+ROLLING_HEADINGS = ("Wallet", "Trades 1h", "Volume 1h (USD)", "Trades 24h", "Volume 24h (USD)", "Trades 7d", "Volume 7d (USD)")
+FLOW_HEADINGS = ("Token Bought", "Token Sold", "Trades", "Volume (USD)", "Reverse Volume (USD)")
+FLOW_ROWS = 6
+SCROLL_UNITS = 3
+WORKER_THREADS = 2
+POLL_INTERVAL_MS = 20
+
+# Sets how many results the table may be asked for; it only holds the rows that fit on screen, so this is far above
+# the engine's own MAX_RESULTS
+TABLE_MAX_RESULTS = 500000
+
+# Sets how often follow mode checks the CSV for appended trades
+FOLLOW_INTERVAL_MS = 500
+
+# Sets how many watchlist alerts are kept on screen; each user's watchlist is saved in a folder next to USER_DATA_FILE
+ALERT_LIMIT = 200
+ALERT_ROWS = 4
+watchlists = None
+
+# Chooses where accounts are kept: "sqlite" stores them in an indexed database that is migrated from users.json once,
+# "json" keeps the original whole-file users.json
 USER_DATA_FILE = "users.json"
+USER_DB_FILE = "users.db"
+USER_STORE = "sqlite"
+USER_STORES = ("sqlite", "json")
+USER_DB_TIMEOUT = 5.0
+user_store = None
+
+# NumPy, pandas and the query engine are imported on first use rather than up here, so the login window does not wait on them.
+# The trades are prefetched on a background thread while the login window is open
+LAZY_MODULES = ["numpy", "pandas", "Crypto_Data_Engine"]
+engine = None
+engine_lock = threading.Lock()
+prefetch = None
+
+# Sets how often the profiler overlay refreshes and where it exports spans and stack samples
+OVERLAY_INTERVAL_MS = 500
+OVERLAY_SPANS = 12
+PROFILE_SPANS_FILE = "profile_spans.json"
+PROFILE_STACKS_FILE = "profile_stacks.folded"
+
+# Collects how long each import took and when each startup milestone was reached, printed with --startup-report
+STARTUP_REPORT = False
+import_times = {"tkinter and the standard library": time.perf_counter() - startup_start}
+startup_marks = {}
+startup_reported = False
+
+# Records how long after startup a milestone was first reached
+def mark_startup(label):
+    startup_marks.setdefault(label, time.perf_counter() - startup_start)
+
+# Prints the import and milestone timings once, when the first data is on screen
+def print_startup_report():
+    global startup_reported
+    if not STARTUP_REPORT or startup_reported:
+        return
+    startup_reported = True
+    print("Startup report")
+    for name, seconds in import_times.items():
+        print(f"  import {name:<36} {seconds * 1000:8.1f} ms")
+    for label, seconds in startup_marks.items():
+        print(f"  {label:<43} {seconds * 1000:8.1f} ms after start")
+
+# Imports NumPy, pandas and the query engine the first time any of them is needed, timing each for the startup report.
+# If the prefetch thread is already importing them, the caller waits for it rather than importing twice
+def import_engine():
+    global engine
+    with engine_lock:
+        if engine is None:
+            for name in LAZY_MODULES:
+                start = time.perf_counter()
+                module = importlib.import_module(name)
+                thread = "" if threading.current_thread() is threading.main_thread() else " (background)"
+                import_times[name + thread] = time.perf_counter() - start
+            engine = module
+    return engine
+
+# Imports the engine and loads the trades on a daemon thread while the user types their credentials,
+# so the main window can show data straight away and closing the login window never waits on the load
+class Prefetch:
+    def __init__(self):
+        self.done = threading.Event()
+        self.trades = None
+        self.error = None
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        try:
+            import_engine()
+            if engine.DATA_SOURCE != "stream":
+                self.trades = engine.TradeEngine().load()
+                mark_startup("data prefetched")
+        except Exception as error:
+            self.error = error
+        finally:
+            self.done.set()
+
+    # Waits for the prefetch to finish and returns what it loaded, re-raising anything it failed with
+    def result(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.trades
 
-# Loads CSV
-def load_data():
-    df = pd.read_csv(CSV_FILE)
-    if not REQUIRED_COLUMNS.issubset(df.columns):
-        raise ValueError("CSV file is missing required columns")
-    return df
+def start_prefetch():
+    global prefetch
+    if prefetch is None:
+        prefetch = Prefetch()
+
+# Hands over the prefetched trades the first time they are asked for, and None after that so a refresh loads afresh
+def take_prefetched():
+    global prefetch
+    pending, prefetch = prefetch, None
+    return None if pending is None else pending.result()
+
+# Runs slow data jobs on background threads and hands each result back on the Tk thread, so the window never freezes.
+# Threads are used rather than processes because jobs share the loaded frame, and pandas/NumPy release the GIL for the heavy parts
+class TaskRunner:
+    def __init__(self, window, on_busy=None, workers=WORKER_THREADS):
+        self.window = window
+        self.on_busy = on_busy
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = {}
+
+    # Starts job(cancelled) in the background, cancelling any job still pending under the same name
+    def submit(self, name, job, on_done, on_error=None):
+        if name in self.pending:
+            future, cancelled = self.pending[name]
+            cancelled.set()
+            future.cancel()
+        cancelled = threading.Event()
+        future = self.executor.submit(job, cancelled)
+        future.submitted_at = time.perf_counter()
+        self.pending[name] = (future, cancelled)
+        self.notify()
+        self.window.after(POLL_INTERVAL_MS, self.poll, name, future, on_done, on_error)
+
+    # Checks from the Tk thread whether a job has finished, and delivers its result unless a newer job replaced it
+    def poll(self, name, future, on_done, on_error):
+        if not future.done():
+            self.window.after(POLL_INTERVAL_MS, self.poll, name, future, on_done, on_error)
+            return
+        if self.pending.get(name, (None,))[0] is not future:
+            return
+        del self.pending[name]
+        self.notify()
+
+        error = future.exception()
+        if error is None:
+            on_done(future.result())
+        elif on_error is not None:
+            on_error(error)
+        else:
+            raise error
+        # Times the whole round trip of a click, from submitting the job to its result being on screen
+        if profiler.enabled():
+            profiler.record(f"task {name}", future.submitted_at, time.perf_counter() - future.submitted_at)
+
+    def busy(self):
+        return bool(self.pending)
+
+    def notify(self):
+        if self.on_busy is not None:
+            self.on_busy(self.busy())
+
+    # Stops waiting on jobs when the window closes, dropping any that have not started
+    def shutdown(self):
+        for _, cancelled in self.pending.values():
+            cancelled.set()
+        self.pending.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
 # Checks if input is valid
 def validate_input(value):
@@ -47,53 +216,456 @@ def validate_input(value):
         messagebox.showerror("Invalid Input", "Please enter a valid number.")
         return None
     num = int(value)
-    if num < MIN_RESULTS or num > MAX_RESULTS:
-        messagebox.showerror("Invalid Input", f"Enter a number between {MIN_RESULTS} and {MAX_RESULTS}.")
+    if num < engine.MIN_RESULTS or num > TABLE_MAX_RESULTS:
+        messagebox.showerror("Invalid Input", f"Enter a number between {engine.MIN_RESULTS} and {TABLE_MAX_RESULTS}.")
         return None
     return num
 
+# Formats rows start:stop of a set of column arrays into Treeview values, touching only those rows
+@profiler.timed()
+def format_rows(columns, start, stop):
+    cells = []
+    for values in columns:
+        chunk = values[start:stop]
+        if chunk.dtype.kind == "M":
+            chunk = engine.pd.DatetimeIndex(chunk).strftime(engine.TIMESTAMP_FORMAT)
+        cells.append(chunk.tolist())
+    return list(zip(*cells))
+
+# Wraps a ttk.Treeview so only the rows that fit on screen exist as Treeview items, however long the result is
+class VirtualTable:
+    def __init__(self, parent, headings, height=None):
+        self.frame = tk.Frame(parent)
+        self.tree = ttk.Treeview(self.frame, show="headings", height=height or 10)
+        self.headings = None
+        self.set_headings(headings)
+        self.scrollbar = ttk.Scrollbar(self.frame, orient="vertical", command=self.yview)
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.pack(side="left", expand=True, fill="both")
+
+        self.columns = []
+        self.row_count = 0
+        self.first_row = 0
+        self.fixed_height = height
+        self.visible_count = height or 10
+
+        self.tree.bind("<Configure>", self.on_resize)
+        for event in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.tree.bind(event, self.on_mousewheel)
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    # Changes which columns the table shows, clearing the rows
+    def set_headings(self, headings):
+        self.tree.delete(*self.tree.get_children())
+        self.tree.configure(columns=headings)
+        for col in headings:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=120)
+        self.headings = headings
+
+    # Swaps in a new result, keeping it as column arrays rather than Treeview items
+    def set_frame(self, frame, columns=None, headings=COLUMNS):
+        if headings != self.headings:
+            self.set_headings(headings)
+        self.columns = [frame[col].to_numpy() for col in columns or engine.DATA_COLUMNS]
+        self.row_count = len(frame)
+        self.first_row = 0
+        self.render()
+
+    # Refills the pooled Treeview items with the rows currently scrolled into view
+    @profiler.timed("VirtualTable.render")
+    def render(self):
+        self.first_row = max(0, min(self.first_row, self.row_count - self.visible_count))
+        stop = min(self.row_count, self.first_row + self.visible_count)
+        rows = format_rows(self.columns, self.first_row, stop)
+        profiler.count("rows rendered", len(rows))
+
+        items = self.tree.get_children()
+        if len(items) > len(rows):
+            self.tree.delete(*items[len(rows):])
+        for item, values in zip(items, rows):
+            self.tree.item(item, values=values)
+        for values in rows[len(items):]:
+            self.tree.insert("", "end", values=values)
+
+        if self.row_count:
+            self.scrollbar.set(self.first_row / self.row_count, stop / self.row_count)
+        else:
+            self.scrollbar.set(0, 1)
+
+    # Handles the scrollbar's "moveto" and "scroll" commands by moving the window of rows being shown
+    def yview(self, *args):
+        if args[0] == "moveto":
+            self.first_row = int(float(args[1]) * self.row_count)
+        elif args[0] == "scroll":
+            step = int(args[1])
+            self.first_row += step * self.visible_count if args[2] == "pages" else step
+        self.render()
+
+    def on_mousewheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.yview("scroll", -SCROLL_UNITS, "units")
+        else:
+            self.yview("scroll", SCROLL_UNITS, "units")
+        return "break"
+
+    # Works out how many rows fit in the table (less one for the headings) whenever it is resized
+    def on_resize(self, event):
+        if self.fixed_height is None:
+            row_height = int(ttk.Style(self.tree).lookup("Treeview", "rowheight") or 25)
+            self.visible_count = max(1, event.height // row_height - 1)
+        self.render()
+
 # Updates the main table with the sorted data
+@profiler.timed()
 def update_main_table(sorted_df):
-    for row in table.get_children():
-        table.delete(row)
-    for _, row in sorted_df.iterrows():
-        table.insert("", "end", values=(
-            row["trader_wallet"], row["token_bought"], row["token_sold"],
-            row["trade_value_usd"], row["timestamp"], row["tx_hash"]
-        ))
-
-# Finds and displays the key transaction
-def update_key_transaction(df):
-    key_tx = df.loc[df['trade_value_usd'].idxmax()]
-    for row in key_tx_table.get_children():
-        key_tx_table.delete(row)
-    key_tx_table.insert("", "end", values=(
-        key_tx["trader_wallet"], key_tx["token_bought"], key_tx["token_sold"],
-        key_tx["trade_value_usd"], key_tx["timestamp"], key_tx["tx_hash"]
-    ))
+    table.set_frame(sorted_df)
+
+# Displays the key transaction
+@profiler.timed()
+def update_key_transaction(key_tx):
+    key_tx_table.set_frame(key_tx)
 
 # The instructions popup
 def show_info_popup():
     messagebox.showinfo("Project Info", "This application allows you to filter through recent crypto transactions.\n\n"
-                                        "You can sort the data, choose how many results to display (1-99), "
+                                        f"You can sort the data, choose how many results to display ({engine.MIN_RESULTS}-{TABLE_MAX_RESULTS}), "
                                         "and it will highlight the key transaction with the highest trade value.\n\n"
                                         "This tool is built for monitoring high value trades on the Ethereum blockchain.")
 
 # Function to sort the data based on the user specifications
 def update_table():
     selected_order = dropdown.get()
-    sort_col, order = selected_order.split()
-    ascending = (order == "ASC")
+    view, sort_col, ascending = engine.parse_choice(selected_order)
     
     num_results = validate_input(entry.get())
     if num_results is None:
         return
-    
-    sorted_df = df.sort_values(by=sort_col, ascending=ascending).head(num_results)
-    update_main_table(sorted_df)
-    update_key_transaction(df)
+    try:
+        clauses = engine.parse_filter(filter_entry.get())
+    except ValueError as error:
+        messagebox.showerror("Invalid Filter", str(error))
+        return
+    if trades.source == "stream":
+        if view != "trades" or clauses:
+            status_label.config(text="Wallet views and filters need the data loaded, so they are not available in streaming mode")
+            return
+        status_label.config(text=f"Streaming {selected_order} from {os.path.basename(trades.csv_file)}...")
+        submit_stream_query(sort_col, ascending, num_results)
+        return
+    if not trades.loaded():
+        status_label.config(text="Data is still loading...")
+        return
+
+    global last_query
+    last_query = (view, sort_col, ascending, num_results, clauses)
+    status_label.config(text=f"Sorting by {selected_order}...")
+    submit_query(view, sort_col, ascending, num_results, clauses)
+
+# Runs a query in the background and shows its results. If written_at is given (follow mode),
+# the status reports how long it took from the trades being written to them being on screen
+def submit_query(view, sort_col, ascending, num_results, clauses=(), written_at=None, appended=0):
+    start = time.perf_counter()
+
+    def query(cancelled):
+        with trades.lock:
+            if cancelled.is_set():
+                return None
+            return trades.query(view, sort_col, ascending, num_results, clauses), trades.key_transaction()
+
+    def show_results(result):
+        sorted_df, key_tx = result
+        if view == "wallets":
+            table.set_frame(sorted_df, engine.WALLET_COLUMNS, WALLET_HEADINGS)
+        elif view == "rolling":
+            table.set_frame(sorted_df, engine.ROLLING_COLUMNS, ROLLING_HEADINGS)
+        else:
+            update_main_table(sorted_df)
+        update_key_transaction(key_tx)
+        if written_at is None:
+            label = "wallets by rolling activity" if view == "rolling" else view
+            status_label.config(text=f"Showing {len(sorted_df):,} {label} ({time.perf_counter() - start:.2f}s)")
+        else:
+            follow_lags.append(time.time() - written_at)
+            status_label.config(text=f"+{appended:,} new trades, shown {follow_lags[-1] * 1000:.0f} ms after being written "
+                                     f"(average {sum(follow_lags) / len(follow_lags) * 1000:.0f} ms)")
+
+    tasks.submit("query", query, show_results, show_task_error)
+
+# Runs a query straight off the CSV in the background, for files too big to load
+def submit_stream_query(sort_col, ascending, num_results):
+    start = time.perf_counter()
+
+    def show_results(result):
+        sorted_df, key_tx = result
+        update_main_table(sorted_df)
+        update_key_transaction(key_tx)
+        status_label.config(text=f"Showing {len(sorted_df):,} trades ({time.perf_counter() - start:.2f}s)")
+
+    tasks.submit("query", lambda cancelled: engine.stream_query(trades.csv_file, sort_col, ascending, num_results),
+                 show_results, show_task_error)
+
+# Jumps straight to the trades of the tx hash or wallet typed into the search box
+def search_trades():
+    value = search_entry.get()
+    if not value.strip():
+        return
+    if not trades.loaded():
+        status_label.config(text="Data is still loading...")
+        return
+
+    def lookup(cancelled):
+        start = time.perf_counter()
+        found_df = trades.lookup(value)
+        return found_df, time.perf_counter() - start
+
+    def show_results(result):
+        found_df, seconds = result
+        update_main_table(found_df)
+        status_label.config(text=f"Found {len(found_df):,} trades for {value.strip()} ({seconds * 1e6:.0f} µs lookup)")
+
+    tasks.submit("query", lookup, show_results, show_task_error)
+
+# Shows or hides the token flows pane above the main table, fetching the flows when it is shown
+def toggle_flows():
+    if flows_var.get():
+        flows_pane.pack(before=table.frame, fill="x", padx=10, pady=(0, 5))
+        refresh_flows()
+    else:
+        flows_pane.pack_forget()
+
+# Fetches the token pair flows in the background; they are built the first time and kept up to date after that
+def refresh_flows():
+    if trades.source == "stream" or trades.source in engine.STORE_SOURCES:
+        status_label.config(text=f"Token flows need the trades in memory, which the {trades.source} source does not load")
+        return
+    if not trades.loaded():
+        status_label.config(text="Data is still loading...")
+        return
+
+    def flows(cancelled):
+        with trades.lock:
+            return trades.get_pair_flows().frame()
+
+    tasks.submit("flows", flows, show_flows, show_task_error)
+
+# Fills the flows pane with the pairs in the order last picked by clicking a heading
+@profiler.timed()
+def show_flows(flows_df):
+    global flows
+    flows = flows_df
+    col, ascending = flows_sort
+    ordered = flows.sort_values(col, ascending=ascending, kind="stable")
+    flows_tree.delete(*flows_tree.get_children())
+    for values in format_rows([ordered[col].to_numpy() for col in engine.PAIR_COLUMNS], 0, len(ordered)):
+        flows_tree.insert("", "end", values=values)
+
+# Sorts the flows by a clicked heading, flipping the order when the same heading is clicked again
+def sort_flows(col):
+    global flows_sort
+    flows_sort = (col, not flows_sort[1] if flows_sort[0] == col else col in ("token_bought", "token_sold"))
+    if flows is not None:
+        show_flows(flows)
+
+# Shows the trades of the pair clicked in the flows pane, found through the pair index rather than a scan
+def show_pair_trades(event):
+    selected = flows_tree.selection()
+    if not selected:
+        return
+    bought, sold = flows_tree.item(selected[0], "values")[:2]
+
+    def lookup(cancelled):
+        start = time.perf_counter()
+        found_df = trades.pair_trades(bought, sold)
+        return found_df, time.perf_counter() - start
+
+    def show_results(result):
+        found_df, seconds = result
+        update_main_table(found_df)
+        status_label.config(text=f"Showing {len(found_df):,} trades buying {bought} with {sold} ({seconds * 1e6:.0f} µs lookup)")
+
+    tasks.submit("query", lookup, show_results, show_task_error)
+
+# Starts or stops the progress bar whenever background work begins or ends
+def show_busy(busy):
+    if busy:
+        progress_bar.start()
+    else:
+        progress_bar.stop()
+
+# Reports a failed background job
+def show_task_error(error):
+    status_label.config(text="")
+    messagebox.showerror("Error", str(error))
+
+# Loads the trades, or takes the ones prefetched during login, and swaps them in for whatever was loaded before
+def load_job(cancelled):
+    prefetched = take_prefetched()
+    if prefetched is not None:
+        trades.adopt(prefetched)
+    else:
+        trades.load()
+    with trades.lock:
+        return trades.row_count(), trades.key_transaction(), trades.index_memory()
+
+# Shows the key transaction of freshly loaded data
+def on_data_loaded(result):
+    row_count, key_tx, index_mb = result
+    update_key_transaction(key_tx)
+    status_label.config(text=f"Loaded {row_count:,} trades ({index_mb:.1f} MB of lookup indexes)")
+    check_loaded_trades()
+    mark_startup("first data shown")
+    print_startup_report()
+
+# Reads any trades appended to the CSV, folds them into the loaded data and checks them against the watchlist
+def follow_job(cancelled):
+    new_df = trades.follow()
+    if new_df is None or new_df.empty or len(watchlist) == 0:
+        return new_df, None
+    return new_df, watchlist.check_batch(new_df)
+
+# Refreshes the table after trades were appended, or reloads everything if the CSV was rewritten
+def on_trades_appended(result):
+    new_df, checked = result
+    if checked is not None:
+        show_alerts(*checked, written_at=trades.tail.last_write_time)
+    if new_df is None:
+        refresh_data()
+    elif not new_df.empty:
+        if flows_var.get():
+            refresh_flows()
+        if last_query is not None:
+            submit_query(*last_query, written_at=trades.tail.last_write_time, appended=len(new_df))
+        else:
+            status_label.config(text=f"+{len(new_df):,} new trades")
+
+# Checks the CSV for appended trades every FOLLOW_INTERVAL_MS while follow mode is on
+def follow_tick():
+    if not follow_var.get():
+        return
+    if trades.tail is not None and not any(name in tasks.pending for name in ("load", "follow")):
+        tasks.submit("follow", follow_job, on_trades_appended, show_task_error)
+    window.after(FOLLOW_INTERVAL_MS, follow_tick)
+
+# Lists the trades of watched wallets at the top of the alerts, newest first, with how long the batch took to check.
+# For appended trades the time since they were written is shown too, and the window bell rings
+def show_alerts(matched, seconds, written_at=None):
+    if matched.empty:
+        return
+    shown = matched.iloc[::-1].head(ALERT_LIMIT)
+    for time_text, wallet, bought, sold, value in reversed(format_rows(
+            [shown[col].to_numpy() for col in ("timestamp", "trader_wallet", "token_bought", "token_sold", "trade_value_usd")], 0, len(shown))):
+        alerts_list.insert(0, f"{time_text}  {wallet} bought {bought} with {sold} for ${value:,.2f}")
+    alerts_list.delete(ALERT_LIMIT, "end")
+    found = f"{len(matched):,} trades by watched wallets"
+    if written_at is None:
+        alerts_label.config(text=f"Watchlist Alerts: {found} in the loaded data (checked in {seconds * 1000:.2f} ms)")
+    else:
+        alerts_label.config(text=f"Watchlist Alerts: {found}, checked in {seconds * 1000:.2f} ms "
+                                 f"and shown {(time.time() - written_at) * 1000:.0f} ms after being written")
+        window.bell()
+
+# Checks every loaded trade against the watchlist, after a load or a change to the list
+def check_loaded_trades():
+    if len(watchlist) == 0 or not trades.loaded() or trades.source in engine.STORE_SOURCES:
+        return
+    current = watchlist
+
+    def check(cancelled):
+        with trades.lock:
+            return current.check_batch(trades.df)
+
+    tasks.submit("watchlist check", check, lambda result: show_alerts(*result), show_task_error)
+
+# Swaps in an edited watchlist, saving it for the user and re-checking the loaded trades against it
+def set_watchlist(edited, save=True):
+    global watchlist
+    watchlist = edited
+    if save:
+        watchlists.save_watchlist(username, USER_DATA_FILE, watchlist)
+    watch_count_label.config(text=f"{len(watchlist):,} watched")
+    check_loaded_trades()
+
+# Reads the addresses typed into the watchlist box, warning about any that are not wallet addresses
+def entered_addresses():
+    try:
+        addresses = watchlists.parse_addresses(watch_entry.get())
+    except ValueError as error:
+        messagebox.showerror("Invalid Address", str(error))
+        return []
+    watch_entry.delete(0, "end")
+    return addresses
+
+def watch_wallets():
+    addresses = entered_addresses()
+    if addresses:
+        set_watchlist(watchlist.with_addresses(added=addresses))
+
+def unwatch_wallets():
+    addresses = entered_addresses()
+    if addresses:
+        set_watchlist(watchlist.with_addresses(removed=addresses))
+
+# Adds every address in a text or CSV file to the watchlist, reading and checking the file in the background
+def import_watchlist():
+    path = filedialog.askopenfilename(title="Import watchlist", filetypes=[("Address lists", "*.txt *.csv"), ("All files", "*")])
+    if not path:
+        return
+
+    def read(cancelled):
+        with open(path, 'r') as file:
+            return watchlists.parse_addresses(file.read())
+
+    tasks.submit("watchlist import", read, lambda addresses: set_watchlist(watchlist.with_addresses(added=addresses)),
+                 show_task_error)
+
+# Starts following the CSV when the follow checkbox is ticked
+def toggle_follow():
+    if follow_var.get():
+        follow_tick()
+
+# Shows or hides the profiler overlay; spans are only recorded while it is shown
+def toggle_profiler():
+    profiler.enable(profile_var.get())
+    if profile_var.get():
+        profile_overlay.place(relx=1.0, rely=1.0, x=-10, y=-10, anchor="se")
+        profile_overlay.lift()
+        update_profile_overlay()
+    else:
+        sample_var.set(False)
+        profiler.stop_sampling()
+        profile_overlay.place_forget()
+
+# Starts or stops the sampling profiler from the overlay
+def toggle_sampling():
+    if sample_var.get():
+        profiler.start_sampling()
+    else:
+        profiler.stop_sampling()
+
+# Refreshes the overlay with the latest span breakdown every OVERLAY_INTERVAL_MS while it is shown
+def update_profile_overlay():
+    if not profile_var.get():
+        return
+    text = profiler.format_summary(OVERLAY_SPANS)
+    if profiler.sampler is not None:
+        text += "\n" + "\n".join(f"{share:4.0%} {function}" for function, share in profiler.sampler.top_functions(5))
+    profile_text.config(text=text)
+    window.after(OVERLAY_INTERVAL_MS, update_profile_overlay)
+
+# Writes the recorded spans, and the stack samples if sampling is on, to files for offline analysis
+def export_profile():
+    written = profiler.export_spans(PROFILE_SPANS_FILE)
+    message = f"Exported {written:,} spans to {PROFILE_SPANS_FILE}"
+    if profiler.sampler is not None:
+        profiler.sampler.export(PROFILE_STACKS_FILE)
+        message += f" and stack samples to {PROFILE_STACKS_FILE}"
+    status_label.config(text=message)
 
 # Function which adjusts each component in the UI based on whether the user has selected dark or light mode
+@profiler.timed()
 def apply_theme(style, dark_mode):
     if dark_mode:
         bg, fg = "#2e2e2e", "#ffffff"
@@ -171,6 +743,9 @@ def apply_theme(style, dark_mode):
             widget.configure(background=entry_bg, foreground=entry_fg,
                             insertbackground=entry_fg, highlightthickness=0,
                             bd=1, relief="solid")
+
+        elif widget_class == "Listbox":
+            widget.configure(background=entry_bg, foreground=entry_fg, highlightthickness=0)
         
         elif widget_class == "Frame":
             widget.configure(background=bg, highlightthickness=0)
@@ -214,28 +789,99 @@ def toggle_theme():
     )
 
 # Attempts to load user data from JSON file
-def load_user_data():
+def load_user_data(path=USER_DATA_FILE):
     try:
-        with open(USER_DATA_FILE, 'r') as file:
+        with open(path, 'r') as file:
             return json.load(file)
     except FileNotFoundError:
         return {}
 
 # Stores the user data
-def save_user_data(user_data):
-    with open(USER_DATA_FILE, 'w') as file:
+def save_user_data(user_data, path=USER_DATA_FILE):
+    with open(path, 'w') as file:
         json.dump(user_data, file)
 
+# Keeps every account in one JSON file that is re-read on each lookup and rewritten on each signup
+class JsonUserStore:
+    def __init__(self, path=USER_DATA_FILE):
+        self.path = path
+
+    def get_user(self, username):
+        return load_user_data(self.path).get(username)
+
+    # Adds an account unless the username is taken, returning whether it was added
+    def add_user(self, username, password_hash, name):
+        user_data = load_user_data(self.path)
+        if username in user_data:
+            return False
+        user_data[username] = {"password": password_hash, "name": name}
+        save_user_data(user_data, self.path)
+        return True
+
+    def close(self):
+        pass
+
+# Keeps accounts in SQLite keyed by username, so a login is one primary-key lookup and a signup is one atomic insert.
+# WAL mode and the busy timeout let several app instances read and sign up against the same file at once
+class SqliteUserStore:
+    def __init__(self, path=USER_DB_FILE, json_path=USER_DATA_FILE):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=USER_DB_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS users "
+                                "(username TEXT PRIMARY KEY, password TEXT NOT NULL, name TEXT NOT NULL) WITHOUT ROWID")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        if json_path is not None:
+            self.migrate_json(json_path)
+
+    # Copies the accounts in users.json into the database the first time it is opened, inside one write transaction
+    # so a second instance starting at the same moment waits for it and then skips the import
+    def migrate_json(self, json_path):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            if self.connection.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone() is None:
+                rows = [(username, user["password"], user["name"]) for username, user in load_user_data(json_path).items()]
+                self.connection.executemany("INSERT OR IGNORE INTO users VALUES (?, ?, ?)", rows)
+                self.connection.execute("INSERT INTO meta VALUES ('json_migrated', ?)", (os.path.abspath(json_path),))
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def get_user(self, username):
+        row = self.connection.execute("SELECT password, name FROM users WHERE username = ?", (username,)).fetchone()
+        return None if row is None else {"password": row[0], "name": row[1]}
+
+    # Adds an account unless the username is taken; the primary key makes the check and the insert one atomic step
+    def add_user(self, username, password_hash, name):
+        try:
+            self.connection.execute("INSERT INTO users VALUES (?, ?, ?)", (username, password_hash, name))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def close(self):
+        self.connection.close()
+
+# Opens the configured user store the first time it is needed
+def get_user_store():
+    global user_store
+    if user_store is None:
+        if USER_STORE not in USER_STORES:
+            raise ValueError(f"USER_STORE must be one of {', '.join(USER_STORES)}, not {USER_STORE!r}")
+        user_store = SqliteUserStore(USER_DB_FILE, USER_DATA_FILE) if USER_STORE == "sqlite" else JsonUserStore(USER_DATA_FILE)
+    return user_store
+
 # Secures the password by hasing it
 def hash_password(password):
     return hashlib.sha256(password.encode('utf-8')).hexdigest()
 
 # Function to validate user's login by comparing input and stored password
+@profiler.timed()
 def login_user(username, password):
-    user_data = load_user_data()
-    if username in user_data:
-        if user_data[username]["password"] == hash_password(password):
-            return user_data[username]["name"]
+    user = get_user_store().get_user(username)
+    if user is not None and user["password"] == hash_password(password):
+        return user["name"]
     return None
 
 # Validate password to ensure it meets requirements
@@ -272,12 +918,8 @@ def signup_user(username, password, name):
     if not name_valid:
         return False, name_error
     
-    user_data = load_user_data()
-    if username in user_data:
+    if not get_user_store().add_user(username, hash_password(password), name):
         return False, "Username already taken"
-    
-    user_data[username] = {"password": hash_password(password), "name": name}
-    save_user_data(user_data)
     return True, "Signup successful! You can now login."
 
 # Creates the GUI login window with input fields, error/confirmation, and a buttons
@@ -347,8 +989,9 @@ def create_login_window():
             
         name = login_user(username, password)
         if name:
+            mark_startup("logged in")
             login_window.destroy()
-            show_main_window(name)
+            show_main_window(name, username)
         else:
             status_label.config(text="Invalid username or password")
 
@@ -376,11 +1019,16 @@ def create_login_window():
                             width=10, borderwidth=1, relief="solid")
     signup_button.pack(side="left", padx=5)
 
+    # Starts the prefetch only once the login window is drawn, so it does not hold the window up
+    login_window.after_idle(mark_startup, "login window shown")
+    login_window.after_idle(start_prefetch)
     login_window.mainloop()
 
 # Function to initialize the main GUI window and sets up all the different UI elements
 def setup_gui(user_name):
-    global dropdown, entry, table, key_tx_table, style, dark_mode_var, window, load_button
+    global dropdown, entry, table, key_tx_table, style, dark_mode_var, window, load_button, status_label, progress_bar, follow_var, filter_entry, search_entry
+    global profile_var, sample_var, profile_overlay, profile_text, flows_var, flows_pane, flows_tree
+    global watch_entry, watch_count_label, alerts_label, alerts_list
 
     window = tk.Tk()
     window.geometry(f'{WINDOW_WIDTH}x{WINDOW_HEIGHT}')
@@ -401,6 +1049,21 @@ def setup_gui(user_name):
                                 command=toggle_theme, borderwidth=0, highlightthickness=0)
     theme_check.pack(pady=(5, 0))
 
+    follow_var = tk.BooleanVar(value=False)
+    follow_check = tk.Checkbutton(window, text="Follow new trades", variable=follow_var,
+                                  command=toggle_follow, borderwidth=0, highlightthickness=0)
+    follow_check.pack()
+
+    profile_var = tk.BooleanVar(value=profiler.enabled())
+    profile_check = tk.Checkbutton(window, text="Profiler", variable=profile_var,
+                                   command=toggle_profiler, borderwidth=0, highlightthickness=0)
+    profile_check.pack()
+
+    flows_var = tk.BooleanVar(value=False)
+    flows_check = tk.Checkbutton(window, text="Token flows", variable=flows_var,
+                                 command=toggle_flows, borderwidth=0, highlightthickness=0)
+    flows_check.pack()
+
     info_button = tk.Button(window, text="ℹ️", font=("Arial", 12), 
                            command=show_info_popup, borderwidth=0, 
                            highlightthickness=0, relief="flat")
@@ -409,47 +1072,161 @@ def setup_gui(user_name):
     sort_label = tk.Label(window, text="Sort by:", anchor='center')
     sort_label.pack(pady=5)
     
-    dropdown = ttk.Combobox(window, values=SORT_CHOICES, state="readonly")
-    dropdown.set(SORT_CHOICES[0])
+    dropdown = ttk.Combobox(window, values=engine.SORT_CHOICES + engine.WALLET_SORT_CHOICES + engine.ROLLING_SORT_CHOICES, state="readonly")
+    dropdown.set(engine.SORT_CHOICES[0])
     dropdown.pack(pady=5)
 
-    result_label = tk.Label(window, text=f"Number of results ({MIN_RESULTS}-{MAX_RESULTS}):")
+    result_label = tk.Label(window, text=f"Number of results ({engine.MIN_RESULTS}-{TABLE_MAX_RESULTS}):")
     result_label.pack(pady=5)
     
     entry = tk.Entry(window, borderwidth=1, relief="solid", highlightthickness=0)
     entry.pack(pady=5)
 
+    filter_label = tk.Label(window, text="Filter (e.g. token_bought=USDC,DAI; trade_value_usd=1000000..):")
+    filter_label.pack(pady=5)
+
+    filter_entry = tk.Entry(window, borderwidth=1, relief="solid", highlightthickness=0, width=60)
+    filter_entry.pack(pady=5)
+
+    search_frame = tk.Frame(window)
+    search_frame.pack(pady=5)
+
+    search_label = tk.Label(search_frame, text="Tx hash or wallet:")
+    search_label.pack(side="left", padx=5)
+
+    search_entry = tk.Entry(search_frame, borderwidth=1, relief="solid", highlightthickness=0, width=50)
+    search_entry.pack(side="left", padx=5)
+    search_entry.bind("<Return>", lambda event: search_trades())
+
+    search_button = tk.Button(search_frame, text="Search", command=search_trades,
+                              borderwidth=1, relief="solid", highlightthickness=0, font=("Arial", 10))
+    search_button.pack(side="left", padx=5)
+
+    watch_frame = tk.Frame(window)
+    watch_frame.pack(pady=5)
+
+    watch_label = tk.Label(watch_frame, text="Watch wallets:")
+    watch_label.pack(side="left", padx=5)
+
+    watch_entry = tk.Entry(watch_frame, borderwidth=1, relief="solid", highlightthickness=0, width=44)
+    watch_entry.pack(side="left", padx=5)
+    watch_entry.bind("<Return>", lambda event: watch_wallets())
+
+    for text, command in (("Watch", watch_wallets), ("Unwatch", unwatch_wallets), ("Import...", import_watchlist)):
+        watch_button = tk.Button(watch_frame, text=text, command=command,
+                                 borderwidth=1, relief="solid", highlightthickness=0, font=("Arial", 10))
+        watch_button.pack(side="left", padx=2)
+
+    watch_count_label = tk.Label(watch_frame, text="")
+    watch_count_label.pack(side="left", padx=5)
+
     load_button = tk.Button(window, text="Load Data", command=update_table, 
                            borderwidth=1, relief="raised", highlightthickness=0,
                            padx=20, pady=5, font=("Arial", 10))
-    load_button.pack(pady=10)
+    load_button.pack(pady=(10, 0))
+
+    refresh_button = tk.Button(window, text="Refresh", command=refresh_data,
+                               borderwidth=1, relief="solid", highlightthickness=0, font=("Arial", 10))
+    refresh_button.pack(pady=5)
 
-    table = ttk.Treeview(window, columns=COLUMNS, show="headings")
-    for col in COLUMNS:
-        table.heading(col, text=col)
-        table.column(col, width=120)
+    status_label = tk.Label(window, text="")
+    status_label.pack()
+
+    progress_bar = ttk.Progressbar(window, mode="indeterminate", length=200)
+    progress_bar.pack(pady=(0, 5))
+
+    table = VirtualTable(window, COLUMNS)
     table.pack(expand=True, fill="both", pady=(0, 10))
 
+    # The token flows pane is packed above the main table while the Token flows box is ticked; clicking a pair shows its trades
+    flows_pane = tk.Frame(window)
+    flows_tree = ttk.Treeview(flows_pane, columns=FLOW_HEADINGS, show="headings", height=FLOW_ROWS, selectmode="browse")
+    for col, heading in zip(engine.PAIR_COLUMNS, FLOW_HEADINGS):
+        flows_tree.heading(heading, text=heading, command=lambda col=col: sort_flows(col))
+        flows_tree.column(heading, width=120)
+    flows_scrollbar = ttk.Scrollbar(flows_pane, orient="vertical", command=flows_tree.yview)
+    flows_tree.configure(yscrollcommand=flows_scrollbar.set)
+    flows_scrollbar.pack(side="right", fill="y")
+    flows_tree.pack(side="left", expand=True, fill="x")
+    flows_tree.bind("<<TreeviewSelect>>", show_pair_trades)
+
     key_tx_label = tk.Label(window, text="Key Transaction (Highest Trade Value)", 
                           font=('Arial', 12, 'bold'))
     key_tx_label.pack(pady=(5, 0))
     
-    key_tx_table = ttk.Treeview(window, columns=COLUMNS, show="headings", height=1)
-    for col in COLUMNS:
-        key_tx_table.heading(col, text=col)
-        key_tx_table.column(col, width=120)
+    key_tx_table = VirtualTable(window, COLUMNS, height=1)
     key_tx_table.pack(pady=5, fill="x")
+
+    alerts_label = tk.Label(window, text="Watchlist Alerts", font=('Arial', 12, 'bold'))
+    alerts_label.pack(pady=(5, 0))
+
+    alerts_list = tk.Listbox(window, height=ALERT_ROWS, borderwidth=1, relief="solid", highlightthickness=0, font=("Courier", 9))
+    alerts_list.pack(pady=(0, 10), padx=10, fill="x")
+
+    # The profiler overlay floats over the bottom right corner and is only placed while the Profiler box is ticked
+    profile_overlay = tk.Frame(window, borderwidth=1, relief="solid")
+    profile_text = tk.Label(profile_overlay, text="", font=("Courier", 9), justify="left", anchor="w")
+    profile_text.pack(fill="both", padx=5, pady=(5, 0))
+
+    profile_buttons = tk.Frame(profile_overlay)
+    profile_buttons.pack(pady=5)
+
+    sample_var = tk.BooleanVar(value=False)
+    sample_check = tk.Checkbutton(profile_buttons, text="Sample stacks", variable=sample_var,
+                                  command=toggle_sampling, borderwidth=0, highlightthickness=0)
+    sample_check.pack(side="left", padx=5)
+
+    export_button = tk.Button(profile_buttons, text="Export", command=export_profile,
+                              borderwidth=1, relief="solid", highlightthickness=0, font=("Arial", 10))
+    export_button.pack(side="left", padx=5)
+
+    reset_button = tk.Button(profile_buttons, text="Reset", command=profiler.reset,
+                             borderwidth=1, relief="solid", highlightthickness=0, font=("Arial", 10))
+    reset_button.pack(side="left", padx=5)
     
     apply_theme(style, dark_mode_var.get())
+    if profile_var.get():
+        toggle_profiler()
     
     return window
 
-# Loads the data and sets up the main GUI
-def show_main_window(user_name):
-    global df
-    df = load_data()
+# Reloads the trades in the background; sorting afterwards works on the loaded rows without fetching again
+def refresh_data():
+    if trades.source == "stream":
+        status_label.config(text="Streaming mode: each query reads the file in chunks")
+        return
+    status_label.config(text="Loading data...")
+    tasks.submit("load", load_job, on_data_loaded, show_task_error)
+
+# Sets up the main GUI straight away and loads the data in the background
+def show_main_window(user_name, user):
+    global trades, tasks, last_query, follow_lags, flows, flows_sort, watchlists, watchlist, username
+    trades = import_engine().TradeEngine()
+    watchlists = importlib.import_module("Crypto_Data_Watchlist")
+    watchlist, username = watchlists.Watchlist(), user
+    last_query = None
+    flows, flows_sort = None, ("volume_usd", False)
+    follow_lags = []
     app = setup_gui(user_name)
+    tasks = TaskRunner(app, on_busy=show_busy)
+
+    def close():
+        tasks.shutdown()
+        app.destroy()
+
+    app.protocol("WM_DELETE_WINDOW", close)
+    app.after_idle(mark_startup, "main window shown")
+    refresh_data()
+    tasks.submit("watchlist load", lambda cancelled: watchlists.load_watchlist(username, USER_DATA_FILE),
+                 lambda loaded: set_watchlist(loaded, save=False), show_task_error)
     app.mainloop()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crypto Trades Data Viewer")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="print import times and time to first window and first data once the data is shown")
+    parser.add_argument("--profile", action="store_true", help="record profiling spans from the start and show the overlay")
+    args = parser.parse_args()
+    STARTUP_REPORT = args.startup_report
+    profiler.enable(args.profile)
     create_login_window()
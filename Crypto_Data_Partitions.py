@@ -0,0 +1,252 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import Crypto_Data_Engine as engine
+import Crypto_Data_Profiler as profiler
+
+"""
+
+Time-partitioned layout for the query engine (DATA_SOURCE =
+"partitioned"). The trades are split into one columnar partition per
+day, each in the binary cache format of Crypto_Data_Engine.py, with a
+manifest recording every partition's row count and its min/max
+timestamp and trade_value_usd.
+
+Queries read the manifest first. Partitions that cannot satisfy a time
+range or value threshold are never opened, and a top-k sort reads
+partitions best bound first, stopping once no remaining partition can
+beat the k-th row, so "timestamp DESC" only touches the newest days.
+
+"""
+
+# Defines where the partitions are kept and how trades are split between them
+PARTITION_SUFFIX = ".partitions"
+PARTITION_FORMAT = "%Y-%m-%d"
+UNDATED_PARTITION = "undated"
+PARTITION_VERSION = 2
+WALLET_ORDER_NAME = "wallets"
+BOUND_COLUMNS = {"timestamp": "time", "trade_value_usd": "value"}
+
+# Returns the folder the partitions of a CSV file are stored in
+def partition_dir_for(csv_file):
+    return csv_file + PARTITION_SUFFIX
+
+# Returns the smallest and largest non-missing value of a column as JSON values, or None for both if every value is missing
+def column_bounds(values):
+    values = values.dropna()
+    if values.empty:
+        return None, None
+    low, high = values.min(), values.max()
+    if isinstance(low, pd.Timestamp):
+        return low.isoformat(), high.isoformat()
+    return float(low), float(high)
+
+# Splits the trades by day and writes each day with the rows it came from, then the manifest, then moves the layout into place
+@profiler.timed()
+def write_partitions(df, folder, fingerprint):
+    temp_folder = folder + ".tmp"
+    shutil.rmtree(temp_folder, ignore_errors=True)
+    os.makedirs(temp_folder)
+
+    day_codes, days = pd.factorize(df["timestamp"].dt.floor("D"), sort=True)
+    order = np.argsort(day_codes, kind="stable")
+    starts = np.searchsorted(day_codes[order], np.arange(-1, len(days) + 1))
+    partitions = []
+    for code in range(-1, len(days)):
+        rows = order[starts[code + 1]:starts[code + 2]]
+        if len(rows) == 0:
+            continue
+        part = df.iloc[rows].reset_index(drop=True)
+        for col in part.columns:
+            if isinstance(part[col].dtype, pd.CategoricalDtype):
+                part[col] = part[col].cat.remove_unused_categories()
+        part["row"] = rows
+        name = UNDATED_PARTITION if code < 0 else days[code].strftime(PARTITION_FORMAT)
+        engine.write_cache(part, os.path.join(temp_folder, name), fingerprint)
+        partition = {"name": name, "rows": len(rows)}
+        for col, label in BOUND_COLUMNS.items():
+            partition[f"min_{label}"], partition[f"max_{label}"] = column_bounds(part[col])
+        partitions.append(partition)
+    # Each partition keeps only its own wallets, so the order wallets first appear in the whole file is kept beside them
+    engine.write_categories(df["trader_wallet"].cat.categories, os.path.join(temp_folder, WALLET_ORDER_NAME))
+
+    manifest_path = os.path.join(temp_folder, engine.CACHE_MANIFEST)
+    with open(manifest_path, 'w') as file:
+        json.dump({"version": PARTITION_VERSION, "fingerprint": fingerprint, "partitions": partitions}, file)
+    shutil.rmtree(folder, ignore_errors=True)
+    os.replace(temp_folder, folder)
+
+# Reads the partition manifest, or returns None if it is missing or was written for another version of the CSV
+def read_manifest(folder, fingerprint):
+    try:
+        with open(os.path.join(folder, engine.CACHE_MANIFEST), 'r') as file:
+            manifest = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if manifest.get("version") != PARTITION_VERSION or manifest["fingerprint"] != fingerprint:
+        return None
+    for partition in manifest["partitions"]:
+        for bound in ("min_time", "max_time"):
+            if partition[bound] is not None:
+                partition[bound] = np.datetime64(partition[bound])
+    return manifest
+
+# Returns whether a partition can hold rows matching one predicate, judging ranges by its min/max and assuming value lists can match
+def predicate_may_match(partition, col, op, value):
+    if op != "between" or col not in BOUND_COLUMNS:
+        return True
+    label = BOUND_COLUMNS[col]
+    low, high = partition[f"min_{label}"], partition[f"max_{label}"]
+    if low is None:
+        return False
+    return (value[0] is None or high >= value[0]) and (value[1] is None or low <= value[1])
+
+# Returns whether a partition can hold rows matching every clause
+def partition_may_match(partition, clauses):
+    return all(any(predicate_may_match(partition, *predicate) for predicate in clause) for clause in clauses)
+
+# Evaluates parsed filter clauses against a frame directly, OR within a clause and AND across clauses
+def match_rows(frame, clauses):
+    mask = np.ones(len(frame), dtype=bool)
+    for clause in clauses:
+        clause_mask = np.zeros(len(frame), dtype=bool)
+        for col, op, value in clause:
+            values = frame[col]
+            if op == "in":
+                clause_mask |= values.isin(value).to_numpy()
+            else:
+                low, high = value
+                matched = values.notna().to_numpy()
+                if low is not None:
+                    matched = matched & (values >= low).to_numpy()
+                if high is not None:
+                    matched = matched & (values <= high).to_numpy()
+                clause_mask |= matched
+        mask &= clause_mask
+    return mask
+
+# Holds the partition manifest of one CSV and answers queries by opening only the partitions that can matter
+class PartitionedTradeStore:
+    def __init__(self, folder, manifest):
+        self.folder = folder
+        self.fingerprint = manifest["fingerprint"]
+        self.partitions = manifest["partitions"]
+        self.frames = {}
+        self.wallet_order = None
+        self.partitions_read = 0
+
+    # Opens the partitions of a CSV, splitting it first if they are missing or were built from another version of it
+    @classmethod
+    def open(cls, csv_file):
+        folder = partition_dir_for(csv_file)
+        # The rows stored depend on the swap leg policy, so partitions split under another policy are rebuilt
+        fingerprint = {**engine.file_fingerprint(csv_file), "swap_leg_policy": engine.SWAP_LEG_POLICY}
+        manifest = read_manifest(folder, fingerprint)
+        if manifest is None:
+            write_partitions(engine.pair_swap_legs(engine.load_data(csv_file=csv_file)), folder, fingerprint)
+            manifest = read_manifest(folder, fingerprint)
+        return cls(folder, manifest)
+
+    def close(self):
+        self.frames.clear()
+
+    # Memory-maps a partition (once) and returns its trades, indexed by the rows they had in the CSV
+    def read(self, partition):
+        frame = self.frames.get(partition["name"])
+        if frame is None:
+            frame = engine.read_cache(os.path.join(self.folder, partition["name"]), self.fingerprint)
+            if frame is None:
+                raise ValueError(f"Partition {partition['name']} is missing or out of date; delete {self.folder} to rebuild it")
+            frame = frame.set_index("row").rename_axis(None)
+            self.frames[partition["name"]] = frame
+        self.partitions_read += 1
+        return frame
+
+    # Returns every wallet in the order it first appears in the CSV, the order the in-memory engine lists tied wallets in
+    def wallets(self):
+        if self.wallet_order is None:
+            self.wallet_order = engine.read_categories(os.path.join(self.folder, WALLET_ORDER_NAME))
+        return self.wallet_order
+
+    # Returns the rows of a partition matching the filter clauses
+    def read_matching(self, partition, clauses):
+        frame = self.read(partition)
+        return frame[match_rows(frame, clauses)] if clauses else frame
+
+    # Returns the partitions that can hold matching rows, counting the ones pruned
+    def candidates(self, clauses=()):
+        matching = [partition for partition in self.partitions if partition_may_match(partition, clauses)]
+        profiler.count("partitions pruned", len(self.partitions) - len(matching))
+        return matching
+
+    def row_count(self):
+        return sum(partition["rows"] for partition in self.partitions)
+
+    # Returns the top rows for a sort. Partitions are read best bound first, and reading stops once k rows are held
+    # and the next partition's bound cannot beat the k-th of them (an equal bound is still read, since ties go to earlier rows)
+    @profiler.timed("partitioned_query")
+    def query(self, view, sort_col, ascending, num_results, clauses=()):
+        if view == "wallets":
+            return self.wallet_query(sort_col, ascending, num_results, clauses)
+        label = BOUND_COLUMNS[sort_col]
+        bound = f"min_{label}" if ascending else f"max_{label}"
+        partitions = self.candidates(clauses)
+        dated = sorted((partition for partition in partitions if partition[bound] is not None),
+                       key=lambda partition: partition[bound], reverse=not ascending)
+        frames, read = [], 0
+        values, rows, sources, positions = np.array([]), np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        for partition in dated + [partition for partition in partitions if partition[bound] is None]:
+            if len(values) >= num_results and not pd.isna(values[-1]) and (
+                    partition[bound] is None or (partition[bound] > values[-1] if ascending else partition[bound] < values[-1])):
+                break
+            frame = self.read_matching(partition, clauses)
+            column = frame[sort_col].to_numpy()
+            top = engine.select_top_k(column, num_results, ascending)
+            frames.append(frame)
+            read += 1
+
+            # Only the sort values and row ids of each partition's best rows are merged, in file order so ties go to the earliest row
+            values = np.concatenate((values, column[top])) if len(values) else column[top]
+            rows = np.concatenate((rows, frame.index.to_numpy()[top]))
+            sources = np.concatenate((sources, np.full(len(top), len(frames) - 1)))
+            positions = np.concatenate((positions, top))
+            order = np.argsort(rows, kind="stable")
+            order = order[engine.select_top_k(values[order], num_results, ascending)]
+            values, rows, sources, positions = values[order], rows[order], sources[order], positions[order]
+        profiler.count("partitions skipped by bound", len(partitions) - read)
+        if len(rows) == 0:
+            return pd.DataFrame(columns=engine.DATA_COLUMNS)
+        found = pd.concat([frames[source].iloc[positions[sources == source]] for source in np.unique(sources)])
+        return found.loc[rows]
+
+    # Summarises the wallets over the partitions that can match the filter clauses. The rows and wallets are put back
+    # in the order of the whole file first, so sums, ties and row labels come out as the in-memory engine gives them
+    def wallet_query(self, sort_col, ascending, num_results, clauses=()):
+        frames = [self.read_matching(partition, clauses) for partition in self.candidates(clauses)]
+        if not frames:
+            return pd.DataFrame(columns=engine.WALLET_COLUMNS)
+        rows = np.concatenate([frame.index.to_numpy() for frame in frames])
+        df = engine.concat_frames(frames).iloc[np.argsort(rows, kind="stable")]
+        stats = engine.compute_wallet_stats(df.assign(trader_wallet=df["trader_wallet"].cat.set_categories(self.wallets())))
+        return stats.iloc[engine.select_top_k(stats[sort_col], num_results, ascending)]
+
+    def key_transaction(self):
+        return self.query("trades", "trade_value_usd", False, 1)
+
+    # Finds the trades for a tx hash or wallet address. Neither says which day it traded, so every partition is checked
+    def lookup(self, value):
+        value = value.strip().lower()
+        columns = ["tx_hash"] if len(value) == engine.TX_HASH_LENGTH else ["trader_wallet"] if len(value) == engine.WALLET_LENGTH \
+            else ["tx_hash", "trader_wallet"]
+        found = [frame[np.logical_or.reduce([(frame[col] == value).to_numpy() for col in columns])]
+                 for frame in (self.read(partition) for partition in self.partitions)]
+        return pd.concat(found).sort_index() if found else pd.DataFrame(columns=engine.DATA_COLUMNS)
+
+    # Returns the size of the partitions on disk in megabytes
+    def memory_mb(self):
+        return sum(entry.stat().st_size for partition in self.partitions
+                   for entry in os.scandir(os.path.join(self.folder, partition["name"]))) / (1024 * 1024)
@@ -0,0 +1,225 @@
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+"""
+
+Lightweight instrumentation for the crypto trades viewer: timing
+spans with p50/p95/p99 over their recent durations, counters, an
+optional sampling profiler and an export of every span recorded, in the
+Chrome trace event format (chrome://tracing or ui.perfetto.dev).
+
+Everything is off until enable() is called. While it is off, a timed
+function costs one extra call and a flag check, and span() hands back
+a shared do-nothing context manager.
+
+"""
+
+# Sets how many durations each span keeps for its percentiles, how many spans are kept for export,
+# and how often the sampling profiler looks at the stacks
+HISTOGRAM_SAMPLES = 1024
+EXPORT_LIMIT = 200_000
+SAMPLE_INTERVAL = 0.005
+SAMPLE_DEPTH = 30
+PERCENTILES = (50, 95, 99)
+
+profiling = False
+lock = threading.Lock()
+spans = {}
+counters = collections.Counter()
+recorded = collections.deque(maxlen=EXPORT_LIMIT)
+clock_start = time.perf_counter()
+sampler = None
+
+# Keeps the recent durations of one span along with its totals
+class SpanStats:
+    def __init__(self):
+        self.durations = collections.deque(maxlen=HISTOGRAM_SAMPLES)
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+
+    def add(self, seconds):
+        self.durations.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+
+    # Returns the given percentiles of the recent durations (nearest rank)
+    def percentiles(self, points=PERCENTILES):
+        ordered = sorted(self.durations)
+        return [ordered[min(len(ordered) - 1, max(0, -(-point * len(ordered) // 100) - 1))] for point in points]
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_SPAN = NullSpan()
+
+# Switches recording on or off at runtime
+def enable(on=True):
+    global profiling
+    profiling = on
+
+def enabled():
+    return profiling
+
+# Records one finished span
+def record(name, start, seconds):
+    with lock:
+        stats = spans.get(name)
+        if stats is None:
+            stats = spans[name] = SpanStats()
+        stats.add(seconds)
+        recorded.append((name, start - clock_start, seconds, threading.get_ident()))
+
+@contextmanager
+def timing(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, start, time.perf_counter() - start)
+
+# Times a block of code as a named span, e.g. "with span('sort'):"
+def span(name):
+    return timing(name) if profiling else NULL_SPAN
+
+# Decorates a function so each call is recorded as a span (named after the function unless a name is given)
+def timed(name=None):
+    def decorate(function):
+        label = name or function.__name__
+
+        def wrapper(*args, **kwargs):
+            if not profiling:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(label, start, time.perf_counter() - start)
+
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        wrapper.__wrapped__ = function
+        return wrapper
+    return decorate
+
+# Adds to a named counter, e.g. rows rendered or queries run
+def count(name, amount=1):
+    if profiling:
+        with lock:
+            counters[name] += amount
+
+# Returns one summary per span, slowest total first: name, calls, last, mean and percentile durations in seconds
+def summary():
+    with lock:
+        rows = []
+        for name, stats in spans.items():
+            p50, p95, p99 = stats.percentiles()
+            rows.append({"name": name, "count": stats.count, "last": stats.last, "mean": stats.total / stats.count,
+                         "total": stats.total, "p50": p50, "p95": p95, "p99": p99})
+        return sorted(rows, key=lambda row: row["total"], reverse=True), dict(counters)
+
+# Formats the summary as fixed-width text for the overlay or a terminal
+def format_summary(limit=None):
+    rows, counts = summary()
+    lines = [f"{'span':<24}{'calls':>7}{'last':>10}{'p50':>10}{'p95':>10}{'p99':>10}"]
+    for row in rows[:limit]:
+        lines.append(f"{row['name'][:23]:<24}{row['count']:>7}" +
+                     "".join(f"{row[key] * 1000:>8.1f}ms" for key in ("last", "p50", "p95", "p99")))
+    lines += [f"{name}: {value:,}" for name, value in sorted(counts.items())]
+    if sampler is not None:
+        lines.append(f"stack samples: {sampler.sample_count:,}")
+    return "\n".join(lines)
+
+# Forgets every span, counter and stack sample recorded so far
+def reset():
+    with lock:
+        spans.clear()
+        counters.clear()
+        recorded.clear()
+    if sampler is not None:
+        sampler.reset()
+
+# Writes the recorded spans (and counters) as Chrome trace events, returning how many spans were written
+def export_spans(path):
+    with lock:
+        events = [{"name": name, "ph": "X", "ts": start * 1e6, "dur": seconds * 1e6, "pid": os.getpid(), "tid": tid}
+                  for name, start, seconds, tid in recorded]
+        events += [{"name": name, "ph": "C", "ts": (time.perf_counter() - clock_start) * 1e6, "pid": os.getpid(),
+                    "args": {name: value}} for name, value in counters.items()]
+    with open(path + ".tmp", 'w') as file:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+    os.replace(path + ".tmp", path)
+    return len(events) - len(counters)
+
+# Samples every thread's Python stack at a fixed interval on a daemon thread and counts how often each stack is seen,
+# which shows where time goes inside a span without instrumenting every function
+class StackSampler:
+    def __init__(self, interval=SAMPLE_INTERVAL, depth=SAMPLE_DEPTH):
+        self.interval = interval
+        self.depth = depth
+        self.stacks = collections.Counter()
+        self.sample_count = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def reset(self):
+        self.stacks.clear()
+        self.sample_count = 0
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.depth:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    # Returns the functions most often found running (innermost on a stack), with the share of samples they were seen in.
+    # Idle threads show up too, e.g. the Tk thread waiting in mainloop
+    def top_functions(self, limit=10):
+        seen = collections.Counter()
+        for stack, hits in list(self.stacks.items()):
+            seen[stack.rpartition(";")[2]] += hits
+        return [(function, hits / max(1, self.sample_count)) for function, hits in seen.most_common(limit)]
+
+    # Writes the stacks in the folded "a;b;c count" format that flame graph tools read
+    def export(self, path):
+        with open(path, 'w') as file:
+            for stack, hits in self.stacks.most_common():
+                file.write(f"{stack} {hits}\n")
+
+def start_sampling(interval=SAMPLE_INTERVAL):
+    global sampler
+    if sampler is None:
+        sampler = StackSampler(interval).start()
+    return sampler
+
+def stop_sampling():
+    global sampler
+    stopped, sampler = sampler, None
+    if stopped is not None:
+        stopped.stop()
+    return stopped
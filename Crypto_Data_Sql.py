@@ -0,0 +1,254 @@
+import io
+import json
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import Crypto_Data_Engine as engine
+import Crypto_Data_Profiler as profiler
+
+"""
+
+SQLite backend for the query engine (DATA_SOURCE = "sqlite"). The CSV
+is ingested once, a chunk at a time, into an indexed table next to it,
+and every query after that is a parameterized SELECT with the sort,
+filters and limit pushed down, so only the rows asked for ever reach
+pandas and the data no longer has to fit in memory.
+
+Column names in the SQL only ever come from the fixed lists below;
+every value the user typed is passed as a parameter.
+
+"""
+
+# Defines where the database is kept and how it is laid out
+DB_SUFFIX = ".sqlite"
+DB_VERSION = 2
+DB_TIMEOUT = 30.0
+SQL_COLUMNS = engine.DATA_COLUMNS
+INDEXED_COLUMNS = engine.SORT_COLUMNS + engine.POSTING_COLUMNS
+WALLET_SQL = {
+    "trade_count": "COUNT(*)",
+    "total_volume_usd": "SUM(trade_value_usd)",
+    "mean_trade_usd": "AVG(trade_value_usd)",
+    "max_trade_usd": "MAX(trade_value_usd)",
+    "first_seen": "MIN(timestamp)",
+    "last_seen": "MAX(timestamp)",
+}
+
+# Returns the database file kept next to a CSV file
+def db_path_for(csv_file):
+    return csv_file + DB_SUFFIX
+
+# Converts a typed chunk into row tuples for SQLite, with timestamps as Unix seconds and missing values as NULL
+def chunk_records(chunk):
+    columns = []
+    for col in SQL_COLUMNS:
+        values = chunk[col]
+        if col == "timestamp":
+            missing = values.isna().to_numpy()
+            seconds = values.to_numpy().astype("datetime64[s]").astype("int64").astype(object)
+            seconds[missing] = None
+            columns.append(seconds)
+        else:
+            columns.append(values.astype(object).where(values.notna(), None).to_numpy())
+    return zip(chunk.index.to_numpy().tolist(), *(column.tolist() for column in columns))
+
+# Numbers the wallets of a chunk from start onwards in the order they first appear, which is the order pandas keeps
+# their categories in, so wallets already numbered by an earlier chunk keep their number when inserted with OR IGNORE
+def wallet_rank_records(chunk, start):
+    return zip(chunk["trader_wallet"].cat.categories.tolist(), range(start, start + len(chunk["trader_wallet"].cat.categories)))
+
+# Turns a filter value into what is stored in the table
+def sql_value(col, value):
+    if value is None:
+        return None
+    if col == "timestamp":
+        return int(np.datetime64(value, "s").astype("int64"))
+    return float(value) if col == "trade_value_usd" else value
+
+# Builds the WHERE clause for parsed filter clauses: predicates are ORed within a clause and clauses are ANDed
+def where_sql(clauses):
+    conditions, params = [], []
+    for clause in clauses:
+        alternatives = []
+        for col, op, value in clause:
+            if col not in INDEXED_COLUMNS:
+                raise ValueError(f"Cannot filter on '{col}'")
+            if op == "in":
+                alternatives.append(f"{col} IN ({', '.join('?' * len(value))})")
+                params += list(value)
+            else:
+                low, high = (sql_value(col, bound) for bound in value)
+                bounds = [f"{col} >= ?"] * (low is not None) + [f"{col} <= ?"] * (high is not None)
+                alternatives.append("(" + (" AND ".join(bounds) or f"{col} IS NOT NULL") + ")")
+                params += [bound for bound in (low, high) if bound is not None]
+        conditions.append("(" + " OR ".join(alternatives) + ")")
+    return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+# Keeps the trades in an indexed SQLite table and answers queries with parameterized SQL
+class SqlTradeStore:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=DB_TIMEOUT, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+
+    # Opens the database for a CSV, ingesting the CSV first if the database is missing or was built from another version of it
+    @classmethod
+    def open(cls, csv_file):
+        path = db_path_for(csv_file)
+        # The rows stored depend on the swap leg policy, so a database ingested under another policy is rebuilt
+        fingerprint = {**engine.file_fingerprint(csv_file), "swap_leg_policy": engine.SWAP_LEG_POLICY}
+        if os.path.exists(path):
+            store = cls(path)
+            if store.fingerprint() == fingerprint:
+                return store
+            store.close()
+        ingest_csv(csv_file, path, fingerprint)
+        return cls(path)
+
+    def close(self):
+        self.connection.close()
+
+    # Returns the fingerprint of the CSV the database was ingested from, or None if it was never finished or has an old layout
+    def fingerprint(self):
+        try:
+            meta = dict(self.connection.execute("SELECT key, value FROM meta WHERE key IN ('version', 'fingerprint')").fetchall())
+        except sqlite3.DatabaseError:
+            return None
+        if meta.get("version") != str(DB_VERSION) or "fingerprint" not in meta:
+            return None
+        return json.loads(meta["fingerprint"])
+
+    # Returns a swap leg pairer holding the ingested legs that never met their mirror, so appended trades can still pair with them
+    def swap_leg_pairer(self):
+        meta = dict(self.connection.execute("SELECT key, value FROM meta WHERE key IN ('swap_legs', 'swap_tokens')").fetchall())
+        pairer = engine.SwapLegPairer()
+        if pairer.policy != "keep":
+            state = json.loads(meta["swap_tokens"])
+            legs = np.load(io.BytesIO(meta["swap_legs"]))
+            pairer.token_ids = {token: token_id for token_id, token in enumerate(state["tokens"], start=1)}
+            pairer.keys, pairer.mirror_keys, pairer.rows = legs["keys"], legs["mirror_keys"], legs["rows"]
+            pairer.next_row = state["next_row"]
+        return pairer
+
+    # Runs a SELECT and returns its rows as a frame with the same types the CSV loader produces
+    def select(self, sql, params, columns):
+        frame = pd.DataFrame.from_records(self.connection.execute(sql, params).fetchall(), columns=["id", *columns])
+        frame = frame.set_index("id").rename_axis(None)
+        for col in ("timestamp", "first_seen", "last_seen"):
+            if col in frame:
+                frame[col] = pd.to_datetime(frame[col], unit="s")
+        for col in ("trade_value_usd", "total_volume_usd", "mean_trade_usd", "max_trade_usd"):
+            if col in frame:
+                frame[col] = frame[col].astype("float64")
+        return frame
+
+    def row_count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM trades").fetchone()[0]
+
+    # Returns the top rows for a sort, with missing values last and ties in file order like a stable sort_values.
+    # Rows with a value come from an index scan, and only if there are too few of them are the missing ones read
+    @profiler.timed("sql_query")
+    def query(self, view, sort_col, ascending, num_results, clauses=()):
+        if view == "wallets":
+            return self.wallet_query(sort_col, ascending, num_results, clauses)
+        if sort_col not in engine.SORT_COLUMNS:
+            raise ValueError(f"Cannot sort on '{sort_col}'")
+        where, params = where_sql(clauses)
+        joiner = " AND " if where else " WHERE "
+        direction = "ASC" if ascending else "DESC"
+        select = f"SELECT id, {', '.join(SQL_COLUMNS)} FROM trades{where}"
+        rows = self.select(f"{select}{joiner}{sort_col} IS NOT NULL ORDER BY {sort_col} {direction}, id LIMIT ?",
+                           [*params, num_results], SQL_COLUMNS)
+        if len(rows) < num_results:
+            missing = self.select(f"{select}{joiner}{sort_col} IS NULL ORDER BY id LIMIT ?",
+                                  [*params, num_results - len(rows)], SQL_COLUMNS)
+            rows = pd.concat([rows, missing]) if len(missing) else rows
+        return rows
+
+    # Summarises the (filtered) trades per wallet in SQL and returns the top wallets for a sort.
+    # Ties go to the wallet that first appears earliest in the file, the order the in-memory engine groups wallets in
+    def wallet_query(self, sort_col, ascending, num_results, clauses=()):
+        if sort_col not in WALLET_SQL:
+            raise ValueError(f"Cannot sort wallets on '{sort_col}'")
+        where, params = where_sql(clauses)
+        aggregates = ", ".join(f"{expression} AS {name}" for name, expression in WALLET_SQL.items())
+        sql = (f"WITH matched AS (SELECT * FROM trades{where}), "
+               f"stats AS (SELECT trader_wallet, {aggregates} FROM matched WHERE trader_wallet IS NOT NULL GROUP BY trader_wallet), "
+               f"tokens AS (SELECT trader_wallet, COUNT(*) AS distinct_tokens FROM (SELECT trader_wallet, token_bought AS token FROM matched "
+               f"UNION SELECT trader_wallet, token_sold FROM matched) WHERE token IS NOT NULL GROUP BY trader_wallet) "
+               f"SELECT ROW_NUMBER() OVER () AS id, stats.*, COALESCE(tokens.distinct_tokens, 0) FROM stats LEFT JOIN tokens USING (trader_wallet) "
+               f"JOIN wallets USING (trader_wallet) ORDER BY {sort_col} IS NULL, {sort_col} {'ASC' if ascending else 'DESC'}, wallets.rank LIMIT ?")
+        stats = self.select(sql, [*params, num_results], ["trader_wallet", *WALLET_SQL, "distinct_tokens"])
+        stats["mean_trade_usd"] = stats["mean_trade_usd"].round(2)
+        return stats[engine.WALLET_COLUMNS].reset_index(drop=True)
+
+    # Returns the highest value trade (earliest on ties) as a one row frame
+    def key_transaction(self):
+        return self.query("trades", "trade_value_usd", False, 1)
+
+    # Finds the trades for a tx hash or wallet address, telling the two apart by length like lookup_rows
+    def lookup(self, value):
+        value = value.strip().lower()
+        columns = ["tx_hash"] if len(value) == engine.TX_HASH_LENGTH else ["trader_wallet"] if len(value) == engine.WALLET_LENGTH \
+            else ["tx_hash", "trader_wallet"]
+        where = " OR ".join(f"{col} = ?" for col in columns)
+        return self.select(f"SELECT id, {', '.join(SQL_COLUMNS)} FROM trades WHERE {where} ORDER BY id",
+                           [value] * len(columns), SQL_COLUMNS)
+
+    # Inserts appended trades (numbered from first_row onwards) in one transaction
+    def append(self, new_df, first_row):
+        new_df = new_df.set_axis(pd.RangeIndex(first_row, first_row + len(new_df)))
+        with self.connection:
+            self.connection.executemany(f"INSERT INTO trades VALUES ({', '.join('?' * (len(SQL_COLUMNS) + 1))})",
+                                        chunk_records(new_df))
+            next_rank = self.connection.execute("SELECT COALESCE(MAX(rank), -1) + 1 FROM wallets").fetchone()[0]
+            self.connection.executemany("INSERT OR IGNORE INTO wallets VALUES (?, ?)", wallet_rank_records(new_df, next_rank))
+
+    # Returns the size of the database file (table and indexes) in megabytes
+    def memory_mb(self):
+        return sum(os.path.getsize(self.path + suffix) for suffix in ("", "-wal") if os.path.exists(self.path + suffix)) / (1024 * 1024)
+
+# Streams a CSV into a fresh database a chunk at a time, builds the indexes once all rows are in,
+# and only then moves it into place, so a half ingested database is never opened
+@profiler.timed()
+def ingest_csv(csv_file, path, fingerprint):
+    temp_path = path + ".tmp"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(temp_path + suffix):
+            os.remove(temp_path + suffix)
+    connection = sqlite3.connect(temp_path)
+    try:
+        connection.execute("PRAGMA journal_mode=OFF")
+        connection.execute("PRAGMA synchronous=OFF")
+        connection.execute("CREATE TABLE trades (id INTEGER PRIMARY KEY, trader_wallet TEXT, token_bought TEXT, "
+                           "token_sold TEXT, trade_value_usd REAL, timestamp INTEGER, tx_hash TEXT)")
+        connection.execute("CREATE TABLE wallets (trader_wallet TEXT PRIMARY KEY, rank INTEGER NOT NULL) WITHOUT ROWID")
+        connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        placeholders = ", ".join("?" * (len(SQL_COLUMNS) + 1))
+        pairer = engine.SwapLegPairer()
+        next_rank = 0
+        with connection:
+            for chunk in engine.read_trade_chunks(csv_file, pairer=pairer):
+                connection.executemany(f"INSERT INTO trades VALUES ({placeholders})", chunk_records(chunk))
+                connection.executemany("INSERT OR IGNORE INTO wallets VALUES (?, ?)", wallet_rank_records(chunk, next_rank))
+                next_rank += len(chunk["trader_wallet"].cat.categories)
+            for col in INDEXED_COLUMNS:
+                connection.execute(f"CREATE INDEX trades_{col} ON trades ({col})")
+            connection.execute("INSERT INTO meta VALUES ('version', ?)", (str(DB_VERSION),))
+            connection.execute("INSERT INTO meta VALUES ('fingerprint', ?)", (json.dumps(fingerprint),))
+            # The legs still waiting for a mirror are kept so trades appended to the CSV later can pair with them
+            legs = io.BytesIO()
+            np.savez(legs, keys=pairer.keys, mirror_keys=pairer.mirror_keys, rows=pairer.rows)
+            connection.execute("INSERT INTO meta VALUES ('swap_legs', ?)", (legs.getvalue(),))
+            connection.execute("INSERT INTO meta VALUES ('swap_tokens', ?)",
+                               (json.dumps({"tokens": list(pairer.token_ids), "next_row": pairer.next_row}),))
+        connection.execute("ANALYZE")
+    finally:
+        connection.close()
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.replace(temp_path, path)
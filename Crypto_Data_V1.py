@@ -35,8 +35,7 @@ ORDER BY {selected_order}
     results = query_result.get("result", [])  # Extract the result data
     
     # Clear old data in the table
-    for row in table.get_children():
-        table.delete(row)
+    table.delete(*table.get_children())
 
     # Insert new data
     for row in results:
@@ -35,19 +35,17 @@ def validate_input(value):
 
 # Update the main data table
 def update_main_table(sorted_df):
-    for row in table.get_children():
-        table.delete(row)
-    for _, row in sorted_df.iterrows():
+    table.delete(*table.get_children())
+    for row in sorted_df.itertuples(index=False):
         table.insert("", "end", values=(
-            row["trader_wallet"], row["token_bought"], row["token_sold"],
-            row["trade_value_usd"], row["timestamp"], row["tx_hash"]
+            row.trader_wallet, row.token_bought, row.token_sold,
+            row.trade_value_usd, row.timestamp, row.tx_hash
         ))
 
 # Update the key transaction table
 def update_key_transaction(df):
     key_tx = df.loc[df['trade_value_usd'].idxmax()]
-    for row in key_tx_table.get_children():
-        key_tx_table.delete(row)
+    key_tx_table.delete(*key_tx_table.get_children())
     key_tx_table.insert("", "end", values=(
         key_tx["trader_wallet"], key_tx["token_bought"], key_tx["token_sold"],
         key_tx["trade_value_usd"], key_tx["timestamp"], key_tx["tx_hash"]
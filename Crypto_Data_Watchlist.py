@@ -0,0 +1,154 @@
+import os
+import re
+import time
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+import Crypto_Data_Profiler as profiler
+
+"""
+
+Wallet watchlists for the crypto trades viewer: the wallets a user has
+chosen to track, checked against every batch of trades that arrives so
+the app can raise an alert the moment one of them trades.
+
+A watchlist keeps its addresses in a hash table (a pandas Index), so a
+batch is checked with one vectorized lookup of its distinct wallets
+rather than a Python loop over rows. An optional Bloom filter in front
+of it answers "definitely not watched" for most wallets with a few
+array operations, leaving only its candidates for the exact lookup.
+
+Each user's watchlist is a text file of addresses, one per line, in a
+folder next to users.json.
+
+"""
+
+# Defines where watchlists are kept: one file per user in a folder beside the users file
+WATCHLIST_DIR = "watchlists"
+WATCHLIST_SUFFIX = ".txt"
+ADDRESS_PATTERN = re.compile(r"0x[0-9a-f]{40}")
+
+# Sizes the optional Bloom prefilter; 10 bits and 7 hashes per address give about a 1% false positive rate.
+# Off by default, since the hash table lookup of a batch's distinct wallets is already cheaper than hashing them twice
+USE_BLOOM = False
+BLOOM_BITS_PER_ADDRESS = 10
+BLOOM_HASHES = 7
+BLOOM_KEYS = ("watchlist-bloom1", "watchlist-bloom2")
+
+# Returns the file a user's watchlist is kept in, next to the users file
+def watchlist_path(username, user_file):
+    folder = os.path.join(os.path.dirname(os.path.abspath(user_file)), WATCHLIST_DIR)
+    return os.path.join(folder, quote(username, safe="") + WATCHLIST_SUFFIX)
+
+# Turns pasted or loaded text (addresses separated by spaces, commas or new lines) into lower case addresses,
+# raising ValueError on anything that is not a wallet address
+def parse_addresses(text):
+    addresses = [value.lower() for value in re.split(r"[\s,;]+", text) if value]
+    invalid = [value for value in addresses if not ADDRESS_PATTERN.fullmatch(value)]
+    if invalid:
+        raise ValueError(f"Not a wallet address: {invalid[0]}" + (f" (and {len(invalid) - 1:,} more)" if len(invalid) > 1 else ""))
+    return addresses
+
+# Hashes strings to 64-bit integers in one vectorized pass
+def address_hashes(values, key):
+    return pd.util.hash_array(np.asarray(values, dtype=object), hash_key=key)
+
+# A Bloom filter over addresses, kept as a packed bit array. Each address sets BLOOM_HASHES bits picked by double hashing
+class BloomFilter:
+    def __init__(self, addresses, bits_per_address=BLOOM_BITS_PER_ADDRESS, hashes=BLOOM_HASHES):
+        self.size = np.uint64(max(64, len(addresses) * bits_per_address))
+        self.hashes = hashes
+        self.bits = np.zeros(int(self.size + np.uint64(7)) // 8, dtype=np.uint8)
+        positions = self.positions(addresses)
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+
+    # Returns the bit positions of each address, one row per address
+    def positions(self, values):
+        first, second = (address_hashes(values, key) for key in BLOOM_KEYS)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        return (first[:, None] + steps * (second | np.uint64(1))[:, None]) % self.size
+
+    # Returns False for addresses certainly not in the filter and True for ones that may be
+    def may_contain(self, values):
+        positions = self.positions(values)
+        return ((self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1).all(axis=1)
+
+    def memory_mb(self):
+        return self.bits.nbytes / (1024 * 1024)
+
+# The wallets one user is tracking, with a vectorized membership test for whole batches of trades
+class Watchlist:
+    def __init__(self, addresses=(), bloom=USE_BLOOM):
+        self.use_bloom = bloom
+        self.index = pd.Index(pd.unique(np.asarray(list(addresses), dtype=object)), dtype=object)
+        self.bloom = BloomFilter(self.index.to_numpy()) if bloom and len(self.index) else None
+        # The Index builds its hash table on the first lookup, so it is built here rather than while the first batch waits
+        self.index.get_indexer(self.index[:1])
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, address):
+        return address in self.index
+
+    def addresses(self):
+        return self.index.tolist()
+
+    # Returns a new watchlist with addresses added or removed (lists are rebuilt rather than edited, so a batch
+    # being matched on another thread always sees a whole one)
+    def with_addresses(self, added=(), removed=()):
+        kept = self.index.difference(pd.Index(list(removed), dtype=object), sort=False) if removed else self.index
+        return Watchlist(kept.append(pd.Index(list(added), dtype=object)), self.use_bloom)
+
+    # Returns which of a set of distinct addresses are watched, using the Bloom filter to skip most of the exact lookups
+    def contains(self, values):
+        values = np.asarray(values, dtype=object)
+        found = np.zeros(len(values), dtype=bool)
+        if len(self.index) == 0 or len(values) == 0:
+            return found
+        candidates = np.arange(len(values)) if self.bloom is None else np.flatnonzero(self.bloom.may_contain(values))
+        found[candidates] = self.index.get_indexer(values[candidates]) >= 0
+        return found
+
+    # Returns which rows of a batch were traded by a watched wallet. Categorical wallets are checked once per
+    # distinct wallet and the answer spread over the rows through their codes, unless the batch is a slice of
+    # a bigger frame holding more categories than rows
+    @profiler.timed("watchlist_match")
+    def match(self, df):
+        wallets = df["trader_wallet"]
+        if isinstance(wallets.dtype, pd.CategoricalDtype) and len(wallets.cat.categories) <= len(wallets):
+            watched = self.contains(wallets.cat.categories.to_numpy())
+            codes = wallets.cat.codes.to_numpy()
+            return np.where(codes >= 0, watched[codes], False)
+        present = wallets.notna().to_numpy()
+        found = np.zeros(len(df), dtype=bool)
+        found[present] = self.contains(wallets.to_numpy()[present])
+        return found
+
+    # Returns the trades of a batch made by watched wallets and how long the check took
+    def check_batch(self, df):
+        start = time.perf_counter()
+        matched = df[self.match(df)]
+        profiler.count("watchlist matches", len(matched))
+        return matched, time.perf_counter() - start
+
+    def memory_mb(self):
+        return (self.index.memory_usage(deep=True) + (self.bloom.bits.nbytes if self.bloom is not None else 0)) / (1024 * 1024)
+
+# Reads a user's watchlist, or an empty one if they have not saved any
+def load_watchlist(username, user_file, bloom=USE_BLOOM):
+    try:
+        with open(watchlist_path(username, user_file), 'r') as file:
+            return Watchlist(parse_addresses(file.read()), bloom)
+    except FileNotFoundError:
+        return Watchlist(bloom=bloom)
+
+# Writes a user's watchlist to a temporary file first, so a crash never leaves half a list behind
+def save_watchlist(username, user_file, watchlist):
+    path = watchlist_path(username, user_file)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", 'w') as file:
+        file.write("".join(address + "\n" for address in watchlist.addresses()))
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# The modules live side by side at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Crypto_Data_Engine as engine
+
+# Writes trades given as (wallet, bought, sold, value, "dd/mm/yyyy hh:mm") tuples to a CSV in the export's layout,
+# numbering the tx hashes so every trade is its own swap
+@pytest.fixture
+def write_trades(tmp_path):
+    def write(trades, name="trades.csv"):
+        path = tmp_path / name
+        lines = [",".join(engine.DATA_COLUMNS)]
+        for number, (wallet, bought, sold, value, timestamp) in enumerate(trades):
+            lines.append(f"{wallet},{bought},{sold},{value},{timestamp},0x{number:064x}")
+        path.write_text("\n".join(lines) + "\n")
+        return str(path)
+    return write
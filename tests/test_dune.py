@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+import Crypto_Data_Dune as dune
+
+ROWS = [{"trader_wallet": "0xfac983fce7ef3cee8ffb2ceb967e1b2362aada00", "token_bought": "DAI", "token_sold": "USDC",
+         "trade_value_usd": 26595002.51, "timestamp": "2025-03-21 22:44:00.000 UTC",
+         "tx_hash": "0xad3d7ca2979af2446fde4359f43672619623e5daa7958f2aa8e0b3abcda3c294"}]
+QUERY_ID = dune.DUNE_QUERY_ID
+LATEST = ("GET", f"/api/v1/query/{QUERY_ID}/results")
+EXECUTE = ("POST", f"/api/v1/query/{QUERY_ID}/execute")
+
+@pytest.fixture
+def stub():
+    with dune.DuneStubServer(ROWS) as server:
+        yield server
+
+# Stands in for asyncio.sleep, recording each wait instead of taking it
+class Sleeps(list):
+    async def __call__(self, delay):
+        self.append(delay)
+
+def make_client(stub, sleeps, **kwargs):
+    return dune.AsyncDuneClient(stub.api_key, base_url=stub.url, sleep=sleeps, **kwargs)
+
+def test_first_fetch_executes_and_polls_with_backoff(stub):
+    stub.pending_polls = 3
+    sleeps = Sleeps()
+    assert asyncio.run(make_client(stub, sleeps).fetch_rows()) == ROWS
+    polls = [("GET", "/api/v1/execution/stub-1/status")] * 4
+    assert stub.requests == [LATEST, EXECUTE, *polls, ("GET", "/api/v1/execution/stub-1/results")]
+    assert sleeps == [1.0, 2.0, 4.0]
+
+def test_second_identical_request_never_reaches_the_server(stub):
+    client = make_client(stub, Sleeps())
+
+    async def fetch_twice():
+        first = await client.fetch_rows()
+        sent = len(stub.requests)
+        second = await client.fetch_rows()
+        return first, second, sent
+
+    first, second, sent = asyncio.run(fetch_twice())
+    assert first == second == ROWS
+    assert len(stub.requests) == sent
+
+def test_new_client_reuses_the_fresh_latest_result(stub):
+    asyncio.run(make_client(stub, Sleeps()).fetch_rows())
+    sent = len(stub.requests)
+    assert asyncio.run(make_client(stub, Sleeps()).fetch_rows()) == ROWS
+    assert stub.requests[sent:] == [LATEST]
+
+def test_stale_result_is_executed_again(stub):
+    client = make_client(stub, Sleeps(), max_age=0)
+    asyncio.run(client.fetch_rows())
+    sent = len(stub.requests)
+    asyncio.run(client.fetch_rows())
+    assert stub.requests[sent:sent + 2] == [LATEST, EXECUTE]
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_rate_limits_and_server_errors_are_retried_with_backoff(stub, status):
+    stub.pending_polls = 0
+    stub.failures = [status] * 3
+    sleeps = Sleeps()
+    assert asyncio.run(make_client(stub, sleeps).fetch_rows()) == ROWS
+    # The failed attempts at the latest result are retried before the query is executed
+    assert stub.requests[:5] == [LATEST] * 4 + [EXECUTE]
+    assert sleeps == [1.0, 2.0, 4.0]
+
+def test_retry_after_sets_the_wait(stub):
+    stub.pending_polls = 0
+    stub.failures = [429]
+    stub.retry_after = 7
+    sleeps = Sleeps()
+    asyncio.run(make_client(stub, sleeps).fetch_rows())
+    assert sleeps == [7.0]
+
+def test_retries_give_up_after_request_retries(stub):
+    stub.failures = [503] * (dune.REQUEST_RETRIES + 1)
+    sleeps = Sleeps()
+    with pytest.raises(dune.DuneRetryableError):
+        asyncio.run(make_client(stub, sleeps).request("GET", f"/query/{QUERY_ID}/results"))
+    assert len(stub.requests) == dune.REQUEST_RETRIES + 1
+    assert len(sleeps) == dune.REQUEST_RETRIES
+
+def test_client_errors_are_not_retried(stub):
+    sleeps = Sleeps()
+    client = dune.AsyncDuneClient("wrong-key", base_url=stub.url, sleep=sleeps)
+    with pytest.raises(dune.DuneError):
+        asyncio.run(client.fetch_rows())
+    assert stub.requests == [LATEST, EXECUTE]
+    assert sleeps == []
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+import Crypto_Data_Engine as engine
+
+WALLET = "0x" + "ab" * 20
+DAY_TRADES = [
+    (WALLET, "USDC", "WETH", 100.0, "04/10/2024 23:59"),
+    (WALLET, "USDC", "WETH", 200.0, "05/10/2024 00:00"),
+    (WALLET, "USDC", "WETH", 300.0, "05/10/2024 14:30"),
+    (WALLET, "USDC", "WETH", 400.0, "05/10/2024 23:59"),
+    (WALLET, "USDC", "WETH", 500.0, "06/10/2024 00:00"),
+]
+
+# Returns the values of the trades a timestamp filter keeps, in time order
+def filtered_values(trades, filter_text):
+    view, sort_col, ascending, num_results, clauses = engine.parse_query("timestamp ASC", engine.MAX_RESULTS, filter_text)
+    return trades.query(view, sort_col, ascending, num_results, clauses)["trade_value_usd"].tolist()
+
+def test_date_without_time_ends_at_the_end_of_that_day():
+    (_, _, (low, high)), = engine.parse_filter("timestamp=2024-10-05")[0]
+    assert low == np.datetime64("2024-10-05T00:00")
+    assert np.datetime64("2024-10-05T23:59:59") < high < np.datetime64("2024-10-06T00:00")
+
+def test_date_with_time_is_exact():
+    (_, _, (low, high)), = engine.parse_filter("timestamp=..05/10/2024 14:30")[0]
+    assert low is None
+    assert high == np.datetime64("2024-10-05T14:30")
+
+def test_result_count_is_capped_unless_the_caller_allows_more():
+    with pytest.raises(ValueError):
+        engine.parse_query("timestamp ASC", engine.MAX_RESULTS + 1)
+    assert engine.parse_query("timestamp ASC", engine.MAX_RESULTS + 1, max_results=10 * engine.MAX_RESULTS)[3] == engine.MAX_RESULTS + 1
+
+@pytest.mark.parametrize("source", ["csv", "sqlite"])
+@pytest.mark.parametrize("filter_text, expected", [
+    ("timestamp=2024-10-05", [200.0, 300.0, 400.0]),
+    ("timestamp=05/10/2024", [200.0, 300.0, 400.0]),
+    ("timestamp=..2024-10-05", [100.0, 200.0, 300.0, 400.0]),
+    ("timestamp=2024-10-05..", [200.0, 300.0, 400.0, 500.0]),
+    ("timestamp=..05/10/2024 14:30", [100.0, 200.0, 300.0]),
+])
+def test_date_filters_cover_whole_days(write_trades, source, filter_text, expected):
+    trades = engine.TradeEngine(source, write_trades(DAY_TRADES)).load()
+    assert filtered_values(trades, filter_text) == expected
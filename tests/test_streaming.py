@@ -0,0 +1,60 @@
+import tracemalloc
+
+import pandas as pd
+import pytest
+
+import Crypto_Data_Benchmark as benchmark
+import Crypto_Data_Engine as engine
+
+# Streams in chunks far smaller than the files, so every file is read in many chunks. The generator shuffles each
+# swap's legs within GENERATOR_CHUNK_ROWS rows, so a window of twice that pairs every leg while keeping the carry small
+CHUNK_ROWS = 2_000
+GENERATOR_CHUNK_ROWS = 5_000
+SMALL_ROWS = 20_000
+LARGE_ROWS = 4 * SMALL_ROWS
+# Asks for more results than the aggregates keep, as the virtualized table can
+RESULT_COUNT = 500
+
+@pytest.fixture(autouse=True)
+def small_window(monkeypatch):
+    monkeypatch.setattr(engine, "SWAP_LEG_WINDOW_ROWS", 2 * GENERATOR_CHUNK_ROWS)
+
+@pytest.fixture(scope="module")
+def trade_files(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("streaming")
+    return {rows: benchmark.generate_trades_csv(str(folder / f"trades_{rows}.csv"), rows, chunk_rows=GENERATOR_CHUNK_ROWS)
+            for rows in (SMALL_ROWS, LARGE_ROWS)}
+
+# Returns the peak memory Python allocations reached while running a function, in bytes
+def traced_peak(function, *args, **kwargs):
+    tracemalloc.start()
+    try:
+        function(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def test_chunks_match_the_loaded_trades(trade_files):
+    path = trade_files[SMALL_ROWS]
+    streamed = pd.concat(list(engine.read_trade_chunks(path, CHUNK_ROWS)))
+    loaded = engine.TradeEngine("csv", path).load().df
+    assert streamed.index.equals(loaded.index)
+    assert streamed[engine.DATA_COLUMNS].astype(object).equals(loaded[engine.DATA_COLUMNS].astype(object))
+
+@pytest.mark.parametrize("choice", engine.SORT_CHOICES)
+def test_stream_query_matches_the_loaded_engine(trade_files, choice):
+    path = trade_files[SMALL_ROWS]
+    _, sort_col, ascending, num_results, _ = engine.parse_query(choice, RESULT_COUNT, max_results=RESULT_COUNT)
+    top, key_tx = engine.stream_query(path, sort_col, ascending, num_results, chunk_rows=CHUNK_ROWS)
+    trades = engine.TradeEngine("csv", path).load()
+    expected = trades.query("trades", sort_col, ascending, num_results)
+    assert top.index.equals(expected.index)
+    assert top[engine.DATA_COLUMNS].astype(object).equals(expected[engine.DATA_COLUMNS].astype(object))
+    assert key_tx.index.equals(trades.key_transaction().index)
+
+def test_stream_query_memory_stays_flat_as_the_file_grows(trade_files):
+    small, large = (traced_peak(engine.stream_query, trade_files[rows], "trade_value_usd", False, engine.AGGREGATE_TOP_N,
+                                chunk_rows=CHUNK_ROWS) for rows in (SMALL_ROWS, LARGE_ROWS))
+    loaded = traced_peak(lambda: engine.TradeEngine("csv", trade_files[LARGE_ROWS]).load())
+    assert large < 1.5 * small
+    assert large < loaded / 4